@@ -32,10 +32,15 @@ import aqt
 
 from . import conversion as to, gui, paths, service
 from .bundle import Bundle
+from .catalog import Catalog, DuePolicy
+from .failures import Failures
 from .config import Config
+from .headless import CONFIG_COLS, VERSION, WEB, get_platform_info
 from .player import Player
 from .router import Router
-from .text import Sanitizer
+from .text import (RULES_FROM_NOTE, RULES_FROM_TEMPLATE_BACK,
+                   RULES_FROM_TEMPLATE_FRONT, RULES_FROM_UNKNOWN,
+                   RULES_FROM_USER, Sanitizer)
 from .updates import Updates
 
 __all__ = ['browser_menus', 'cards_button', 'config_menu', 'editor_button',
@@ -43,38 +48,6 @@ __all__ = ['browser_menus', 'cards_button', 'config_menu', 'editor_button',
            'window_shortcuts']
 
 
-def get_platform_info():
-    """Exception-tolerant platform information for use with AGENT."""
-
-    implementation = system_description = "???"
-    python_version = "?.?.?"
-
-    try:
-        import platform
-    except:  # catch-all, pylint:disable=bare-except
-        pass
-    else:
-        try:
-            implementation = platform.python_implementation()
-        except:  # catch-all, pylint:disable=bare-except
-            pass
-
-        try:
-            python_version = platform.python_version()
-        except:  # catch-all, pylint:disable=bare-except
-            pass
-
-        try:
-            system_description = platform.platform().replace('-', ' ')
-        except:  # catch-all, pylint:disable=bare-except
-            pass
-
-    return "%s %s; %s" % (implementation, python_version, system_description)
-
-VERSION = '1.11.0-dev'
-
-WEB = 'https://ankiatts.appspot.com'
-
 AGENT = 'AwesomeTTS/%s (Anki %s; PyQt %s; %s)' % (VERSION, anki.version,
                                                   PYQT_VERSION_STR,
                                                   get_platform_info())
@@ -96,7 +69,7 @@ config = Config(
     db=Bundle(path=paths.CONFIG,
               table='general',
               normalize=to.normalized_ascii),
-    cols=[
+    cols=CONFIG_COLS + [
         ('automaticAnswers', 'integer', True, to.lax_bool, int),
         ('automatic_answers_errors', 'integer', True, to.lax_bool, int),
         ('automaticQuestions', 'integer', True, to.lax_bool, int),
@@ -108,14 +81,10 @@ config = Config(
         ('delay_questions_onthefly', 'integer', 0, int, int),
         ('delay_questions_stored_ours', 'integer', 0, int, int),
         ('delay_questions_stored_theirs', 'integer', 0, int, int),
-        ('ellip_note_newlines', 'integer', False, to.lax_bool, int),
         ('ellip_template_newlines', 'integer', False, to.lax_bool, int),
-        ('extras', 'text', {}, to.deserialized_dict, to.compact_json),
         ('filenames', 'text', 'hash', str, str),
         ('filenames_human', 'text',
          u'{{text}} ({{service}} {{voice}})', unicode, unicode),
-        ('groups', 'text', {}, to.deserialized_dict, to.compact_json),
-        ('lame_flags', 'text', '--quiet -q 2', str, str),
         ('last_mass_append', 'integer', True, to.lax_bool, int),
         ('last_mass_behavior', 'integer', True, to.lax_bool, int),
         ('last_mass_dest', 'text', 'Back', unicode, unicode),
@@ -136,25 +105,19 @@ config = Config(
         ('launch_templater', 'integer', Qt.ControlModifier | Qt.Key_T,
          to.nullable_key, to.nullable_int),
         ('otf_only_revealed_cloze', 'integer', False, to.lax_bool, int),
+        ('otf_progressive', 'integer', False, to.lax_bool, int),
         ('otf_remove_hints', 'integer', False, to.lax_bool, int),
-        ('presets', 'text', {}, to.deserialized_dict, to.compact_json),
-        ('spec_note_count', 'text', '', unicode, unicode),
-        ('spec_note_count_wrap', 'integer', True, to.lax_bool, int),
-        ('spec_note_ellipsize', 'text', '', unicode, unicode),
-        ('spec_note_strip', 'text', '', unicode, unicode),
+        ('prefetch_cards', 'integer', 0, int, int),
+        ('prefetch_concurrency', 'integer', 2, int, int),
+        ('speculative_answers', 'integer', False, to.lax_bool, int),
         ('spec_template_count', 'text', '', unicode, unicode),
         ('spec_template_count_wrap', 'integer', True, to.lax_bool, int),
         ('spec_template_ellipsize', 'text', '', unicode, unicode),
         ('spec_template_strip', 'text', '', unicode, unicode),
-        ('strip_note_braces', 'integer', False, to.lax_bool, int),
-        ('strip_note_brackets', 'integer', False, to.lax_bool, int),
-        ('strip_note_parens', 'integer', False, to.lax_bool, int),
         ('strip_template_braces', 'integer', False, to.lax_bool, int),
         ('strip_template_brackets', 'integer', False, to.lax_bool, int),
         ('strip_template_parens', 'integer', False, to.lax_bool, int),
-        ('sub_note_cloze', 'text', 'anki', str, str),
         ('sub_template_cloze', 'text', 'anki', str, str),
-        ('sul_note', 'text', [], to.substitution_list, to.substitution_json),
         ('sul_template', 'text', [], to.substitution_list,
          to.substitution_json),
         ('templater_cloze', 'integer', True, to.lax_bool, int),
@@ -174,6 +137,13 @@ config = Config(
     ],
 )
 
+catalog = Catalog(
+    db=Bundle(path=paths.CONFIG,
+              table='cache'),
+    cache_dir=paths.CACHE,
+    logger=logger,
+)
+
 player = Player(
     anki=Bundle(
         mw=aqt.mw,
@@ -187,47 +157,9 @@ player = Player(
 
 router = Router(
     services=Bundle(
-        mappings=[
-            ('abair', service.Abair),
-            ('ariana', service.Ariana),
-            ('baidu', service.Baidu),
-            ('collins', service.Collins),
-            ('duden', service.Duden),
-            ('ekho', service.Ekho),
-            ('espeak', service.ESpeak),
-            ('festival', service.Festival),
-            ('fluencynl', service.FluencyNl),
-            ('google', service.Google),
-            ('howjsay', service.Howjsay),
-            ('imtranslator', service.ImTranslator),
-            ('ispeech', service.ISpeech),
-            ('naver', service.Naver),
-            ('neospeech', service.NeoSpeech),
-            ('oddcast', service.Oddcast),
-            ('oxford', service.Oxford),
-            ('pico2wave', service.Pico2Wave),
-            ('rhvoice', service.RHVoice),
-            ('sapi5js', service.SAPI5JS),
-            ('say', service.Say),
-            ('spanishdict', service.SpanishDict),
-            ('voicetext', service.VoiceText),
-            ('wiktionary', service.Wiktionary),
-            ('yandex', service.Yandex),
-            ('youdao', service.Youdao),
-        ],
-        dead=dict(
-            ttsapicom="TTS-API.com has gone offline and can no longer be "
-                      "used. Please switch to another service with English.",
-        ),
-        aliases=[('b', 'baidu'), ('g', 'google'), ('macosx', 'say'),
-                 ('microsoft', 'sapi5js'), ('microsoftjs', 'sapi5js'),
-                 ('microsoftjscript', 'sapi5js'), ('oed', 'oxford'),
-                 ('osx', 'say'), ('sapi', 'sapi5js'), ('sapi5', 'sapi5js'),
-                 ('sapi5jscript', 'sapi5js'), ('sapijs', 'sapi5js'),
-                 ('sapijscript', 'sapi5js'), ('svox', 'pico2wave'),
-                 ('svoxpico', 'pico2wave'), ('ttsapi', 'ttsapicom'),
-                 ('windows', 'sapi5js'), ('windowsjs', 'sapi5js'),
-                 ('windowsjscript', 'sapi5js'), ('y', 'yandex')],
+        mappings=service.MAPPINGS,
+        dead=service.DEAD,
+        aliases=service.ALIASES,
         normalize=to.normalized_ascii,
         args=(),
         kwargs=dict(temp_dir=paths.TEMP,
@@ -237,11 +169,32 @@ router = Router(
                     ecosystem=Bundle(web=WEB, agent=AGENT)),
     ),
     cache_dir=paths.CACHE,
-    temp_dir=join(paths.TEMP, '_awesometts_scratch_' + str(int(time()))),
+    catalog=catalog,
+    failures=Failures(
+        db=Bundle(path=paths.CONFIG,
+                  table='failures'),
+        logger=logger,
+    ),
+    temp_dir=join(paths.SCRATCH, str(int(time()))),
     logger=logger,
     config=config,
+    executor=gui.QtExecutor,
+    policies=dict(
+        due=DuePolicy(get_days=lambda card_ids: gui.get_days_until_due(
+            aqt.mw.col, card_ids)),
+    ),
 )
 
+# n.b. This is not an optional component (see AwesomeTTS.py) because the
+# router's worker threads must never outlive the profile that started them.
+
+anki.hooks.addHook('unloadProfile', router.shutdown)
+
+# n.b. Older versions kept every cached file at the top of the cache
+# directory; move any such files into place in the background.
+
+anki.hooks.addHook('profileLoaded', router.migrate_cache)
+
 updates = Updates(
     agent=AGENT,
     endpoint='%s/api/update/%s-%s-%s' % (WEB, anki.version, sys.platform,
@@ -249,21 +202,6 @@ updates = Updates(
     logger=logger,
 )
 
-STRIP_TEMPLATE_POSTHTML = [
-    'whitespace',
-    'sounds_univ',
-    'filenames',
-    ('within_parens', 'strip_template_parens'),
-    ('within_brackets', 'strip_template_brackets'),
-    ('within_braces', 'strip_template_braces'),
-    ('char_remove', 'spec_template_strip'),
-    ('counter', 'spec_template_count', 'spec_template_count_wrap'),
-    ('char_ellipsize', 'spec_template_ellipsize'),
-    ('custom_sub', 'sul_template'),
-    'ellipses',
-    'whitespace',
-]
-
 addon = Bundle(
     config=config,
     downloader=Bundle(
@@ -285,84 +223,15 @@ addon = Bundle(
     player=player,
     router=router,
     strip=Bundle(
-        # n.b. cloze substitution logic happens first in both modes because:
-        # - we need the <span>...</span> markup in on-the-fly to identify it
-        # - Anki won't recognize cloze w/ HTML beginning/ending within braces
-        # - the following 'html' rule will cleanse the HTML out anyway
-
-        # for content directly from a note field (e.g. BrowserGenerator runs,
-        # prepopulating a modal input based on some note field, where cloze
-        # placeholders are still in their unprocessed state)
-        from_note=Sanitizer([
-            ('clozes_braced', 'sub_note_cloze'),
-            ('newline_ellipsize', 'ellip_note_newlines'),
-            'html',
-            'whitespace',
-            'sounds_univ',
-            'filenames',
-            ('within_parens', 'strip_note_parens'),
-            ('within_brackets', 'strip_note_brackets'),
-            ('within_braces', 'strip_note_braces'),
-            ('char_remove', 'spec_note_strip'),
-            ('counter', 'spec_note_count', 'spec_note_count_wrap'),
-            ('char_ellipsize', 'spec_note_ellipsize'),
-            ('custom_sub', 'sul_note'),
-            'ellipses',
-            'whitespace',
-        ], config=config, logger=logger),
-
-        # for cleaning up already-processed HTML templates (e.g. on-the-fly,
-        # where cloze is marked with <span class=cloze></span> tags)
-        from_template_front=Sanitizer([
-            ('clozes_rendered', 'sub_template_cloze'),
-            'hint_links',
-            ('hint_content', 'otf_remove_hints'),
-            ('newline_ellipsize', 'ellip_template_newlines'),
-            'html',
-        ] + STRIP_TEMPLATE_POSTHTML, config=config, logger=logger),
-
-        # like the previous, but for the back sides of cards
-        from_template_back=Sanitizer([
-            ('clozes_revealed', 'otf_only_revealed_cloze'),
-            'hint_links',
-            ('hint_content', 'otf_remove_hints'),
-            ('newline_ellipsize', 'ellip_template_newlines'),
-            'html',
-        ] + STRIP_TEMPLATE_POSTHTML, config=config, logger=logger),
-
-        # for cleaning up text from unknown sources (e.g. system clipboard);
-        # n.b. clozes_revealed is not used here without the card context and
-        # it would be a weird thing to apply to the clipboard content anyway
-        from_unknown=Sanitizer([
-            ('clozes_braced', 'sub_note_cloze'),
-            ('clozes_rendered', 'sub_template_cloze'),
-            'hint_links',
-            ('hint_content', 'otf_remove_hints'),
-            ('newline_ellipsize', 'ellip_note_newlines'),
-            ('newline_ellipsize', 'ellip_template_newlines'),
-            'html',
-            'html',  # clipboards often have escaped HTML, so we run twice
-            'whitespace',
-            'sounds_univ',
-            'filenames',
-            ('within_parens', ['strip_note_parens', 'strip_template_parens']),
-            ('within_brackets', ['strip_note_brackets',
-                                 'strip_template_brackets']),
-            ('within_braces', ['strip_note_braces', 'strip_template_braces']),
-            ('char_remove', 'spec_note_strip'),
-            ('char_remove', 'spec_template_strip'),
-            ('counter', 'spec_note_count', 'spec_note_count_wrap'),
-            ('counter', 'spec_template_count', 'spec_template_count_wrap'),
-            ('char_ellipsize', 'spec_note_ellipsize'),
-            ('char_ellipsize', 'spec_template_ellipsize'),
-            ('custom_sub', 'sul_note'),
-            ('custom_sub', 'sul_template'),
-            'ellipses',
-            'whitespace',
-        ], config=config, logger=logger),
-
-        # for direct user input (e.g. previews, EditorGenerator insertion)
-        from_user=Sanitizer(rules=['ellipses', 'whitespace'], logger=logger),
+        # see the text module for the rule chains and where each is used
+        from_note=Sanitizer(RULES_FROM_NOTE, config=config, logger=logger),
+        from_template_front=Sanitizer(RULES_FROM_TEMPLATE_FRONT,
+                                      config=config, logger=logger),
+        from_template_back=Sanitizer(RULES_FROM_TEMPLATE_BACK,
+                                     config=config, logger=logger),
+        from_unknown=Sanitizer(RULES_FROM_UNKNOWN, config=config,
+                               logger=logger),
+        from_user=Sanitizer(rules=RULES_FROM_USER, logger=logger),
 
         # target sounds specifically
         sounds=Bundle(
@@ -397,8 +266,9 @@ addon = Bundle(
 
 def browser_menus():
     """
-    Gives user access to mass generator, MP3 stripper, and the hook that
-    disables and enables it upon selection of items.
+    Gives user access to mass generator, MP3 stripper, on-the-fly cache
+    warmer, and the hook that disables and enables them upon selection
+    of items.
     """
 
     from PyQt4 import QtGui
@@ -436,6 +306,19 @@ def browser_menus():
             sequence=sequences['browser_stripper'],
             parent=menu,
         )
+        gui.Action(
+            target=Bundle(
+                constructor=gui.BrowserWarmer,
+                args=(),
+                kwargs=dict(browser=browser,
+                            addon=addon,
+                            alerts=aqt.utils.showWarning,
+                            parent=browser),
+            ),
+            text="&Prepare On-the-Fly Audio for Selected...",
+            sequence=gui.Action.NO_SEQUENCE,
+            parent=menu,
+        )
 
     def update_title_wrapper(browser):
         """Enable/disable AwesomeTTS menu items upon selection."""
@@ -461,37 +344,19 @@ def cache_control():
 
     def on_unload_profile():
         """
-        Finds MP3s in the cache directory older than the user's
+        Looks up MP3s in the cache catalog older than the user's
         configured cache limit and attempts to remove them.
         """
 
-        from os import listdir, unlink
-
-        cache = paths.CACHE
-
         try:
-            filenames = listdir(cache)
+            if config['cache_days']:
+                limit = time() - 86400 * config['cache_days']
+                catalog.purge(catalog.paths(created_before=limit))
+            else:
+                catalog.purge(catalog.paths())
+            catalog.flush()
         except:  # allow silent failure, pylint:disable=bare-except
-            return
-        if not filenames:
-            return
-
-        prospects = (join(cache, filename) for filename in filenames)
-
-        if config['cache_days']:
-            from os.path import getmtime
-
-            limit = time() - 86400 * config['cache_days']
-            targets = (prospect for prospect in prospects
-                       if getmtime(prospect) < limit)
-        else:
-            targets = prospects
-
-        for target in targets:
-            try:
-                unlink(target)
-            except:  # skip broken files, pylint:disable=bare-except
-                pass
+            pass
 
     anki.hooks.addHook('unloadProfile', on_unload_profile)
 
@@ -619,6 +484,13 @@ def reviewer_hooks():
         lambda: reviewer.card_handler('answer', aqt.mw.reviewer.card),
     )
 
+    # preparing audio for upcoming cards
+
+    anki.hooks.addHook(
+        'showQuestion',
+        lambda: reviewer.prefetch_handler(aqt.mw.reviewer.card),
+    )
+
     # shortcut-triggered playback
 
     reviewer_filter = gui.Filter(
@@ -783,20 +655,23 @@ def temp_files():
 
     def on_unload_profile():
         """
-        Finds scratch directories in the temporary path, removes their
-        files, then removes the directories themselves.
+        Finds scratch directories (and any left in the temporary path by
+        older versions), removes their files, then removes the
+        directories themselves.
         """
 
         from os import listdir, unlink, rmdir
         from os.path import isdir
 
-        temp = paths.TEMP
-
-        try:
-            subdirs = [join(temp, filename) for filename in listdir(temp)
-                       if filename.startswith('_awesometts_scratch')]
-        except:  # allow silent failure, pylint:disable=bare-except
-            return
+        subdirs = []
+        for parent, prefix in [(paths.SCRATCH, ''),
+                               (paths.TEMP, '_awesometts_scratch')]:
+            try:
+                subdirs.extend(join(parent, filename)
+                               for filename in listdir(parent)
+                               if filename.startswith(prefix))
+            except:  # allow silent failure, pylint:disable=bare-except
+                pass
         if not subdirs:
             return
 
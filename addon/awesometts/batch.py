@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Batch generation of clips from a CSV/TSV file, outside of Anki
+
+Each row of the input has a `text` column and says how it should be
+spoken with one of a `service` column (plus any other columns, which
+are passed as that service's options, e.g. `voice`), a `preset`
+column, or a `group` column, naming presets and groups as configured
+in the add-on. Defaults for these may be given on the command line.
+
+Clips go into the router's cache as usual, and a manifest is written
+as the rows finish. Rerunning with the same manifest skips every row
+that has already been generated successfully.
+"""
+
+import argparse
+import csv
+from functools import partial
+from hashlib import sha1
+import json
+import logging
+import os
+import os.path
+from Queue import Empty, Queue
+import sys
+from time import time
+
+from . import headless, paths
+from .executors import ThreadExecutor
+
+__all__ = ['main']
+
+
+MANIFEST_COLS = ['key', 'row', 'text', 'service', 'preset', 'group',
+                 'status', 'path', 'bytes', 'seconds', 'error']
+
+REQUEST_COLS = ['text', 'service', 'preset', 'group']
+
+WINDOW_PER_WORKER = 4  # rows submitted ahead for every slot in the pool
+
+
+def main(argv):
+    """
+    Runs the batch described by the given command-line arguments,
+    returning 0 if every row is available in the cache afterward or 1
+    if there were failures.
+    """
+
+    args = _get_parser().parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr,
+                        level=logging.DEBUG if args.verbose
+                        else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('awesometts')
+
+    overrides = {}
+    if args.parallel:
+        overrides['pool_size'] = args.parallel
+    rates = headless.parse_svc_values(args.rate, float)
+
+    tts = headless.build(
+        logger=logger,
+        config_path=args.config,
+        cache_dir=args.cache,
+        executor=partial(ThreadExecutor,
+                         interval=lambda svc_id: (1.0 / rates[svc_id]
+                                                  if rates.get(svc_id)
+                                                  else None)),
+        overrides=overrides,
+    )
+
+    if args.limit:
+        tts.config['concurrency'] = dict(tts.config['concurrency'],
+                                         **headless.parse_svc_values(
+                                             args.limit, int))
+
+    manifest = args.manifest or os.path.splitext(args.input)[0] + \
+        '.manifest.csv'
+    delimiter = args.delimiter or ('\t' if args.input.lower().endswith(
+        ('.tsv', '.tab')) else ',')
+
+    with open(args.input, 'rb') as stream:
+        rows = list(csv.DictReader(stream, delimiter=delimiter))
+
+    completed = _read_manifest(manifest)
+    strip = tts.strip.from_user if args.raw else tts.strip.from_note
+    defaults = dict(service=args.service, preset=args.preset,
+                    group=args.group)
+
+    requests = []
+    skipped = 0
+    for number, row in enumerate(rows, 1):
+        request = _get_request(number, row, defaults, strip)
+        if not request['text']:
+            continue
+        if request['key'] in completed:
+            skipped += 1
+            continue
+        requests.append(request)
+
+    logger.info("%d rows to generate, %d already done", len(requests),
+                skipped)
+
+    with open(manifest, 'ab') as stream:
+        writer = csv.writer(stream)
+        if not stream.tell():
+            writer.writerow(MANIFEST_COLS)
+
+        try:
+            counts = _run(tts, requests, writer, stream,
+                          window=max(tts.config['pool_size'], 1) *
+                          WINDOW_PER_WORKER,
+                          quiet=args.quiet)
+        finally:
+            tts.router.shutdown()
+            tts.catalog.flush()
+
+    if not args.quiet:
+        sys.stderr.write("\n%d generated, %d from cache, %d failed, %d "
+                         "skipped as already done; manifest in %s\n" %
+                         (counts['okay'] - counts['hits'], counts['hits'],
+                          counts['fail'], skipped, manifest))
+
+    return 1 if counts['fail'] or counts['aborted'] else 0
+
+
+def _get_parser():
+    """Returns the argument parser for the command line."""
+
+    parser = argparse.ArgumentParser(
+        prog='batch.py',
+        description="Generates AwesomeTTS clips for every row of a CSV or "
+                    "TSV file into the cache, writing a manifest.",
+    )
+
+    parser.add_argument('input',
+                        help="CSV or TSV file with a header row and a "
+                             "'text' column")
+    parser.add_argument('-m', '--manifest',
+                        help="where to write (and resume) the manifest; "
+                             "defaults to alongside the input")
+    parser.add_argument('-d', '--delimiter',
+                        help="input delimiter; defaults to tab for .tsv "
+                             "and .tab files, and comma otherwise")
+
+    parser.add_argument('-s', '--service',
+                        help="service for rows without their own")
+    parser.add_argument('-p', '--preset',
+                        help="preset for rows without their own")
+    parser.add_argument('-g', '--group',
+                        help="group for rows without their own")
+    parser.add_argument('--raw', action='store_true',
+                        help="only collapse whitespace and ellipses rather "
+                             "than applying the note field text handling")
+
+    parser.add_argument('-j', '--parallel', type=int, metavar='N',
+                        help="how many service calls to run at once; "
+                             "defaults to the add-on's setting")
+    parser.add_argument('-l', '--limit', action='append', default=[],
+                        metavar='SVC=N',
+                        help="at most N calls at once for the service "
+                             "(may be repeated)")
+    parser.add_argument('-r', '--rate', action='append', default=[],
+                        metavar='SVC=N',
+                        help="at most N calls per second for the service, "
+                             "e.g. 0.5 for one every two seconds (may be "
+                             "repeated)")
+
+    parser.add_argument('--config', default=paths.CONFIG,
+                        help="configuration database to read presets, "
+                             "groups, and text handling from; defaults to "
+                             "the add-on's")
+    parser.add_argument('--cache', default=paths.CACHE,
+                        help="cache directory; defaults to the add-on's "
+                             "(use a different --config with this)")
+
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="do not show progress")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="log debugging output")
+
+    return parser
+
+
+def _read_manifest(path):
+    """
+    Returns the set of request keys whose last entry in the manifest
+    at the given path succeeded and whose file is still there.
+    """
+
+    if not os.path.exists(path):
+        return set()
+
+    last = {}
+    with open(path, 'rb') as stream:
+        for entry in csv.DictReader(stream):
+            last[entry['key']] = entry
+
+    return {
+        key
+        for key, entry in last.items()
+        if entry['status'] == 'okay' and os.path.exists(entry['path'])
+    }
+
+
+def _get_request(number, row, defaults, strip):
+    """
+    Returns a request dict for the given input row, with its sanitized
+    text, how it should be spoken, service options, and a key that
+    identifies the request across runs.
+    """
+
+    row = {
+        (name or '').strip().lower(): (value or '').decode('utf-8').strip()
+        for name, value in row.items()
+    }
+
+    request = {'row': number, 'text': strip(row.get('text', u''))}
+    for name in ['service', 'preset', 'group']:
+        request[name] = row.get(name) or defaults[name] or ''
+    request['options'] = {
+        name: value
+        for name, value in row.items()
+        if name not in REQUEST_COLS and value
+    }
+
+    request['key'] = sha1(json.dumps(
+        [request[name] for name in REQUEST_COLS] + [request['options']],
+        sort_keys=True,
+    )).hexdigest()
+
+    return request
+
+
+def _run(tts, requests, writer, stream, window, quiet):
+    """
+    Submits the requests to the router, keeping up to `window` of them
+    outstanding, and writes a manifest row as each one finishes. The
+    callbacks may run on the executor's threads, so they only ever put
+    results onto a queue for this thread to handle.
+    """
+
+    results = Queue()
+    counts = dict(okay=0, fail=0, hits=0, aborted=False)
+    total = len(requests)
+    pending = list(reversed(requests))
+    outstanding = 0
+    shown = 0
+
+    while pending or outstanding:
+        try:
+            while pending and outstanding < window and not counts['aborted']:
+                _submit(tts, pending.pop(), results)
+                outstanding += 1
+
+            try:
+                request, path, error, missed = results.get(timeout=1)
+            except Empty:
+                continue
+
+        except KeyboardInterrupt:
+            if counts['aborted']:
+                raise
+            counts['aborted'] = True
+            pending = []
+            sys.stderr.write("\nStopping after %d outstanding row(s); press "
+                             "Ctrl+C again to quit now\n" % outstanding)
+            continue
+
+        outstanding -= 1
+        if error is None:
+            counts['okay'] += 1
+            if not missed:
+                counts['hits'] += 1
+        else:
+            counts['fail'] += 1
+
+        writer.writerow([
+            request['key'],
+            request['row'],
+            request['text'].encode('utf-8'),
+            request['service'].encode('utf-8'),
+            request['preset'].encode('utf-8'),
+            request['group'].encode('utf-8'),
+            'okay' if error is None else 'fail',
+            path.encode('utf-8') if path else '',
+            os.path.getsize(path) if path else '',
+            '%.3f' % (time() - request['started']),
+            error.encode('utf-8') if error else '',
+        ])
+        stream.flush()
+
+        if not quiet and (time() - shown >= 1 or not outstanding):
+            shown = time()
+            sys.stderr.write("\r%d of %d rows finished, %d failed " %
+                             (counts['okay'] + counts['fail'], total,
+                              counts['fail']))
+
+    return counts
+
+
+def _submit(tts, request, results):
+    """
+    Sends one request to the router at bulk priority, arranging for
+    its outcome to be put onto the results queue.
+    """
+
+    request['started'] = time()
+    missed = []
+
+    def okay(path):
+        """Queue the successful result."""
+
+        results.put((request, path, None, bool(missed)))
+
+    def fail(exception):
+        """Queue the failure with a one-line message."""
+
+        message = exception.message
+        if not isinstance(message, basestring) or not message:
+            message = format(exception) or type(exception).__name__
+        if isinstance(message, str):
+            message = message.decode('utf-8', 'replace')
+
+        results.put((request, None, u' '.join(message.split()),
+                     bool(missed)))
+
+    try:
+        headless.dispatch(tts, request,
+                          callbacks=dict(okay=okay, fail=fail,
+                                         miss=lambda svc_id, count:
+                                         missed.append(svc_id)),
+                          priority=tts.router.Priority.BULK)
+    except (KeyError, ValueError) as exception:
+        fail(exception)
@@ -0,0 +1,779 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Index of media files stored in the cache directory
+"""
+
+import os
+import os.path
+import re
+import sqlite3
+import sys
+from threading import RLock
+from time import time
+from uuid import uuid4
+
+__all__ = ['Catalog', 'DuePolicy']
+
+
+MP3_MIN_SIZE = 256  # smaller than any real clip, even a lone silent frame
+
+MP3_SYNC_WINDOW = 2**12  # how far past any ID3v2 tag to look for a frame
+
+RE_FRAME_SYNC = re.compile(r'\xff[\xe0-\xff]')
+
+STAGING_DIR = '.staging'  # subdirectory of the cache for unfinished files
+
+STAGING_STALE_SECS = 3600  # sweep unfinished files left for over an hour
+
+
+class Catalog(object):
+    """
+    Keeps a record of every file in the cache directory in a SQLite3
+    table, so that cache hit checks, statistics, and eviction can be
+    answered without listing or stat'ing the cache directory.
+
+    Each entry records the path of the file (relative to the cache
+    directory), the service that produced it, its size in bytes, when
+    it was created, and when it was last used.
+
+    Files may also be linked to the IDs of the cards that played them
+    (e.g. from on-the-fly <tts> tags), so that eviction can take into
+    account when those cards are due; see DuePolicy.
+
+    If the catalog drifts from the directory (e.g. the user deletes
+    files by hand), rebuild() will bring the two back in sync.
+
+    Files may be kept in subdirectories of the cache directory. Older
+    versions put every file at the top, and migrate() moves those into
+    the subdirectories where they now belong.
+
+    New files are written under a staging path first and only moved
+    into the cache directory by commit() once they check out, so an
+    interrupted service run never leaves a partial file at the path
+    of a cache hit.
+    """
+
+    # flush pending last-hit times and card links after this many or seconds
+    HIT_FLUSH_COUNT = 50
+    HIT_FLUSH_SECS = 60
+
+    __slots__ = [
+        '_connection',  # SQLite3 connection, opened upon first use
+        '_db',          # bundle with path to database and table name
+        '_dir',         # path to the cache directory being cataloged
+        '_flat',        # where migrate() resumes, None once fully migrated
+        '_hits',        # pending last-hit times not yet written to database
+        '_hits_when',   # when the pending last-hit times were last flushed
+        '_links',       # pending (path, card ID)s not yet written to database
+        '_lock',        # serializes access to the connection and hits
+        '_logger',      # logger-like interface with debug(), info(), etc.
+        '_size',        # running total of cataloged bytes, None until summed
+    ]
+
+    def __init__(self, db, cache_dir, logger):
+        """
+        The database specification should be a bundle, with:
+
+            - path: full path to database
+            - table: table name
+
+        The cache directory is the directory whose files this catalog
+        keeps track of.
+
+        If the table does not exist yet, it is created and immediately
+        populated from whatever is already in the cache directory.
+        """
+
+        self._connection = None
+        self._db = db
+        self._dir = cache_dir
+        self._flat = ''
+        self._hits = {}
+        self._hits_when = time()
+        self._links = set()
+        self._lock = RLock()
+        self._logger = logger
+        self._size = None
+
+        with self._lock:
+            cursor = self._cursor()
+            is_new = not cursor.execute('SELECT name FROM sqlite_master '
+                                        'WHERE type=? AND name=?',
+                                        ('table', db.table)).fetchall()
+
+            if is_new:
+                self._logger.info("Creating new cache catalog table")
+                cursor.execute('CREATE TABLE %s (path text PRIMARY KEY, '
+                               'service text, size integer, created real, '
+                               'hit real)' % db.table)
+                cursor.execute('CREATE INDEX %s_created ON %s (created)' %
+                               (db.table, db.table))
+
+            cursor.execute('CREATE INDEX IF NOT EXISTS %s_hit ON %s (hit)' %
+                           (db.table, db.table))
+            cursor.execute('CREATE TABLE IF NOT EXISTS %s_cards (path text, '
+                           'card integer, PRIMARY KEY (path, card))' %
+                           db.table)
+
+        if is_new:
+            self.rebuild()
+
+        self.sweep()
+
+    def _cursor(self):
+        """
+        Returns a cursor for the catalog, connecting to the database
+        if needed. Callers must hold the lock.
+        """
+
+        if not self._connection:
+            self._connection = sqlite3.connect(self._db.path,
+                                               isolation_level=None,
+                                               check_same_thread=False)
+        return self._connection.cursor()
+
+    def _relative(self, path):
+        """Returns the given cache path relative to the cache dir."""
+
+        return os.path.relpath(path, self._dir)
+
+    def _absolute(self, relative):
+        """Returns the full path of a cataloged relative path."""
+
+        return os.path.join(self._dir, relative)
+
+    def _size_of(self, relative):
+        """
+        Returns the cataloged size of the given relative path, or zero
+        if it is not cataloged. Callers must hold the lock.
+        """
+
+        row = self._cursor().execute(
+            'SELECT size FROM %s WHERE path=?' % self._db.table,
+            (relative,),
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _grow(self, delta):
+        """
+        Adjusts the running total by the given number of bytes, if one
+        is being kept. Callers must hold the lock.
+        """
+
+        if self._size is not None:
+            self._size += delta
+
+    def hit(self, path):
+        """
+        Returns True if the given path is cataloged, recording the use
+        of the file if so. Returns False otherwise.
+
+        If the file is still at the top of the cache directory, waiting
+        to be migrated, it is moved to the given path first.
+        """
+
+        relative = self._relative(path)
+
+        with self._lock:
+            if relative in self._hits:
+                found = True
+            else:
+                found = bool(self._cursor().execute(
+                    'SELECT 1 FROM %s WHERE path=?' % self._db.table,
+                    (relative,),
+                ).fetchone())
+
+                if not found and self._flat is not None:
+                    flat = os.path.basename(relative)
+                    found = flat != relative and self._move(flat, relative)
+
+            if found:
+                self._hits[relative] = time()
+                self._flush_if_due()
+
+        return found
+
+    def link(self, path, card_ids):
+        """
+        Records that the file at the given path is played by the cards
+        with the given IDs. The file need not be cataloged yet.
+        """
+
+        relative = self._relative(path)
+
+        with self._lock:
+            self._links.update((relative, card_id) for card_id in card_ids)
+            self._flush_if_due()
+
+    def linked_cards(self):
+        """Returns the set of card IDs linked to any cataloged file."""
+
+        with self._lock:
+            self.flush()
+            return set(row[0] for row in self._cursor().execute(
+                'SELECT DISTINCT card FROM %s_cards' % self._db.table,
+            ))
+
+    def add(self, path, svc_id):
+        """
+        Records a newly-written file at the given path from the given
+        service. The file must exist.
+        """
+
+        now = time()
+        size = os.path.getsize(path)
+        relative = self._relative(path)
+
+        with self._lock:
+            self._grow(size - self._size_of(relative))
+            self._cursor().execute(
+                'INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?)' %
+                self._db.table,
+                (relative, svc_id, size, now, now),
+            )
+
+    def staging(self, path):
+        """
+        Returns a new, unique path (in the staging subdirectory of the
+        cache directory, so it can be renamed across atomically) where
+        a service should write the file destined for the given path.
+        """
+
+        staging_dir = os.path.join(self._dir, STAGING_DIR)
+        _makedirs(staging_dir)
+
+        return os.path.join(staging_dir, '%s-%s' % (uuid4().hex[:12],
+                                                    os.path.basename(path)))
+
+    def commit(self, staging, path, svc_id):
+        """
+        Checks that the file at the staging path is a usable MP3 and,
+        if so, renames it into place at the given path and records it
+        as having come from the given service.
+
+        Otherwise, the staging file is deleted and a ValueError raised.
+        """
+
+        try:
+            _check_mp3(staging)
+        except (EnvironmentError, ValueError):
+            self.discard(staging)
+            raise
+
+        _makedirs(os.path.dirname(path))
+        if sys.platform.startswith('win') and os.path.exists(path):
+            os.unlink(path)  # rename on Windows cannot replace files
+        os.rename(staging, path)
+
+        self.add(path, svc_id)
+
+    def discard(self, staging):
+        """Deletes the file at the staging path, if there is one."""
+
+        try:
+            os.unlink(staging)
+        except OSError:
+            pass
+
+    def migrate(self, shard, count):
+        """
+        Moves up to `count` of the cataloged files still at the top of
+        the cache directory to where the shard callable says they go
+        (given a filename, it returns a path relative to the cache
+        directory, or None to leave the file where it is). Returns the
+        number of files looked at; callers wanting everything migrated
+        should call again for as long as a full `count` is returned.
+        """
+
+        with self._lock:
+            if self._flat is None:
+                return 0
+
+            flat = [row[0] for row in self._cursor().execute(
+                'SELECT path FROM %s WHERE path>? AND path NOT LIKE ? '
+                'ORDER BY path LIMIT ?' % self._db.table,
+                (self._flat, '%' + os.sep + '%', count),
+            )]
+
+        moved = 0
+        for relative in flat:
+            destination = shard(relative)
+            if destination:
+                with self._lock:
+                    moved += self._move(relative, destination)
+
+        with self._lock:
+            self._flat = flat[-1] if len(flat) >= count else None
+
+        if moved:
+            self._logger.info("Migrated %d file(s) in cache", moved)
+        return len(flat)
+
+    def _move(self, relative, destination):
+        """
+        Moves a cataloged file from one relative path to another (where
+        its file may already be, e.g. if generated again in the meantime)
+        and returns True, or returns False if there is no such file, in
+        which case the entry is dropped. Callers must hold the lock.
+        """
+
+        cursor = self._cursor()
+        if not cursor.execute('SELECT 1 FROM %s WHERE path=?' %
+                              self._db.table, (relative,)).fetchone():
+            return False
+
+        source = self._absolute(relative)
+        target = self._absolute(destination)
+
+        try:
+            if os.path.exists(target):
+                os.unlink(source)
+            else:
+                _makedirs(os.path.dirname(target))
+                os.rename(source, target)
+        except OSError as error:
+            if os.path.exists(source):
+                self._logger.warn("Cannot move %s in cache: %s", relative,
+                                  error)
+                return False
+
+        if not os.path.exists(target):
+            self._grow(-self._size_of(relative))
+            cursor.execute('DELETE FROM %s WHERE path=?' % self._db.table,
+                           (relative,))
+            cursor.execute('DELETE FROM %s_cards WHERE path=?' %
+                           self._db.table, (relative,))
+            self._hits.pop(relative, None)
+            return False
+
+        if destination != relative:
+            self._grow(-self._size_of(destination))
+        cursor.execute('UPDATE OR REPLACE %s SET path=? WHERE path=?' %
+                       self._db.table, (destination, relative))
+        cursor.execute('UPDATE OR IGNORE %s_cards SET path=? WHERE path=?' %
+                       self._db.table, (destination, relative))
+        cursor.execute('DELETE FROM %s_cards WHERE path=?' % self._db.table,
+                       (relative,))
+        if relative in self._hits:
+            self._hits[destination] = self._hits.pop(relative)
+        return True
+
+    def sweep(self):
+        """
+        Deletes files left in the staging subdirectory by service runs
+        that never finished (e.g. because Anki was killed), returning
+        the number deleted. Recent files are left alone, as they could
+        belong to another process sharing the cache (e.g. a batch run).
+        """
+
+        staging_dir = os.path.join(self._dir, STAGING_DIR)
+        try:
+            filenames = os.listdir(staging_dir)
+        except OSError:
+            return 0
+
+        limit = time() - STAGING_STALE_SECS
+        count = 0
+
+        for filename in filenames:
+            path = os.path.join(staging_dir, filename)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.unlink(path)
+                    count += 1
+            except OSError:
+                continue
+
+        if count:
+            self._logger.info("Swept %d unfinished file(s) from the cache",
+                              count)
+        return count
+
+    def flush(self):
+        """
+        Writes any pending last-hit times and card links out to the
+        database.
+        """
+
+        with self._lock:
+            if self._hits:
+                self._cursor().executemany(
+                    'UPDATE %s SET hit=? WHERE path=?' % self._db.table,
+                    [(when, relative)
+                     for relative, when in self._hits.items()],
+                )
+                self._logger.debug("Flushed %d cache hit time(s)",
+                                   len(self._hits))
+                self._hits = {}
+            if self._links:
+                self._cursor().executemany(
+                    'INSERT OR IGNORE INTO %s_cards VALUES (?, ?)' %
+                    self._db.table,
+                    list(self._links),
+                )
+                self._logger.debug("Flushed %d cache card link(s)",
+                                   len(self._links))
+                self._links = set()
+            self._hits_when = time()
+
+    def _flush_if_due(self):
+        """Flushes if enough is pending. Callers must hold the lock."""
+
+        if len(self._hits) + len(self._links) >= self.HIT_FLUSH_COUNT or \
+           time() - self._hits_when > self.HIT_FLUSH_SECS:
+            self.flush()
+
+    def stats(self):
+        """Returns the number of cataloged files and their total size."""
+
+        with self._lock:
+            count, size = self._cursor().execute(
+                'SELECT COUNT(*), TOTAL(size) FROM %s' % self._db.table,
+            ).fetchone()
+            self._size = int(size)
+
+        return count, int(size)
+
+    def size(self):
+        """
+        Returns the total size of the cataloged files from the running
+        total kept as files are added and dropped, so that it is cheap
+        enough to check after every new file. The table is only summed
+        the first time and again after a rebuild.
+        """
+
+        with self._lock:
+            if self._size is None:
+                self._size = int(self._cursor().execute(
+                    'SELECT TOTAL(size) FROM %s' % self._db.table,
+                ).fetchone()[0])
+            return self._size
+
+    def paths(self, created_before=None):
+        """
+        Returns the full paths of all cataloged files, or only those
+        created before the given timestamp if one is passed.
+        """
+
+        with self._lock:
+            if created_before is None:
+                rows = self._cursor().execute(
+                    'SELECT path FROM %s' % self._db.table,
+                )
+            else:
+                rows = self._cursor().execute(
+                    'SELECT path FROM %s WHERE created<?' % self._db.table,
+                    (created_before,),
+                )
+
+            return [self._absolute(row[0]) for row in rows]
+
+    def evict(self, budget, count, order=None):
+        """
+        While the cataloged files total more than `budget` bytes, deletes
+        up to `count` of the least recently used ones (i.e. by last hit,
+        or by creation for files never hit since) and returns the number
+        deleted. Callers wanting the cache fully under budget should call
+        again for as long as a full `count` gets deleted.
+
+        If given, the order callable is passed a list of (relative path,
+        size, last hit, set of linked card IDs) tuples for every file
+        and returns those that may be evicted, most expendable first
+        (e.g. from a DuePolicy), which is used instead of plain LRU.
+        """
+
+        with self._lock:
+            self.flush()
+            cursor = self._cursor()
+
+            # resyncs the running total, e.g. with a batch run's additions
+            self._size = int(cursor.execute(
+                'SELECT TOTAL(size) FROM %s' % self._db.table,
+            ).fetchone()[0])
+            excess = self._size - budget
+            if excess <= 0:
+                return 0
+
+            if order:
+                cards = {}
+                for relative, card_id in cursor.execute(
+                        'SELECT path, card FROM %s_cards' % self._db.table,
+                ):
+                    cards.setdefault(relative, set()).add(card_id)
+
+                candidates = [
+                    (relative, size, hit, cards.get(relative, set()))
+                    for relative, size, hit in cursor.execute(
+                        'SELECT path, size, hit FROM %s' % self._db.table,
+                    ).fetchall()
+                ]
+
+            else:
+                candidates = cursor.execute(
+                    'SELECT path, size FROM %s ORDER BY hit LIMIT ?' %
+                    self._db.table,
+                    (count,),
+                ).fetchall()
+
+        if order:
+            candidates = order(candidates)[:count]
+
+        paths = []
+        for candidate in candidates:
+            if excess <= 0:
+                break
+            paths.append(self._absolute(candidate[0]))
+            excess -= candidate[1]
+
+        count_success, _ = self.purge(paths)
+        self._logger.info("Evicted %d file(s) from cache", count_success)
+        return count_success
+
+    def purge(self, paths):
+        """
+        Deletes the files at the given paths and drops them from the
+        catalog, returning the number of files that were deleted and the
+        number that could not be deleted. A file that has already gone
+        missing counts as deleted.
+        """
+
+        count_success = count_error = 0
+        dropped = []
+
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                if os.path.exists(path):
+                    count_error += 1
+                    continue
+            count_success += 1
+            dropped.append((self._relative(path),))
+
+        with self._lock:
+            for (relative,) in dropped:
+                self._grow(-self._size_of(relative))
+            cursor = self._cursor()
+            cursor.executemany(
+                'DELETE FROM %s WHERE path=?' % self._db.table,
+                dropped,
+            )
+            cursor.executemany(
+                'DELETE FROM %s_cards WHERE path=?' % self._db.table,
+                dropped,
+            )
+            for (relative,) in dropped:
+                self._hits.pop(relative, None)
+
+        self._logger.debug("Purged %d file(s) from cache, %d failure(s)",
+                           count_success, count_error)
+        return count_success, count_error
+
+    def rebuild(self):
+        """
+        Brings the catalog back in sync with the cache directory (and
+        its subdirectories, other than hidden ones) by adding entries
+        for files that are not cataloged and dropping entries whose files
+        no longer exist. Returns the number of entries added and dropped.
+        """
+
+        on_disk = {}
+        for directory, subdirs, filenames in os.walk(self._dir):
+            if directory == self._dir:  # e.g. the staging directory
+                subdirs[:] = [subdir for subdir in subdirs
+                              if not subdir.startswith('.')]
+
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    on_disk[self._relative(path)] = (os.path.getsize(path),
+                                                     os.path.getmtime(path))
+                except OSError:
+                    continue
+
+        with self._lock:
+            self.flush()
+            cursor = self._cursor()
+            cataloged = set(row[0] for row in cursor.execute(
+                'SELECT path FROM %s' % self._db.table,
+            ))
+
+            missing = [(relative,) for relative in cataloged
+                       if relative not in on_disk]
+            untracked = [
+                (relative, os.path.basename(relative).split('-', 1)[0], size,
+                 mtime, mtime)
+                for relative, (size, mtime) in on_disk.items()
+                if relative not in cataloged
+            ]
+            if any(os.sep not in entry[0] for entry in untracked):
+                self._flat = ''  # there is something to migrate again
+
+            cursor.execute('BEGIN')
+            cursor.executemany('DELETE FROM %s WHERE path=?' % self._db.table,
+                               missing)
+            cursor.executemany('INSERT INTO %s VALUES (?, ?, ?, ?, ?)' %
+                               self._db.table, untracked)
+            cursor.execute('DELETE FROM %s_cards WHERE path NOT IN '
+                           '(SELECT path FROM %s)' %
+                           (self._db.table, self._db.table))
+            cursor.execute('COMMIT')
+            self._size = None  # summed again when next needed
+
+        self._logger.info("Rebuilt cache catalog; %d added, %d dropped",
+                          len(untracked), len(missing))
+        return len(untracked), len(missing)
+
+
+class DuePolicy(object):
+    """
+    Eviction policy for Catalog.evict() that keeps the files played by
+    cards due soon, given a function that looks up, for a set of card
+    IDs, a dict of how many days away each one is due (zero or less
+    for cards due now, None for new cards), leaving out suspended and
+    deleted cards.
+
+    Calling the policy with the IDs of the linked cards looks up their
+    due dates right away (so it can be done on the thread that owns the
+    collection) and returns the order callable for Catalog.evict(),
+    which ranks files as follows, each group least recently used first
+    unless noted:
+
+        - files whose cards are all suspended or deleted
+        - files whose soonest card is due beyond far_days, latest first
+        - files not linked to cards (or only to new cards)
+        - files whose soonest card is due beyond protect_days, latest
+          first
+
+    Files with a card due within protect_days are never evicted.
+    """
+
+    __slots__ = [
+        '_far_days',      # days away beyond which a card is "far-future"
+        '_get_days',      # callable looking up the days until cards are due
+        '_protect_days',  # days away within which a card's files are kept
+    ]
+
+    def __init__(self, get_days, protect_days=7, far_days=60):
+        """
+        Save the due date lookup and the thresholds.
+        """
+
+        self._far_days = far_days
+        self._get_days = get_days
+        self._protect_days = protect_days
+
+    def __call__(self, card_ids):
+        """
+        Returns an order callable for the due dates of the cards now.
+        """
+
+        days = self._get_days(card_ids)
+
+        def rank(candidate):
+            """
+            Returns the sort key for the candidate, or None if it must
+            be kept.
+            """
+
+            _, _, hit, cards = candidate
+            if not cards:
+                return 2, hit
+
+            scheduled = [days[card_id] for card_id in cards
+                         if days.get(card_id) is not None]
+            if not scheduled:
+                return (2, hit) if any(card_id in days for card_id in cards) \
+                    else (0, hit)
+
+            soonest = min(scheduled)
+            if soonest <= self._protect_days:
+                return None
+            return (1 if soonest > self._far_days else 3), -soonest, hit
+
+        def order(candidates):
+            """Returns the evictable candidates, most expendable first."""
+
+            ranked = [(key, candidate)
+                      for key, candidate in ((rank(candidate), candidate)
+                                             for candidate in candidates)
+                      if key is not None]
+            ranked.sort(key=lambda item: item[0])
+            return [candidate for _, candidate in ranked]
+
+        return order
+
+
+def _makedirs(path):
+    """Creates the directory at the given path unless it exists."""
+
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+
+def _check_mp3(path):
+    """
+    Raises a ValueError unless the file at the given path is of some
+    minimum size and begins with an MPEG audio frame, allowing for an
+    ID3v2 tag (and any stray bytes shortly after it) in front.
+    """
+
+    size = os.path.getsize(path)
+    if size < MP3_MIN_SIZE:
+        raise ValueError("only %d bytes long" % size)
+
+    with open(path, 'rb') as stream:
+        header = stream.read(10)
+        if header[:3] == 'ID3' and len(header) == 10:
+            # the tag size is stored as four 7-bit "syncsafe" bytes
+            tag_size = 0
+            for byte in header[6:]:
+                tag_size = tag_size << 7 | ord(byte) & 0x7f
+            stream.seek(10 + tag_size +
+                        (10 if ord(header[5]) & 0x10 else 0))  # footer
+        else:
+            stream.seek(0)
+        head = stream.read(MP3_SYNC_WINDOW)
+
+    for match in RE_FRAME_SYNC.finditer(head):
+        if _is_frame_header(head[match.start():match.start() + 4]):
+            return
+
+    raise ValueError("no MPEG audio frame found")
+
+
+def _is_frame_header(header):
+    """
+    Returns True if the given four bytes, which start with the frame
+    sync bits, form a valid MPEG audio frame header.
+    """
+
+    if len(header) < 4:
+        return False
+
+    second, third = ord(header[1]), ord(header[2])
+    return ((second >> 3) & 3) != 1 and \
+        ((second >> 1) & 3) != 0 and \
+        (third >> 4) != 15 and \
+        ((third >> 2) & 3) != 3
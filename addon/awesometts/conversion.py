@@ -23,8 +23,6 @@ Helpful type conversions
 import json
 import re
 
-from PyQt4.QtCore import Qt
-
 __all__ = ['compact_json', 'deserialized_dict', 'lax_bool',
            'normalized_ascii', 'nullable_key', 'nullable_int',
            'substitution_compiled', 'substitution_json', 'substitution_list']
@@ -93,6 +91,8 @@ def nullable_key(value):
     returns None.
     """
 
+    from PyQt4.QtCore import Qt  # not needed by headless callers
+
     if isinstance(value, Qt.Key):
         return value
 
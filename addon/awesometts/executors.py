@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Executors that run service calls on behalf of the router
+
+The scheduling (priorities, per-service limits, pool size) is shared by
+all executors; they only differ in where tasks run and on which thread
+the completion callbacks are delivered. None of these need Qt; the Qt
+adapter that delivers callbacks on the GUI thread lives in the gui
+package.
+"""
+
+from heapq import heappop, heappush
+from Queue import Queue
+from threading import RLock, Thread
+from time import sleep, time
+
+__all__ = ['Priority', 'Executor', 'SyncExecutor', 'ThreadExecutor']
+
+
+class Priority(object):  # enum class, pylint:disable=R0903
+    """
+    Provides an enum-like namespace for the classes of requests that
+    the router schedules, most urgent first.
+    """
+
+    INTERACTIVE = 0  # the user is waiting on it, e.g. on-the-fly playback
+    PREFETCH = 1     # the user will probably want it soon
+    BULK = 2         # batch work, e.g. mass generation in the card browser
+
+
+def _prefixed(lines, prefix="!!! "):
+    """Take incoming `lines` and prefix each line with `prefix`."""
+
+    return "\n".join(
+        prefix + line
+        for line in (lines if isinstance(lines, list) else lines.split("\n"))
+    )
+
+
+def _delayed(task, delay):
+    """Wraps `task` so that it waits `delay` seconds before running."""
+
+    def run():
+        """Sleep, then run the task."""
+
+        sleep(delay)
+        task()
+
+    return run
+
+
+class Executor(object):
+    """
+    Schedules tasks by priority and then in the order they were
+    submitted, while respecting each service's concurrency limit and
+    the overall pool size.
+
+    Two rules keep bulk work from getting in the way of the user:
+
+        - one slot is only ever given to INTERACTIVE jobs
+        - BULK jobs for a service are held back while there are any
+          INTERACTIVE jobs for that same service waiting or running
+
+    If given an interval callable, tasks for a service are also paced
+    so that they start at least that many seconds apart (e.g. to stay
+    under a web service's rate limit).
+
+    Subclasses implement _start() to actually run a dispatched task and
+    must arrange for _complete() to be called once it has finished.
+    """
+
+    __slots__ = [
+        '_current_id',   # the last/current job ID in-use
+        '_interactive',  # dict of service IDs mapping to interactive counts
+        '_interval',     # callable returning a service's pacing, or None
+        '_jobs',         # dict of IDs mapping to job's service, callback...
+        '_limit',        # callable returning a service's concurrency limit
+        '_lock',         # guards all of the scheduling state
+        '_logger',       # for writing messages about jobs
+        '_pending',      # dict of (priority, service ID) to job ID heaps
+        '_running',      # dict of service IDs mapping to the number dispatched
+        '_size',         # callable returning how many jobs to run at most
+        '_started',      # dict of service IDs mapping to last paced start
+    ]
+
+    def __init__(self, size, limit, logger, interval=None):
+        """
+        Initialize my internal state (next ID and lookup pools for the
+        jobs). The size, limit, and interval are callables, so that
+        changes to the user's configuration take effect without a
+        restart.
+        """
+
+        self._current_id = 0
+        self._interactive = {}
+        self._interval = interval
+        self._jobs = {}
+        self._limit = limit
+        self._lock = RLock()
+        self._logger = logger
+        self._pending = {}
+        self._running = {}
+        self._size = size
+        self._started = {}
+
+    def spawn(self, svc_id, task, callback, priority):
+        """
+        Queue the given task for the given service at the given
+        priority, returning its job ID. When the task has completed,
+        the callback will be called with an exception or None.
+        """
+
+        with self._lock:
+            self._current_id += 1
+            job_id = self._current_id
+            self._jobs[job_id] = {
+                'callback': callback,
+                'priority': priority,
+                'svc_id': svc_id,
+                'task': task,
+            }
+            self._enqueue(job_id)
+
+        self._logger.debug("Queued job [%d] for %s at priority %d",
+                           job_id, svc_id, priority)
+        self._dispatch()
+        return job_id
+
+    def promote(self, job_id, priority):
+        """
+        Move the given job up to the given priority, if it has not been
+        dispatched yet and is not already at that priority or better.
+        """
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or 'task' not in job or job['priority'] <= priority:
+                return
+
+            job['priority'] = priority  # entry in the old heap is now stale
+            self._enqueue(job_id)
+
+        self._logger.debug("Promoted job [%d] to priority %d",
+                           job_id, priority)
+        self._dispatch()
+
+    def shutdown(self):
+        """
+        Release any resources held by the executor once the tasks that
+        are running now have finished. Does nothing by default.
+        """
+
+    def notify(self, callback, *args):
+        """
+        Calls the callback with the given arguments on the thread that
+        completion callbacks are delivered on, for tasks to report on
+        their progress before they complete (e.g. the first part of a
+        long clip). Notifications from a task arrive in the order they
+        were made and before its completion callback. By default, the
+        callback is called right away.
+        """
+
+        callback(*args)
+
+    def _enqueue(self, job_id):
+        """
+        Adds the given job to the heap for its priority and service.
+        Callers must hold the lock.
+        """
+
+        job = self._jobs[job_id]
+        heappush(self._pending.setdefault((job['priority'], job['svc_id']),
+                                          []),
+                 job_id)
+
+        if job['priority'] == Priority.INTERACTIVE:
+            self._interactive[job['svc_id']] = \
+                self._interactive.get(job['svc_id'], 0) + 1
+
+    def _head(self, key):
+        """
+        Returns the oldest job ID still waiting in the heap for the
+        given key, discarding stale entries (i.e. promoted jobs), or
+        None if there are no jobs left waiting for it. Callers must
+        hold the lock.
+        """
+
+        heap = self._pending[key]
+
+        while heap:
+            job = self._jobs.get(heap[0])
+            if job and 'task' in job and job['priority'] == key[0]:
+                return heap[0]
+            heappop(heap)
+
+        return None
+
+    def _next(self):
+        """
+        Takes the most urgent pending job whose service is under its
+        limit, if the pool is not fully occupied, and returns its ID and
+        task, or (None, None) if nothing can be dispatched right now.
+        Callers must hold the lock.
+        """
+
+        size = max(self._size(), 1)
+        running = sum(self._running.values())
+        if running >= size:
+            return None, None
+
+        reserved = size > 1 and running == size - 1
+
+        ready = [
+            (key[0], job_id, key)
+            for key, job_id in (
+                (key, self._head(key))
+                for key in self._pending.keys()
+                if not (reserved and key[0] != Priority.INTERACTIVE) and
+                not (key[0] == Priority.BULK and
+                     self._interactive.get(key[1])) and
+                self._running.get(key[1], 0) < max(self._limit(key[1]), 1)
+            )
+            if job_id is not None
+        ]
+        if not ready:
+            return None, None
+
+        _, job_id, key = min(ready)
+        heappop(self._pending[key])
+        self._running[key[1]] = self._running.get(key[1], 0) + 1
+
+        self._logger.debug("Dispatching job [%d]; running=%s",
+                           job_id, self._running)
+        task = self._jobs[job_id].pop('task')
+
+        delay = self._pace(key[1])
+        if delay > 0:
+            self._logger.debug("Pacing job [%d] by %.2f seconds",
+                               job_id, delay)
+            task = _delayed(task, delay)
+
+        return job_id, task
+
+    def _pace(self, svc_id):
+        """
+        Returns how long a task for the given service that is being
+        dispatched now must wait before starting, recording its start.
+        Callers must hold the lock.
+        """
+
+        interval = self._interval and self._interval(svc_id)
+        if not interval:
+            return 0
+
+        now = time()
+        start = max(now, self._started.get(svc_id, 0) + interval)
+        self._started[svc_id] = start
+        return start - now
+
+    def _dispatch(self):
+        """
+        Starts as many pending jobs as the limits allow.
+        """
+
+        while True:
+            with self._lock:
+                job_id, task = self._next()
+            if job_id is None:
+                break
+            self._start(job_id, task)
+
+    def _start(self, job_id, task):
+        """
+        Runs the given task, after which _complete() must be called.
+        """
+
+        raise NotImplementedError
+
+    def _complete(self, job_id, exception=None, stack_trace=None):
+        """
+        Frees up the slot of the given finished job, executes the
+        callback that was registered for it, passing on any exception,
+        and then dispatches more work if there is any.
+        """
+
+        with self._lock:
+            job = self._jobs.pop(job_id)
+            self._running[job['svc_id']] -= 1
+            if job['priority'] == Priority.INTERACTIVE:
+                self._interactive[job['svc_id']] -= 1
+
+        if exception:
+            if not (hasattr(exception, 'message') and
+                    isinstance(exception.message, basestring) and
+                    exception.message):
+                exception.message = format(exception) or \
+                    "No additional details available"
+
+            self._logger.debug(
+                "Exception from job [%d] (%s); executing callback\n%s",
+
+                job_id, exception.message,
+
+                _prefixed(stack_trace)
+                if isinstance(stack_trace, basestring)
+                else "Stack trace unavailable",
+            )
+
+        else:
+            self._logger.debug(
+                "Completion from job [%d]; executing callback",
+                job_id,
+            )
+
+        try:
+            job['callback'](exception)
+        finally:
+            self._dispatch()
+
+
+class SyncExecutor(Executor):
+    """
+    Runs each task on the calling thread as soon as it is dispatched,
+    so callbacks have fired by the time spawn() returns (unless the job
+    is held back by a limit). Useful for scripts and benchmarks.
+    """
+
+    __slots__ = [
+        '_dispatching',  # True while the outermost _dispatch() is looping
+    ]
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the reentrancy flag.
+        """
+
+        super(SyncExecutor, self).__init__(*args, **kwargs)
+
+        self._dispatching = False
+
+    def _dispatch(self):
+        """
+        Dispatches only from the outermost call, so that completions
+        do not recurse deeper with every job that has been queued.
+        """
+
+        if self._dispatching:
+            return
+
+        self._dispatching = True
+        try:
+            super(SyncExecutor, self)._dispatch()
+        finally:
+            self._dispatching = False
+
+    def _start(self, job_id, task):
+        """Runs the task right away and completes it."""
+
+        try:
+            task()
+        except Exception as exception:  # catch all, pylint:disable=W0703
+            from traceback import format_exc
+            self._complete(job_id, exception, format_exc())
+        else:
+            self._complete(job_id)
+
+
+class ThreadExecutor(Executor):
+    """
+    Runs tasks on a fixed-size pool of long-lived worker threads that
+    are started on demand. Callbacks are executed on the worker thread
+    that ran the task, so callers must be thread-safe.
+    """
+
+    __slots__ = [
+        '_queue',    # feeds dispatched (ID, task) tuples to the workers
+        '_workers',  # list of started workers
+    ]
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the queue and an empty set of workers.
+        """
+
+        super(ThreadExecutor, self).__init__(*args, **kwargs)
+
+        self._queue = Queue()
+        self._workers = []
+
+    def shutdown(self):
+        """
+        Tell each worker to exit after its current task and then wait
+        for them to do so. Jobs still waiting on a slot stay queued, and
+        workers will be started again if they are dispatched.
+        """
+
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+
+        if not workers:
+            return
+
+        for _ in workers:
+            self._queue.put(None)
+        for worker in workers:
+            self._wait(worker)
+
+        self._logger.debug("Stopped %d worker(s)", len(workers))
+
+    def _start(self, job_id, task):
+        """
+        Hands the task to the workers, starting another worker if all
+        of the existing ones are already occupied.
+        """
+
+        with self._lock:
+            if len(self._workers) < sum(self._running.values()):
+                self._workers.append(self._new_worker())
+                self._logger.debug("Started worker #%d", len(self._workers))
+
+        self._queue.put((job_id, task))
+
+    def _new_worker(self):
+        """Returns a newly-started worker thread."""
+
+        worker = Thread(target=self._work, args=(self._complete,),
+                        name='AwesomeTTS worker')
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def _wait(self, worker):  # pylint:disable=no-self-use
+        """Blocks until the given worker has exited."""
+
+        worker.join()
+
+    def _work(self, deliver):
+        """
+        Runs tasks as they arrive until receiving None, passing the job
+        ID and any exception and stack trace to deliver() afterward.
+        """
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            job_id, task = item
+
+            try:
+                task()
+            except Exception as exception:  # catch all, pylint:disable=W0703
+                from traceback import format_exc
+                deliver(job_id, exception, format_exc())
+            else:
+                deliver(job_id)
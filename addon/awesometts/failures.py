@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Store of service failures, so requests that failed are not retried
+"""
+
+from httplib import IncompleteRead
+import os.path
+from socket import error as SocketError
+import sqlite3
+from threading import RLock
+from time import time
+from urllib2 import HTTPError, URLError
+
+from .service.common import NotFound
+
+__all__ = ['Failures']
+
+
+PERMANENT = 'permanent'  # the service says it does not know the word
+TRANSIENT = 'transient'  # e.g. the service is down or rate-limiting us
+OTHER = 'other'          # anything else, e.g. an unusable MP3
+
+PERMANENT_SECS = 30 * 86400  # remember permanent failures for a month
+OTHER_SECS = 3600  # remember other failures for an hour
+
+TRANSIENT_SECS = 60  # back off transient failures for a minute at first,
+TRANSIENT_MAX_SECS = 86400  # doubling with each repeat up to a day,
+TRANSIENT_RESET_SECS = 86400  # starting over if quiet for a day past expiry
+
+MAX_ENTRIES = 10000  # forget the failures expiring soonest beyond this
+
+
+class Failures(object):
+    """
+    Keeps a record of the requests that have failed in a SQLite3 table,
+    keyed by their cache filename, so that repeating a request (even in
+    a later session) fails right away with the same message instead of
+    calling the service again.
+
+    How long a failure is remembered depends on its class:
+
+        - permanent failures (i.e. a NotFound from a service, e.g. a
+          dictionary that does not know the word) are remembered for a
+          month
+        - transient failures (e.g. a 429 or 5xx from the service, or
+          any other IOError a service raises) are remembered for a
+          minute at first, doubling each time the same request fails
+          again, up to a day (starting over if the previous failure
+          expired more than a day ago)
+        - other failures are remembered for an hour
+
+    Network errors on our end (e.g. no connection) are not remembered,
+    and a request that succeeds is forgotten. At most MAX_ENTRIES
+    failures are kept.
+    """
+
+    __slots__ = [
+        '_connection',  # SQLite3 connection, opened upon first use
+        '_db',          # bundle with path to database and table name
+        '_lock',        # serializes access to the connection
+        '_logger',      # logger-like interface with debug(), info(), etc.
+    ]
+
+    def __init__(self, db, logger):
+        """
+        The database specification should be a bundle, with:
+
+            - path: full path to database
+            - table: table name
+
+        If the table does not exist yet, it is created.
+        """
+
+        self._connection = None
+        self._db = db
+        self._lock = RLock()
+        self._logger = logger
+
+        with self._lock:
+            cursor = self._cursor()
+            cursor.execute('CREATE TABLE IF NOT EXISTS %s (path text PRIMARY '
+                           'KEY, service text, class text, message text, '
+                           'count integer, expires real)' % db.table)
+            cursor.execute('CREATE INDEX IF NOT EXISTS %s_expires ON %s '
+                           '(expires)' % (db.table, db.table))
+
+    def _cursor(self):
+        """
+        Returns a cursor for the store, connecting to the database if
+        needed. Callers must hold the lock.
+        """
+
+        if not self._connection:
+            self._connection = sqlite3.connect(self._db.path,
+                                               isolation_level=None,
+                                               check_same_thread=False)
+        return self._connection.cursor()
+
+    def get(self, path):
+        """
+        Returns an exception for a remembered failure of the request
+        cached at the given path, or None if there is none.
+        """
+
+        with self._lock:
+            row = self._cursor().execute(
+                'SELECT class, message FROM %s WHERE path=? AND expires>?' %
+                self._db.table,
+                (os.path.basename(path), time()),
+            ).fetchone()
+
+        if not row:
+            return None
+
+        failure_class, message = row
+        return (NotFound if failure_class == PERMANENT
+                else RuntimeError if failure_class == OTHER
+                else IOError)(message)
+
+    def add(self, path, svc_id, exception):
+        """
+        Remembers that the request cached at the given path failed with
+        the given exception, unless it was a network error on our end.
+        """
+
+        failure_class = classify(exception)
+        if not failure_class:
+            return
+
+        message = getattr(exception, 'message', None)
+        if not isinstance(message, basestring) or not message:
+            message = format(exception) or type(exception).__name__
+        if isinstance(message, str):
+            message = message.decode('utf-8', 'replace')
+
+        filename = os.path.basename(path)
+        now = time()
+
+        with self._lock:
+            cursor = self._cursor()
+
+            row = cursor.execute(
+                'SELECT class, count, expires FROM %s WHERE path=?' %
+                self._db.table,
+                (filename,),
+            ).fetchone()
+            count = (
+                row[1] + 1
+                if row and row[0] == failure_class and
+                row[2] > now - TRANSIENT_RESET_SECS
+                else 1
+            )
+
+            if failure_class == PERMANENT:
+                expires = now + PERMANENT_SECS
+            elif failure_class == TRANSIENT:
+                expires = now + min(TRANSIENT_SECS * 2 ** min(count - 1, 20),
+                                    TRANSIENT_MAX_SECS)
+            else:
+                expires = now + OTHER_SECS
+
+            cursor.execute(
+                'INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?, ?)' %
+                self._db.table,
+                (filename, svc_id, failure_class, message, count, expires),
+            )
+
+            excess = cursor.execute(
+                'SELECT COUNT(*) FROM %s' % self._db.table,
+            ).fetchone()[0] - MAX_ENTRIES
+            if excess > 0:
+                cursor.execute('DELETE FROM %s WHERE expires<?' %
+                               self._db.table, (now,))
+                excess -= cursor.rowcount
+            if excess > 0:
+                cursor.execute(
+                    'DELETE FROM %s WHERE path IN (SELECT path FROM %s '
+                    'ORDER BY expires LIMIT ?)' %
+                    (self._db.table, self._db.table),
+                    (excess,),
+                )
+
+        self._logger.debug("Remembering %s failure of %s until %d (x%d)",
+                           failure_class, filename, expires, count)
+
+    def forget(self, path):
+        """
+        Forgets any failure of the request cached at the given path,
+        e.g. because it has since succeeded.
+        """
+
+        with self._lock:
+            self._cursor().execute(
+                'DELETE FROM %s WHERE path=?' % self._db.table,
+                (os.path.basename(path),),
+            )
+
+    def count(self):
+        """
+        Returns the number of remembered failures, after dropping any
+        that have expired.
+        """
+
+        with self._lock:
+            cursor = self._cursor()
+            cursor.execute('DELETE FROM %s WHERE expires<?' % self._db.table,
+                           (time(),))
+            return cursor.execute(
+                'SELECT COUNT(*) FROM %s' % self._db.table,
+            ).fetchone()[0]
+
+    def clear(self):
+        """Forgets all of the remembered failures."""
+
+        with self._lock:
+            self._cursor().execute('DELETE FROM %s' % self._db.table)
+
+
+def classify(exception):
+    """
+    Returns the class of failure (PERMANENT, TRANSIENT, or OTHER) that
+    the given exception represents, or None for network errors on our
+    end, which should not be remembered.
+    """
+
+    if isinstance(exception, NotFound):
+        return PERMANENT
+
+    if isinstance(exception, HTTPError):
+        if exception.code == 429 or exception.code >= 500:
+            return TRANSIENT
+        return OTHER  # n.b. a 404 might just be a service's moved endpoint
+
+    if isinstance(exception, (IncompleteRead, SocketError, URLError)):
+        return None
+
+    # n.b. Services also raise a plain IOError (i.e. one without an errno)
+    # when they cannot get the audio for other reasons, some of which do
+    # go away (e.g. Google rewraps rate limiting and connection errors).
+
+    if type(exception) is IOError and exception.errno is None:
+        return TRANSIENT
+
+    return OTHER
@@ -29,6 +29,8 @@ from .common import (
 
 from .configurator import Configurator
 
+from .executor import QtExecutor
+
 from .generator import (
     BrowserGenerator,
     EditorGenerator,
@@ -40,7 +42,9 @@ from .templater import Templater
 
 from .updater import Updater
 
-from .reviewer import Reviewer
+from .reviewer import Reviewer, get_days_until_due
+
+from .warmer import BrowserWarmer
 
 __all__ = [
     # common
@@ -54,9 +58,12 @@ __all__ = [
     'BrowserGenerator',
     'EditorGenerator',
     'BrowserStripper',
+    'BrowserWarmer',
     'Templater',
     'Updater',
 
     # headless
+    'QtExecutor',
     'Reviewer',
+    'get_days_until_due',
 ]
@@ -19,8 +19,6 @@
 """Configuration dialog"""
 
 from locale import format as locale
-import os
-import os.path
 from sys import platform
 
 from PyQt4 import QtCore, QtGui
@@ -42,18 +40,21 @@ class Configurator(Dialog):
 
     _PROPERTY_KEYS = [
         'automatic_answers', 'automatic_answers_errors', 'automatic_questions',
-        'automatic_questions_errors', 'cache_days', 'delay_answers_onthefly',
-        'delay_answers_stored_ours', 'delay_answers_stored_theirs',
-        'delay_questions_onthefly', 'delay_questions_stored_ours',
-        'delay_questions_stored_theirs', 'ellip_note_newlines',
-        'ellip_template_newlines', 'filenames', 'filenames_human',
-        'lame_flags', 'launch_browser_generator', 'launch_browser_stripper',
-        'launch_configurator', 'launch_editor_generator', 'launch_templater',
-        'otf_only_revealed_cloze', 'otf_remove_hints', 'spec_note_strip',
-        'spec_note_ellipsize', 'spec_template_ellipsize', 'spec_note_count',
-        'spec_note_count_wrap', 'spec_template_count',
-        'spec_template_count_wrap', 'spec_template_strip', 'strip_note_braces',
-        'strip_note_brackets', 'strip_note_parens', 'strip_template_braces',
+        'automatic_questions_errors', 'cache_days', 'cache_mb', 'cache_policy',
+        'delay_answers_onthefly', 'delay_answers_stored_ours',
+        'delay_answers_stored_theirs', 'delay_questions_onthefly',
+        'delay_questions_stored_ours', 'delay_questions_stored_theirs',
+        'ellip_note_newlines', 'ellip_template_newlines', 'filenames',
+        'filenames_human', 'lame_flags', 'launch_browser_generator',
+        'launch_browser_stripper', 'launch_configurator',
+        'launch_editor_generator', 'launch_templater',
+        'otf_only_revealed_cloze', 'otf_progressive', 'otf_remove_hints',
+        'pool_size', 'prefetch_cards', 'prefetch_concurrency',
+        'spec_note_strip', 'spec_note_ellipsize', 'spec_template_ellipsize',
+        'spec_note_count', 'spec_note_count_wrap', 'spec_template_count',
+        'speculative_answers', 'spec_template_count_wrap',
+        'spec_template_strip', 'strip_note_braces', 'strip_note_brackets',
+        'strip_note_parens', 'strip_template_braces',
         'strip_template_brackets', 'strip_template_parens', 'sub_note_cloze',
         'sub_template_cloze', 'sul_note', 'sul_template', 'throttle_sleep',
         'throttle_threshold', 'tts_key_a', 'tts_key_q', 'updates_enabled',
@@ -62,12 +63,13 @@ class Configurator(Dialog):
     _PROPERTY_WIDGETS = (Checkbox, QtGui.QComboBox, QtGui.QLineEdit,
                          QtGui.QPushButton, QtGui.QSpinBox, QtGui.QListView)
 
-    __slots__ = ['_alerts', '_ask', '_preset_editor', '_group_editor',
-                 '_sul_compiler']
+    __slots__ = ['_alerts', '_ask', '_concurrency', '_preset_editor',
+                 '_group_editor', '_sul_compiler']
 
     def __init__(self, alerts, ask, sul_compiler, *args, **kwargs):
         self._alerts = alerts
         self._ask = ask
+        self._concurrency = {}
         self._preset_editor = None
         self._group_editor = None
         self._sul_compiler = sul_compiler
@@ -120,6 +122,10 @@ class Configurator(Dialog):
             'automatic_answers', 'tts_key_a',
             'delay_answers_', "Answers / Backs of Cards",
         ))
+        vert.addWidget(self._ui_tabs_playback_upcoming())
+        vert.addWidget(Checkbox("Start playing long on-the-fly <tts> tags "
+                                "before all of their audio has arrived",
+                                'otf_progressive'))
         vert.addSpacing(self._SPACING)
         vert.addWidget(Label('Anki controls if and how to play [sound] '
                              'tags. See "Help" for more information.'))
@@ -180,6 +186,36 @@ class Configurator(Dialog):
         group.setLayout(layout)
         return group
 
+    def _ui_tabs_playback_upcoming(self):
+        """Returns the "Upcoming Cards" input group."""
+
+        cards = QtGui.QSpinBox()
+        cards.setObjectName('prefetch_cards')
+        cards.setRange(0, 50)
+        cards.setSpecialValueText("none")
+        cards.setSuffix(" cards")
+
+        concurrency = QtGui.QSpinBox()
+        concurrency.setObjectName('prefetch_concurrency')
+        concurrency.setRange(1, 10)
+        concurrency.setSuffix(" at a time")
+
+        hor = QtGui.QHBoxLayout()
+        hor.addWidget(Label("Prepare on-the-fly <tts> tags for the next"))
+        hor.addWidget(cards)
+        hor.addWidget(concurrency)
+        hor.addStretch()
+
+        vert = QtGui.QVBoxLayout()
+        vert.addWidget(Checkbox("Prepare on-the-fly <tts> tags for the answer "
+                                "while its question is shown",
+                                'speculative_answers'))
+        vert.addLayout(hor)
+
+        group = QtGui.QGroupBox("Upcoming Cards")
+        group.setLayout(vert)
+        return group
+
     def _ui_tabs_text(self):
         """Returns the "Text" tab."""
 
@@ -343,6 +379,7 @@ class Configurator(Dialog):
         vert.addWidget(self._ui_tabs_mp3gen_filenames())
         vert.addWidget(self._ui_tabs_mp3gen_lame())
         vert.addWidget(self._ui_tabs_mp3gen_throttle())
+        vert.addWidget(self._ui_tabs_mp3gen_concurrency())
         vert.addStretch()
 
         tab = QtGui.QWidget()
@@ -438,6 +475,63 @@ class Configurator(Dialog):
         group.setLayout(vert)
         return group
 
+    def _ui_tabs_mp3gen_concurrency(self):
+        """Returns the "Concurrent Generation" input group."""
+
+        size = QtGui.QSpinBox()
+        size.setObjectName('pool_size')
+        size.setRange(1, 32)
+        size.setSuffix(" at once")
+
+        size_line = QtGui.QHBoxLayout()
+        size_line.addWidget(Label("Generate up to "))
+        size_line.addWidget(size)
+        size_line.addStretch()
+
+        dropdown = QtGui.QComboBox()
+        dropdown.setObjectName('concurrency_service')
+        for svc_id, name, default in self._addon.router.get_concurrency():
+            dropdown.addItem(name, (svc_id, default))
+
+        limit = QtGui.QSpinBox()
+        limit.setObjectName('concurrency_limit')
+        limit.setRange(0, 32)
+        limit.setSuffix(" at once")
+
+        def on_service(index):
+            """Show the limit for the newly-selected service."""
+            svc_id, default = dropdown.itemData(index)
+            limit.setSpecialValueText("default (%d)" % default)
+            limit.setValue(self._concurrency.get(svc_id, 0))
+
+        def on_limit(value):
+            """Remember the limit for the selected service."""
+            svc_id = dropdown.itemData(dropdown.currentIndex())[0]
+            if value:
+                self._concurrency[svc_id] = value
+            else:
+                self._concurrency.pop(svc_id, None)
+
+        dropdown.currentIndexChanged.connect(on_service)
+        limit.valueChanged.connect(on_limit)
+
+        limit_line = QtGui.QHBoxLayout()
+        limit_line.addWidget(Label("Allow "))
+        limit_line.addWidget(dropdown)
+        limit_line.addWidget(Label(" to generate "))
+        limit_line.addWidget(limit)
+        limit_line.addStretch()
+
+        vert = QtGui.QVBoxLayout()
+        vert.addWidget(Note("Limit how many files AwesomeTTS generates "
+                            "simultaneously, in total and per service."))
+        vert.addLayout(size_line)
+        vert.addLayout(limit_line)
+
+        group = QtGui.QGroupBox("Concurrent Generation")
+        group.setLayout(vert)
+        return group
+
     def _ui_tabs_windows(self):
         """Returns the "Window" tab."""
 
@@ -554,11 +648,36 @@ class Configurator(Dialog):
         hor.addWidget(Label("at exit (zero clears everything)"))
         hor.addStretch()
 
+        megabytes = QtGui.QSpinBox()
+        megabytes.setObjectName('cache_mb')
+        megabytes.setRange(0, 999999)
+        megabytes.setSingleStep(100)
+        megabytes.setSuffix(" MB")
+
+        size_hor = QtGui.QHBoxLayout()
+        size_hor.addWidget(Label("Keep the cache under"))
+        size_hor.addWidget(megabytes)
+        size_hor.addWidget(Label("(zero for no limit) by deleting"))
+        size_hor.addStretch()
+
+        policy = QtGui.QComboBox()
+        policy.setObjectName('cache_policy')
+        policy.addItem("least recently played files first", 'lru')
+        policy.addItem("files for cards not due soon first, sparing cards "
+                       "due within a week", 'due')
+
+        policy_hor = QtGui.QHBoxLayout()
+        policy_hor.addWidget(policy)
+        policy_hor.addStretch()
+
         layout = QtGui.QVBoxLayout()
         layout.addWidget(Note("AwesomeTTS caches generated audio files and "
-                              "remembers failures during each session to "
-                              "speed up repeated playback."))
+                              "remembers failures (for up to a month if a "
+                              "word is unknown) to speed up repeated "
+                              "playback."))
         layout.addLayout(hor)
+        layout.addLayout(size_hor)
+        layout.addLayout(policy_hor)
 
         abutton = QtGui.QPushButton("Delete Files")
         abutton.setObjectName('on_cache')
@@ -568,9 +687,16 @@ class Configurator(Dialog):
         fbutton.setObjectName('on_forget')
         fbutton.clicked.connect(lambda: self._on_forget_failures(fbutton))
 
+        rbutton = QtGui.QPushButton("Repair Index")
+        rbutton.setObjectName('on_repair')
+        rbutton.setToolTip("Resynchronize AwesomeTTS's index of cached files "
+                           "with the cache directory")
+        rbutton.clicked.connect(lambda: self._on_cache_repair(rbutton))
+
         hor = QtGui.QHBoxLayout()
         hor.addWidget(abutton)
         hor.addWidget(fbutton)
+        hor.addWidget(rbutton)
         layout.addLayout(hor)
 
         group = QtGui.QGroupBox("Caching")
@@ -620,18 +746,12 @@ class Configurator(Dialog):
             elif isinstance(widget, QtGui.QListView):
                 widget.setModel(value)
 
-        widget = self.findChild(QtGui.QPushButton, 'on_cache')
-        widget.atts_list = (
-            [filename for filename in os.listdir(self._addon.paths.cache)]
-            if os.path.isdir(self._addon.paths.cache) else []
-        )
-        if widget.atts_list:
-            widget.setEnabled(True)
-            widget.setText("Delete Files (%s)" %
-                           locale("%d", len(widget.atts_list), grouping=True))
-        else:
-            widget.setEnabled(False)
-            widget.setText("Delete Files")
+        self._concurrency = dict(self._addon.config['concurrency'])
+        dropdown = self.findChild(QtGui.QComboBox, 'concurrency_service')
+        dropdown.currentIndexChanged.emit(dropdown.currentIndex())
+
+        self._refresh_cache_button()
+        self.findChild(QtGui.QPushButton, 'on_repair').setText("Repair Index")
 
         widget = self.findChild(QtGui.QPushButton, 'on_forget')
         fail_count = self._addon.router.get_failure_count()
@@ -668,6 +788,8 @@ class Configurator(Dialog):
             for widget in self.findChildren(self._PROPERTY_WIDGETS)
             if widget.objectName() in self._PROPERTY_KEYS
         })
+        self._addon.config['concurrency'] = self._concurrency
+        self._addon.router.evict_cache()  # in case the budget was lowered
 
         super(Configurator, self).accept()
 
@@ -789,18 +911,26 @@ class Configurator(Dialog):
             ),
         )
 
+    def _refresh_cache_button(self):
+        """Updates the "Delete Files" button from the cache catalog."""
+
+        widget = self.findChild(QtGui.QPushButton, 'on_cache')
+        count, size = self._addon.router.get_cache_stats()
+        if count:
+            widget.setEnabled(True)
+            widget.setText("Delete Files (%s, %s MB)" % (
+                locale("%d", count, grouping=True),
+                locale("%.1f", size / 1048576.0, grouping=True),
+            ))
+        else:
+            widget.setEnabled(False)
+            widget.setText("Delete Files")
+
     def _on_cache_clear(self, button):
         """Attempts clear known files from cache."""
 
         button.setEnabled(False)
-        count_error = count_success = 0
-
-        for filename in button.atts_list:
-            try:
-                os.unlink(os.path.join(self._addon.paths.cache, filename))
-                count_success += 1
-            except:  # capture all exceptions, pylint:disable=W0702
-                count_error += 1
+        count_success, count_error = self._addon.router.clear_cache()
 
         if count_error:
             if count_success:
@@ -811,6 +941,18 @@ class Configurator(Dialog):
         else:
             button.setText("emptied cache")
 
+    def _on_cache_repair(self, button):
+        """Rebuilds the cache catalog from the cache directory."""
+
+        button.setEnabled(False)
+        count_added, count_dropped = self._addon.router.rebuild_cache()
+        self._refresh_cache_button()
+        button.setText("repaired (%s added, %s dropped)" % (
+            locale("%d", count_added, grouping=True),
+            locale("%d", count_dropped, grouping=True),
+        ) if count_added or count_dropped else "index is in sync")
+        button.setEnabled(True)
+
     def _on_forget_failures(self, button):
         """Tells the router to forget all cached failures."""
 
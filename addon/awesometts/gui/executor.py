@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Executor that delivers router callbacks on the Qt GUI thread
+"""
+
+from PyQt4 import QtCore
+
+from ..executors import ThreadExecutor
+
+__all__ = ['QtExecutor']
+
+
+_SIGNAL = QtCore.SIGNAL('awesomeTtsThreadDone')
+
+_SIGNAL_NOTIFY = QtCore.SIGNAL('awesomeTtsThreadNotify')
+
+
+class QtExecutor(ThreadExecutor):
+    """
+    Runs tasks on QThread workers to keep the UI responsive, relaying
+    each completion (and notification) back to the GUI thread with a
+    Qt signal, so that callbacks can safely touch widgets and Anki's
+    collection.
+    """
+
+    __slots__ = [
+        '_relay',  # QObject living on the GUI thread to receive signals
+    ]
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the relay; must be called from the GUI thread.
+        """
+
+        super(QtExecutor, self).__init__(*args, **kwargs)
+
+        self._relay = _Relay(self._complete)
+        self._relay.connect(self._relay, _SIGNAL_NOTIFY, self._relay.notify)
+
+    def notify(self, callback, *args):
+        """
+        Relays the callback to the GUI thread; if called from the GUI
+        thread, Qt calls it right away.
+        """
+
+        self._relay.emit(_SIGNAL_NOTIFY, callback, args)
+
+    def _new_worker(self):
+        """Returns a newly-started QThread worker."""
+
+        worker = _Worker(self._work)
+        self._relay.connect(worker, _SIGNAL, self._relay.complete)
+        worker.start()
+        return worker
+
+    def _wait(self, worker):
+        """Blocks until the given worker has exited."""
+
+        worker.wait()
+
+
+class _Relay(QtCore.QObject):
+    """
+    Receives completion and notification signals from the workers.
+    Because it is created on the GUI thread, Qt queues the signals to
+    be handled there.
+    """
+
+    __slots__ = [
+        '_complete',  # callable to pass the job ID and any exception on to
+    ]
+
+    def __init__(self, complete):
+        """
+        Save my completion handler.
+        """
+
+        super(_Relay, self).__init__()
+
+        self._complete = complete
+
+    def complete(self, job_id, exception=None, stack_trace=None):
+        """
+        Pass the signal's arguments on to the completion handler.
+        """
+
+        self._complete(job_id, exception, stack_trace)
+
+    def notify(self, callback, args):  # pylint:disable=no-self-use
+        """
+        Call the notification's callback with its arguments.
+        """
+
+        callback(*args)
+
+
+class _Worker(QtCore.QThread):
+    """
+    Generic worker for running tasks in the background, signalling
+    the main thread as each one finishes.
+    """
+
+    __slots__ = [
+        '_work',  # callable to run, passed a function to signal completion
+    ]
+
+    def __init__(self, work):
+        """
+        Save my work loop.
+        """
+
+        super(_Worker, self).__init__()
+
+        self._work = work
+
+    def run(self):
+        """
+        Run my work loop, emitting a signal for every completion.
+        """
+
+        self._work(lambda *args: self.emit(_SIGNAL, *args))
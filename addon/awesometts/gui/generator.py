@@ -393,14 +393,16 @@ class BrowserGenerator(ServiceDialog):
                                      presets=config['presets'],
                                      callbacks=callbacks,
                                      want_human=want_human,
-                                     note=note)
+                                     note=note,
+                                     priority=self._addon.router.Priority.BULK)
         else:
             self._addon.router(svc_id=svc_id,
                                text=phrase,
                                options=proc['service']['options'],
                                callbacks=callbacks,
                                want_human=want_human,
-                               note=note)
+                               note=note,
+                               priority=self._addon.router.Priority.BULK)
 
     def _accept_next_output(self, old_value, filename):
         """
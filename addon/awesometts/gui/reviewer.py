@@ -24,14 +24,16 @@ because interacts with the GUI components of Anki and it also spawns
 alert windows. It also may have more visual components in the future.
 """
 
+from collections import deque
+from json import dumps
 import re
 
 from BeautifulSoup import BeautifulSoup
-from PyQt4.QtCore import Qt
+from PyQt4.QtCore import Qt, QTimer
 
 from .common import key_event_combo
 
-__all__ = ['Reviewer']
+__all__ = ['Reviewer', 'get_days_until_due']
 
 X_FOR_THIS_TAG_MSG = 'The "%s" %s specified by this tag does not exist:\n' \
                      "\n" \
@@ -97,12 +99,16 @@ class Reviewer(object):
         '_addon',
         '_alerts',
         '_mw',
+        '_prefetch_pending',  # deque of requests for upcoming cards
+        '_prefetch_running',  # number of prefetch requests in the router
     ]
 
     def __init__(self, addon, alerts, mw):
         self._addon = addon
         self._alerts = alerts
         self._mw = mw
+        self._prefetch_pending = deque()
+        self._prefetch_running = 0
 
     def card_handler(self, state, card):
         """
@@ -116,12 +122,142 @@ class Reviewer(object):
         if state == 'question' and config['automatic_questions']:
             self._play_html('front', card.q(),
                             self._addon.player.otf_question, self._mw,
-                            show_errors=config['automatic_questions_errors'])
+                            show_errors=config['automatic_questions_errors'],
+                            cards=[card.id])
 
         elif state == 'answer' and config['automatic_answers']:
-            self._play_html('back', self._get_answer(card),
+            self._play_html('back', self.get_answer(card),
                             self._addon.player.otf_answer, self._mw,
-                            show_errors=config['automatic_answers_errors'])
+                            show_errors=config['automatic_answers_errors'],
+                            cards=[card.id])
+
+    def prefetch_handler(self, card):
+        """
+        Looks ahead to the cards that the scheduler is likely to show
+        after the passed one and sends the on-the-fly tags from both of
+        their sides to the router at prefetch priority, so that their
+        audio is already cached by the time they come up.
+
+        If speculative answers are enabled, the answer side of the
+        passed card (whose question is now on-screen) goes first. This
+        only warms the cache; playback still waits for the answer to be
+        revealed, at which point the router promotes any request that
+        is still waiting.
+
+        Requests for the previous lookahead that have not been sent yet
+        are replaced, as the upcoming cards may have changed.
+        """
+
+        config = self._addon.config
+        count = config['prefetch_cards']
+        if not count and not config['speculative_answers']:
+            return
+
+        sides = [('back', self.get_answer(card), card.id)] \
+            if config['speculative_answers'] else []
+        for upcoming in self._get_upcoming(card, count) if count else []:
+            sides.append(('front', upcoming.q(), upcoming.id))
+            sides.append(('back', self.get_answer(upcoming), upcoming.id))
+
+        requests = []
+        seen = {}
+
+        for side, html, card_id in sides:
+            for request in self.parse_html(side, html):
+                key = dumps(request, sort_keys=True)
+                if key in seen:
+                    seen[key]['cards'].append(card_id)
+                else:
+                    request['cards'] = [card_id]
+                    seen[key] = request
+                    requests.append(request)
+
+        self._addon.logger.debug("Prefetching %d request(s) from %d side(s)",
+                                 len(requests), len(sides))
+        self._prefetch_pending = deque(requests)
+        self._prefetch_next()
+
+    def _get_upcoming(self, card, count):
+        """
+        Returns up to count cards that the scheduler is likely to show
+        after the passed card, in the order it would show them (learning
+        cards, then reviews, then new cards).
+
+        This relies on the internal queues of Anki's scheduler, so if
+        they are not as expected, an empty list is returned.
+        """
+
+        try:
+            sched = self._mw.col.sched
+            card_ids = (  # pylint:disable=protected-access
+                [card_id for _, card_id in sorted(sched._lrnQueue)] +
+                list(reversed(sched._revQueue)) +  # popped from the end
+                list(reversed(sched._newQueue))
+            )
+        except (AttributeError, TypeError, ValueError):
+            return []
+
+        upcoming = []
+        seen = set([card.id])
+
+        for card_id in card_ids:
+            if card_id in seen:
+                continue
+            seen.add(card_id)
+
+            try:
+                upcoming.append(self._mw.col.getCard(card_id))
+            except Exception:  # catch all, pylint:disable=broad-except
+                continue
+
+            if len(upcoming) >= count:
+                break
+
+        return upcoming
+
+    def _prefetch_next(self):
+        """
+        Sends pending prefetch requests to the router, as long as we are
+        under the configured number of outstanding prefetch requests.
+        """
+
+        limit = max(self._addon.config['prefetch_concurrency'], 1)
+        router = self._addon.router
+
+        while self._prefetch_pending and self._prefetch_running < limit:
+            request = self._prefetch_pending.popleft()
+            self._prefetch_running += 1
+
+            callbacks = dict(
+                okay=lambda path: None,
+                fail=lambda exception: None,
+                then=self._prefetch_then,
+            )
+
+            if 'group' in request:
+                router.group(text=request['text'],
+                             group=request['group'],
+                             presets=self._addon.config['presets'],
+                             callbacks=callbacks,
+                             priority=router.Priority.PREFETCH,
+                             cards=request['cards'])
+            else:
+                router(svc_id=request['svc_id'],
+                       text=request['text'],
+                       options=request['options'],
+                       callbacks=callbacks,
+                       priority=router.Priority.PREFETCH,
+                       cards=request['cards'])
+
+    def _prefetch_then(self):
+        """
+        Frees up the slot of a finished prefetch request. Sending the
+        next one is done via a single-shot QTimer to avoid recursing
+        through a long string of cache hits.
+        """
+
+        self._prefetch_running -= 1
+        QTimer.singleShot(0, self._prefetch_next)
 
     def key_handler(self, key_event, state, card, replay_audio):
         """
@@ -152,18 +288,20 @@ class Reviewer(object):
         question_combo = self._addon.config['tts_key_q']
         if question_combo and combo == question_combo:
             self._play_html('front', card.q(),
-                            self._addon.player.otf_shortcut, self._mw)
+                            self._addon.player.otf_shortcut, self._mw,
+                            cards=[card.id])
             handled = True
 
         answer_combo = self._addon.config['tts_key_a']
         if state == 'answer' and answer_combo and combo == answer_combo:
-            self._play_html('back', self._get_answer(card),
-                            self._addon.player.otf_shortcut, self._mw)
+            self._play_html('back', self.get_answer(card),
+                            self._addon.player.otf_shortcut, self._mw,
+                            cards=[card.id])
             handled = True
 
         return handled
 
-    def _get_answer(self, card):
+    def get_answer(self, card):
         """
         Attempts to strip out the question side of the card in the blob
         of HTML we get as the "answer" HTML.
@@ -192,10 +330,36 @@ class Reviewer(object):
 
         return answer_html
 
-    def _play_html(self, side, html, playback, parent, show_errors=True):
+    def parse_html(self, side, html):
+        """
+        Returns a list of the requests that playing the passed HTML
+        would send to the router, without actually sending them. Each
+        is a dict with the text and either a group, or a service ID and
+        options. Tags that have problems are skipped.
+        """
+
+        assert side in ['front', 'back'], "invalid 'side' passed"
+        from_template = (self._addon.strip.from_template_back if side == 'back'
+                         else self._addon.strip.from_template_front)
+        ignore = lambda message: None
+
+        return [
+            request
+            for request in (
+                [self._parse_html_tag(tag, from_template, ignore)
+                 for tag in BeautifulTTS(html)('tts')] +
+                [self._parse_html_legacy(legacy, from_template, ignore)
+                 for legacy in self.RE_LEGACY_TAGS.findall(html)]
+            )
+            if request
+        ]
+
+    def _play_html(self, side, html, playback, parent, show_errors=True,
+                   cards=None):
         """
         Read in the passed HTML, attempt to discover <tts> tags in it,
-        and pass them to the router for processing.
+        and pass them to the router for processing, along with the IDs
+        of the cards the HTML came from, if any.
 
         Additionally, old-style [GTTS], [TTS], and [ATTS] tags are
         detected and played back, e.g.
@@ -223,106 +387,117 @@ class Reviewer(object):
         else:
             skip_check = False
 
-        def playback_wrapper(*args, **kwargs):
-            """Play audio contingent on matching state."""
+        def wrap(callee):
+            """Returns callee wrapped to play contingent on state."""
 
-            if skip_check:
-                self._addon.logger.info("No previous state; playing audio")
-                playback(*args, **kwargs)
+            def playback_wrapper(*args, **kwargs):
+                """Play audio contingent on matching state."""
 
-            elif (parent_state == parent.state and
-                  reviewer_state == parent.reviewer.state and
-                  card_id == parent.reviewer.card.id):
-                self._addon.logger.info("Previous state same; playing audio")
-                playback(*args, **kwargs)
+                if skip_check:
+                    self._addon.logger.info("No previous state; playing "
+                                            "audio")
+                    callee(*args, **kwargs)
 
-            else:
-                self._addon.logger.warn("State changed; not playing audio")
+                elif (parent_state == parent.state and
+                      reviewer_state == parent.reviewer.state and
+                      card_id == parent.reviewer.card.id):
+                    self._addon.logger.info("Previous state same; playing "
+                                            "audio")
+                    callee(*args, **kwargs)
+
+                else:
+                    self._addon.logger.warn("State changed; not playing "
+                                            "audio")
+
+            return playback_wrapper
+
+        playback = wrap(playback)
+        part_playback = wrap(self._addon.player.otf_part)
 
         for tag in BeautifulTTS(html)('tts'):
-            self._play_html_tag(tag, from_template, playback_wrapper,
-                                parent, show_errors)
+            self._play_html_tag(tag, from_template,
+                                self._get_playbacks(playback, part_playback),
+                                parent, show_errors, cards)
 
         for legacy in self.RE_LEGACY_TAGS.findall(html):
-            self._play_html_legacy(legacy, from_template, playback_wrapper,
-                                   parent, show_errors)
+            self._play_html_legacy(legacy, from_template,
+                                   self._get_playbacks(playback,
+                                                       part_playback),
+                                   parent, show_errors, cards)
 
-    def _play_html_tag(self, tag, from_template, playback, parent,
-                       show_errors=True):
+    def _get_playbacks(self, playback, part_playback):
+        """
+        Returns the okay callback (and, if the user has turned on
+        progressive playback, the part callback) for a request to the
+        router that should be played back.
+
+        With progressive playback, the first segment of a long clip is
+        passed to playback as soon as it has arrived and the rest to
+        part_playback (to be queued after it) as they arrive, and the
+        whole clip is then not played again once it is complete.
+        """
+
+        if not self._addon.config['otf_progressive']:
+            return dict(okay=playback)
+
+        played = []
+
+        def part(path):
+            """Plays the first segment and queues the later ones."""
+
+            (part_playback if played else playback)(path)
+            played.append(path)
+
+        def okay(path):
+            """Plays the whole clip unless its segments were played."""
+
+            if not played:
+                playback(path)
+
+        return dict(okay=okay, part=part)
+
+    def _play_html_tag(self, tag, from_template, playbacks, parent,
+                       show_errors=True, cards=None):
         """Helper method for _play_html()."""
 
-        text = from_template(unicode(tag))
-        if not text:
+        request = self._parse_html_tag(
+            tag, from_template,
+            lambda message: show_errors and self._alerts(message, parent),
+        )
+        if not request:
             return
 
-        attr = dict(tag.attrs)
-        config = self._addon.config
-
-        if 'group' in attr:
-            try:
-                group = lax_dict_lookup(config['groups'], attr['group'])
-            except KeyError:
-                if show_errors:
-                    self._alerts(
-                        X_FOR_THIS_TAG_MSG % (attr['group'], "group",
-                                              tag.prettify().decode('utf-8')),
-                        parent,
-                    )
-            else:
-                self._addon.router.group(
-                    text=text,
-                    group=group,
-                    presets=config['presets'],
-                    callbacks=dict(
-                        okay=playback,
-                        fail=lambda exception: (
-                            isinstance(exception,
-                                       self._addon.router.BusyError) or
-                            not show_errors or
-                            self._alerts(
-                                "Unable to play this group tag:\n%s\n\n%s" % (
-                                    tag.prettify().decode('utf-8').strip(),
-                                    exception.message,
-                                ),
-                                parent,
-                            )
-                        ),
+        if 'group' in request:
+            self._addon.router.group(
+                text=request['text'],
+                group=request['group'],
+                presets=self._addon.config['presets'],
+                callbacks=dict(
+                    playbacks,
+                    fail=lambda exception: (
+                        not show_errors or
+                        self._alerts(
+                            "Unable to play this group tag:\n%s\n\n%s" % (
+                                tag.prettify().decode('utf-8').strip(),
+                                exception.message,
+                            ),
+                            parent,
+                        )
                     ),
-                )
+                ),
+                cards=cards,
+            )
             return
 
-        if 'preset' in attr:
-            try:
-                attr = dict(lax_dict_lookup(config['presets'], attr['preset']))
-            except KeyError:
-                if show_errors:
-                    self._alerts(
-                        X_FOR_THIS_TAG_MSG % (attr['preset'], "preset",
-                                              tag.prettify().decode('utf-8')),
-                        parent,
-                    )
-                return
-
-        try:
-            svc_id = attr.pop('service')
-        except KeyError:
-            if show_errors:
-                self._alerts(
-                    "This tag needs a 'service' attribute:\n%s" %
-                    tag.prettify().decode('utf-8'),
-                    parent,
-                )
-            return
+        svc_id = request['svc_id']
 
         self._addon.router(
             svc_id=svc_id,
-            text=text,
-            options=attr,
+            text=request['text'],
+            options=request['options'],
             callbacks=dict(
-                okay=playback,
+                playbacks,
                 fail=lambda exception: (
-                    # we can safely ignore "service busy" errors in review
-                    isinstance(exception, self._addon.router.BusyError) or
                     not show_errors or
                     self._alerts(
                         ("Unable to play this tag:\n%s\n\n%s\n\n"
@@ -341,39 +516,100 @@ class Reviewer(object):
                     )
                 ),
             ),
+            cards=cards,
         )
 
-    def _play_html_legacy(self, legacy, from_template, playback, parent,
-                          show_errors=True):
+    def _parse_html_tag(self, tag, from_template, on_error):
+        """
+        Returns a request dict for the given <tts> tag, with its text
+        and either a group or a service ID and options, or None if the
+        tag has nothing to say or has a problem (passed to on_error).
+        """
+
+        text = from_template(unicode(tag))
+        if not text:
+            return None
+
+        attr = dict(tag.attrs)
+        config = self._addon.config
+
+        if 'group' in attr:
+            try:
+                group = lax_dict_lookup(config['groups'], attr['group'])
+            except KeyError:
+                on_error(X_FOR_THIS_TAG_MSG % (attr['group'], "group",
+                                               tag.prettify().decode('utf-8')))
+                return None
+            return dict(text=text, group=group)
+
+        if 'preset' in attr:
+            try:
+                attr = dict(lax_dict_lookup(config['presets'], attr['preset']))
+            except KeyError:
+                on_error(X_FOR_THIS_TAG_MSG % (attr['preset'], "preset",
+                                               tag.prettify().decode('utf-8')))
+                return None
+
+        try:
+            svc_id = attr.pop('service')
+        except KeyError:
+            on_error("This tag needs a 'service' attribute:\n%s" %
+                     tag.prettify().decode('utf-8'))
+            return None
+
+        return dict(text=text, svc_id=svc_id, options=attr)
+
+    def _play_html_legacy(self, legacy, from_template, playbacks, parent,
+                          show_errors=True, cards=None):
         """Helper method for _play_html()."""
 
+        request = self._parse_html_legacy(
+            legacy, from_template,
+            lambda message: show_errors and self._play_html_legacy_bad(
+                legacy, message, parent),
+        )
+        if not request:
+            return
+
+        self._addon.router(
+            svc_id=request['svc_id'],
+            text=request['text'],
+            options=request['options'],
+            callbacks=dict(
+                playbacks,
+                fail=lambda exception: (
+                    not show_errors or
+                    self._play_html_legacy_bad(legacy, exception.message,
+                                               parent)
+                ),
+            ),
+            cards=cards,
+        )
+
+    def _parse_html_legacy(self, legacy, from_template, on_error):
+        """
+        Returns a request dict for the given old-style tag, with its
+        text, service ID, and options, or None if the tag has nothing to
+        say or has a problem (passed to on_error).
+        """
+
         components = legacy[1].split(':')
 
         if legacy[0] and legacy[0].strip().lower() == 'g':
             if len(components) < 2:
-                if show_errors:
-                    self._play_html_legacy_bad(
-                        legacy,
-                        "Old-style GTTS bracket tags must specify the "
-                        "voice, e.g. [GTTS:es:hola], [GTTS:es:{{Front}}], "
-                        "[GTTS:en:{{text:Back}}]",
-                        parent,
-                    )
-                return
+                on_error("Old-style GTTS bracket tags must specify the "
+                         "voice, e.g. [GTTS:es:hola], [GTTS:es:{{Front}}], "
+                         "[GTTS:en:{{text:Back}}]")
+                return None
 
             svc_id = 'yandex'
 
         else:
             if len(components) < 3:
-                if show_errors:
-                    self._play_html_legacy_bad(
-                        legacy,
-                        "Old-style TTS bracket tags must specify service and "
-                        "voice, e.g. [TTS:g:es:mundo], [TTS:g:es:{{Front}}], "
-                        "[TTS:g:en:{{text:Back}}]",
-                        parent,
-                    )
-                return
+                on_error("Old-style TTS bracket tags must specify service and "
+                         "voice, e.g. [TTS:g:es:mundo], [TTS:g:es:{{Front}}], "
+                         "[TTS:g:en:{{text:Back}}]")
+                return None
 
             svc_id = components.pop(0)
 
@@ -382,22 +618,9 @@ class Reviewer(object):
         text = ':'.join(components)
         text = from_template(text)
         if not text:
-            return
+            return None
 
-        self._addon.router(
-            svc_id=svc_id,
-            text=text,
-            options={'voice': voice},
-            callbacks=dict(
-                okay=playback,
-                fail=lambda exception: (
-                    isinstance(exception, self._addon.router.BusyError) or
-                    not show_errors or
-                    self._play_html_legacy_bad(legacy, exception.message,
-                                               parent)
-                ),
-            ),
-        )
+        return dict(text=text, svc_id=svc_id, options={'voice': voice})
 
     def _play_html_legacy_bad(self, legacy, message, parent):
         """Reassembles the legacy given tag and displays an alert."""
@@ -416,9 +639,9 @@ class Reviewer(object):
             text=text,
             options=preset,
             callbacks=dict(
-                okay=self._addon.player.menu_click,
+                self._get_playbacks(self._addon.player.menu_click,
+                                    self._addon.player.otf_part),
                 fail=lambda exception: (
-                    isinstance(exception, self._addon.router.BusyError) or
                     self._alerts(exception.message, parent)
                 ),
             ),
@@ -434,7 +657,6 @@ class Reviewer(object):
             callbacks=dict(
                 okay=self._addon.player.menu_click,
                 fail=lambda exception: (
-                    isinstance(exception, self._addon.router.BusyError) or
                     self._alerts(exception.message, parent)
                 ),
             ),
@@ -445,11 +667,13 @@ class Reviewer(object):
 
         if state == 'question':
             self._play_html('front', card.q(),
-                            self._addon.player.menu_click, parent)
+                            self._addon.player.menu_click, parent,
+                            cards=[card.id])
 
         elif state == 'answer':
-            self._play_html('back', self._get_answer(card),
-                            self._addon.player.menu_click, parent)
+            self._play_html('back', self.get_answer(card),
+                            self._addon.player.menu_click, parent,
+                            cards=[card.id])
 
     def has_tts(self, state, card):
         """
@@ -458,7 +682,7 @@ class Reviewer(object):
         """
 
         html = (card.q() if state == 'question'
-                else self._get_answer(card) if state == 'answer'
+                else self.get_answer(card) if state == 'answer'
                 else None)
 
         return html and (BeautifulTTS(html)('tts') or
@@ -475,6 +699,39 @@ class BeautifulTTS(BeautifulSoup):  # pylint:disable=abstract-method
                          [('tts', [])])
 
 
+def get_days_until_due(col, card_ids):
+    """
+    Returns a dict mapping the given card IDs to how many days away
+    each card is due in the passed collection (zero or less if it is
+    due now or is in learning), or None for new cards. Suspended and
+    deleted cards are left out. Must be called on the main thread.
+    """
+
+    if not col or not card_ids:
+        return {}
+
+    today = col.sched.today
+    card_ids = list(card_ids)
+    days = {}
+
+    for start in range(0, len(card_ids), 500):
+        for card_id, card_type, queue, due in col.db.all(
+                'SELECT id, type, queue, due FROM cards WHERE id IN (%s)' %
+                ','.join(str(int(card_id))
+                         for card_id in card_ids[start:start + 500])
+        ):
+            if queue == -1:  # suspended
+                continue
+            elif queue == 1:  # learning, where due is a timestamp
+                days[card_id] = 0
+            elif card_type == 0:  # new
+                days[card_id] = None
+            else:
+                days[card_id] = due - today
+
+    return days
+
+
 def lax_dict_lookup(src, key, return_none=False):
     """
     Try to get a value out of the passed source dict with the passed
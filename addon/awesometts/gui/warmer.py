@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cache warm-up dialog for on-the-fly tags
+"""
+
+from collections import deque
+from json import dumps
+from re import compile as re
+
+from PyQt4 import QtCore, QtGui
+
+from .base import Dialog
+from .common import Note
+from .generator import _Progress
+from .reviewer import Reviewer
+
+__all__ = ['BrowserWarmer']
+
+
+class BrowserWarmer(Dialog):
+    """
+    Provides a dialog that can be invoked when the user wants to
+    generate the on-the-fly audio for a selection of cards in the card
+    browser ahead of time (e.g. before going offline), so that it is
+    already in the cache when those cards come up in review.
+    """
+
+    _RE_WHITESPACE = re(r'\s+')
+
+    __slots__ = [
+        '_alerts',    # callable for reporting errors and summaries
+        '_browser',   # reference to the current Anki browser window
+        '_card_ids',  # list of card IDs selected when window opened
+        '_process',   # state during processing; see accept() method below
+        '_reviewer',  # for extracting requests the same way as playback
+    ]
+
+    def __init__(self, browser, alerts, *args, **kwargs):
+        """
+        Sets our title and initializes our selected cards.
+        """
+
+        self._alerts = alerts
+        self._browser = browser
+        self._card_ids = None  # set in show()
+        self._process = None  # set in accept()
+
+        super(BrowserWarmer, self).__init__(
+            title="Prepare On-the-Fly Audio for Selected Cards",
+            *args, **kwargs
+        )
+
+        self._reviewer = Reviewer(addon=self._addon, alerts=alerts,
+                                  mw=browser.mw)
+
+    # UI Construction ########################################################
+
+    def _ui(self):
+        """
+        Prepares the basic layout structure, including the intro label
+        and help/okay/cancel buttons.
+        """
+
+        intro = Note()  # see show() for where the text is initialized
+        intro.setObjectName('intro')
+
+        layout = super(BrowserWarmer, self)._ui()
+        layout.addWidget(intro)
+        layout.addSpacing(self._SPACING)
+        layout.addWidget(Note(
+            "Both sides of each card will be checked for on-the-fly <tts> "
+            "tags, and any audio that is not already in the cache will be "
+            "generated. Nothing is added to your notes."
+        ))
+        layout.addWidget(self._ui_buttons())
+
+        return layout
+
+    def _ui_buttons(self):
+        """
+        Adjust title of the OK button.
+        """
+
+        buttons = super(BrowserWarmer, self)._ui_buttons()
+        buttons.findChild(QtGui.QAbstractButton, 'okay').setText("&Prepare")
+
+        return buttons
+
+    # Events #################################################################
+
+    def show(self, *args, **kwargs):
+        """
+        Initialize the introduction message based on what is selected.
+        """
+
+        self._card_ids = self._browser.selectedCards()
+
+        self.findChild(Note, 'intro').setText(
+            '%d card%s selected. To prepare a whole deck or note type, '
+            'search for it in the browser and select all of its cards.' %
+            (len(self._card_ids), "s" if len(self._card_ids) != 1 else "")
+        )
+
+        super(BrowserWarmer, self).show(*args, **kwargs)
+
+    def help_request(self):
+        """
+        Launch the web browser pointed at the on-the-fly usage page.
+        """
+
+        self._launch_link('usage/on-the-fly')
+
+    def accept(self):
+        """
+        Kick off the processing, which alternates between reading the
+        next card and sending requests found on it to the router.
+        """
+
+        self.setDisabled(True)
+
+        self._process = {
+            'aborted': False,
+            'progress': _Progress(
+                maximum=len(self._card_ids),
+                on_cancel=self._accept_abort,
+                title="Preparing On-the-Fly Audio",
+                addon=self._addon,
+                parent=self,
+            ),
+            'cards': deque(self._card_ids),
+            'requests': deque(),
+            'seen': {},
+            'running': 0,
+            'counts': {
+                'cards': 0,  # cards read
+                'total': 0,  # distinct requests found
+                'done': 0,   # requests finished
+                'okay': 0,   # requests which resulted in an MP3
+                'fail': 0,   # requests which resulted in an exception
+            },
+            'exceptions': {},
+            'throttling': {
+                'calls': {},  # unthrottled download calls made per service
+                'sleep': self._addon.config['throttle_sleep'],
+                'threshold': self._addon.config['throttle_threshold'],
+            },
+        }
+
+        self._process['progress'].show()
+        self._accept_next()
+
+    def _accept_abort(self):
+        """
+        Flags that the user has requested that processing stops.
+        """
+
+        self._process['aborted'] = True
+
+    def _accept_next(self):
+        """
+        Sends pending requests to the router, up to the pool size, if
+        not throttled; otherwise reads the next card for more requests.
+        """
+
+        proc = self._process
+        if not proc:
+            return  # a stray timer after processing has already finished
+
+        self._accept_update()
+        throttling = proc['throttling']
+
+        if proc['aborted'] or not (proc['cards'] or proc['requests']):
+            if not proc['running']:
+                self._accept_done()
+            return
+
+        if 'timer' in throttling:
+            return
+
+        if throttling['calls'] and \
+           max(throttling['calls'].values()) >= throttling['threshold']:
+            if proc['running']:
+                return  # wait for outstanding calls before sleeping
+
+            timer = QtCore.QTimer()
+            throttling['timer'] = timer
+            throttling['countdown'] = throttling['sleep']
+
+            timer.timeout.connect(self._accept_throttled)
+            timer.setInterval(1000)
+            timer.start()
+            return
+
+        if proc['requests']:
+            if proc['running'] < max(self._addon.config['pool_size'], 1):
+                self._accept_request(proc['requests'].popleft())
+                QtCore.QTimer.singleShot(0, self._accept_next)
+            return
+
+        card = self._browser.mw.col.getCard(proc['cards'].popleft())
+        proc['counts']['cards'] += 1
+
+        for side, html in [('front', card.q()),
+                           ('back', self._reviewer.get_answer(card))]:
+            for request in self._reviewer.parse_html(side, html):
+                key = dumps(request, sort_keys=True)
+                if key in proc['seen']:
+                    proc['seen'][key]['cards'].append(card.id)
+                else:
+                    request['cards'] = [card.id]
+                    proc['seen'][key] = request
+                    proc['requests'].append(request)
+                    proc['counts']['total'] += 1
+
+        QtCore.QTimer.singleShot(0, self._accept_next)
+
+    def _accept_request(self, request):
+        """
+        Sends a single request to the router at bulk priority.
+        """
+
+        proc = self._process
+        proc['running'] += 1
+        self._accept_update(request['text'])
+
+        def done():
+            """Count the processed request."""
+
+            proc['counts']['done'] += 1
+            proc['running'] -= 1
+
+        def okay(path):  # pylint:disable=unused-argument
+            """Count the success."""
+
+            proc['counts']['okay'] += 1
+
+        def fail(exception):
+            """Count the failure and the unique message."""
+
+            proc['counts']['fail'] += 1
+
+            message = exception.message
+            if isinstance(message, basestring):
+                message = self._RE_WHITESPACE.sub(' ', message).strip()
+
+            try:
+                proc['exceptions'][message] += 1
+            except KeyError:
+                proc['exceptions'][message] = 1
+
+        def miss(svc_id, count):
+            """Count the cache miss."""
+
+            try:
+                proc['throttling']['calls'][svc_id] += count
+            except KeyError:
+                proc['throttling']['calls'][svc_id] = count
+
+        callbacks = dict(
+            done=done, okay=okay, fail=fail, miss=miss,
+
+            # see BrowserGenerator for why this goes through a QTimer
+            then=lambda: QtCore.QTimer.singleShot(0, self._accept_next),
+        )
+
+        router = self._addon.router
+
+        if 'group' in request:
+            router.group(text=request['text'],
+                         group=request['group'],
+                         presets=self._addon.config['presets'],
+                         callbacks=callbacks,
+                         priority=router.Priority.BULK,
+                         cards=request['cards'])
+        else:
+            router(svc_id=request['svc_id'],
+                   text=request['text'],
+                   options=request['options'],
+                   callbacks=callbacks,
+                   priority=router.Priority.BULK,
+                   cards=request['cards'])
+
+    def _accept_throttled(self):
+        """
+        Called for every "timeout" of the timer during a throttling.
+        """
+
+        throttling = self._process['throttling']
+        throttling['countdown'] -= 1
+
+        if self._process['aborted'] or throttling['countdown'] <= 0:
+            throttling['timer'].stop()
+            del throttling['countdown']
+            del throttling['timer']
+            throttling['calls'] = {}
+            self._accept_next()
+        else:
+            self._accept_update()
+
+    def _accept_update(self, detail=None):
+        """
+        Update the progress bar and message.
+        """
+
+        proc = self._process
+        counts = proc['counts']
+
+        proc['progress'].update(
+            label="read %d of %d cards\n"
+                  "%d of %d clips finished, %d failed\n"
+                  "\n"
+                  "%s" % (
+                      counts['cards'],
+                      len(self._card_ids),
+                      counts['done'],
+                      counts['total'],
+                      counts['fail'],
+
+                      "sleeping for %d second%s" % (
+                          proc['throttling']['countdown'],
+                          "s"
+                          if proc['throttling']['countdown'] != 1
+                          else ""
+                      )
+                      if 'countdown' in proc['throttling']
+                      else " "
+                  ),
+            value=counts['cards'],
+            detail=detail,
+        )
+
+    def _accept_done(self):
+        """
+        Display statistics and close out the dialog.
+        """
+
+        proc = self._process
+        proc['progress'].accept()
+        counts = proc['counts']
+
+        messages = [
+            "%d of the %d card%s you selected %s read, with %d distinct "
+            "on-the-fly clip%s found. " % (
+                counts['cards'],
+                len(self._card_ids),
+                "s" if len(self._card_ids) != 1 else "",
+                "were" if counts['cards'] != 1 else "was",
+                counts['total'],
+                "s" if counts['total'] != 1 else "",
+            ),
+
+            "%d %s ready in the cache" % (
+                counts['okay'],
+                "is" if counts['okay'] == 1 else "are",
+            ),
+        ]
+
+        if counts['fail']:
+            messages.append(", but %d failed.\n\n" % counts['fail'])
+            messages.append("The following problem%s encountered:" % (
+                " was" if len(proc['exceptions']) == 1 else "s were"
+            ))
+            messages += [
+                "\n- %s (%d time%s)" %
+                (message, count, "s" if count != 1 else "")
+                for message, count
+                in proc['exceptions'].items()
+            ]
+        else:
+            messages.append(".")
+
+        if proc['aborted']:
+            messages.append("\n\nYou aborted processing before every card "
+                            "was prepared.")
+
+        self.setDisabled(False)
+        self._card_ids = None
+        self._process = None
+
+        super(BrowserWarmer, self).accept()
+
+        # this alert is done by way of a singleShot() callback to avoid random
+        # crashes on Mac OS X, which happen <5% of the time if called directly
+        QtCore.QTimer.singleShot(
+            0,
+            lambda: self._alerts("".join(messages), self._browser),
+        )
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Setup of the core components without Anki's GUI
+
+Nothing here (or in the modules this pulls in) needs Qt or aqt, so the
+router, cache, and text sanitization can also be driven from the
+command-line tools, e.g. on a build machine. The `anki` package (and
+the BeautifulSoup module that ships with it) must still be importable.
+"""
+
+import os
+from os.path import join
+from time import time
+
+from . import conversion as to, paths, service
+from .bundle import Bundle
+from .catalog import Catalog
+from .config import Config
+from .executors import ThreadExecutor
+from .failures import Failures
+from .router import Router
+from .text import RULES_FROM_NOTE, RULES_FROM_USER, Sanitizer
+
+__all__ = ['AGENT', 'CONFIG_COLS', 'VERSION', 'WEB', 'build', 'dispatch',
+           'get_cache_path', 'get_platform_info', 'parse_svc_values']
+
+
+def get_platform_info():
+    """Exception-tolerant platform information for use with AGENT."""
+
+    implementation = system_description = "???"
+    python_version = "?.?.?"
+
+    try:
+        import platform
+    except:  # catch-all, pylint:disable=bare-except
+        pass
+    else:
+        try:
+            implementation = platform.python_implementation()
+        except:  # catch-all, pylint:disable=bare-except
+            pass
+
+        try:
+            python_version = platform.python_version()
+        except:  # catch-all, pylint:disable=bare-except
+            pass
+
+        try:
+            system_description = platform.platform().replace('-', ' ')
+        except:  # catch-all, pylint:disable=bare-except
+            pass
+
+    return "%s %s; %s" % (implementation, python_version, system_description)
+
+VERSION = '1.11.0-dev'
+
+WEB = 'https://ankiatts.appspot.com'
+
+AGENT = 'AwesomeTTS/%s (headless; %s)' % (VERSION, get_platform_info())
+
+# n.b. These are the configuration columns needed by the router, the
+# services, and the note sanitizer. The add-on defines the rest of its
+# columns (many of which need Qt for their defaults) on top of these.
+
+CONFIG_COLS = [
+    ('cache_mb', 'integer', 0, int, int),
+    ('cache_policy', 'text', 'lru', str, str),
+    ('concurrency', 'text', {}, to.deserialized_dict, to.compact_json),
+    ('ellip_note_newlines', 'integer', False, to.lax_bool, int),
+    ('extras', 'text', {}, to.deserialized_dict, to.compact_json),
+    ('groups', 'text', {}, to.deserialized_dict, to.compact_json),
+    ('lame_flags', 'text', '--quiet -q 2', str, str),
+    ('pool_size', 'integer', 6, int, int),
+    ('presets', 'text', {}, to.deserialized_dict, to.compact_json),
+    ('spec_note_count', 'text', '', unicode, unicode),
+    ('spec_note_count_wrap', 'integer', True, to.lax_bool, int),
+    ('spec_note_ellipsize', 'text', '', unicode, unicode),
+    ('spec_note_strip', 'text', '', unicode, unicode),
+    ('strip_note_braces', 'integer', False, to.lax_bool, int),
+    ('strip_note_brackets', 'integer', False, to.lax_bool, int),
+    ('strip_note_parens', 'integer', False, to.lax_bool, int),
+    ('sub_note_cloze', 'text', 'anki', str, str),
+    ('sul_note', 'text', [], to.substitution_list, to.substitution_json),
+]
+
+
+def build(logger, config_path=paths.CONFIG, cache_dir=paths.CACHE,
+          executor=ThreadExecutor, overrides=None):
+    """
+    Returns a bundle with the user's configuration (as a plain dict),
+    the cache catalog, a router, and note and user text sanitizers,
+    set up the same way as they are in the add-on.
+
+    The configuration is read once from the given database (by default,
+    the add-on's own) and is not written back; any overrides are only
+    applied to the returned copy (e.g. to change the pool size for one
+    run). By default, the router shares the add-on's cache directory.
+    The cache catalog (and the store of failed requests) is kept in the
+    same database as the configuration, so a different cache directory
+    should go with a different database.
+
+    The executor is passed on to the router; see the executors module.
+    """
+
+    stored = Config(
+        db=Bundle(path=config_path,
+                  table='general',
+                  normalize=to.normalized_ascii),
+        cols=CONFIG_COLS,
+        logger=logger,
+    )
+
+    config = {col[0]: stored[col[0]] for col in CONFIG_COLS}
+    if overrides:
+        config.update(overrides)
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    catalog = Catalog(
+        db=Bundle(path=config_path,
+                  table='cache'),
+        cache_dir=cache_dir,
+        logger=logger,
+    )
+
+    router = Router(
+        services=Bundle(
+            mappings=service.MAPPINGS,
+            dead=service.DEAD,
+            aliases=service.ALIASES,
+            normalize=to.normalized_ascii,
+            args=(),
+            kwargs=dict(temp_dir=paths.TEMP,
+                        lame_flags=lambda: config['lame_flags'],
+                        normalize=to.normalized_ascii,
+                        logger=logger,
+                        ecosystem=Bundle(web=WEB, agent=AGENT)),
+        ),
+        cache_dir=cache_dir,
+        catalog=catalog,
+        failures=Failures(
+            db=Bundle(path=config_path,
+                      table='failures'),
+            logger=logger,
+        ),
+        temp_dir=join(cache_dir, '.scratch', str(int(time()))),
+        logger=logger,
+        config=config,
+        executor=executor,
+    )
+    router.migrate_cache()
+
+    return Bundle(
+        config=config,
+        catalog=catalog,
+        router=router,
+        strip=Bundle(
+            from_note=Sanitizer(RULES_FROM_NOTE, config=config,
+                                logger=logger),
+            from_user=Sanitizer(rules=RULES_FROM_USER, logger=logger),
+        ),
+    )
+
+
+def dispatch(tts, request, callbacks, priority):
+    """
+    Sends a request to the router of a bundle returned by build(). The
+    request is a dict with the text and one of a service (plus its
+    options), a preset (whose options the request's may override), or
+    a group. The callbacks are as for the router.
+
+    Raises a KeyError if the named preset or group does not exist or a
+    ValueError if the request names none of them.
+    """
+
+    if request.get('group'):
+        tts.router.group(text=request['text'],
+                         group=_lookup(tts.config, 'groups',
+                                       request['group']),
+                         presets=tts.config['presets'],
+                         callbacks=callbacks,
+                         priority=priority)
+
+    else:
+        svc_id, options = _get_service(tts, request)
+        tts.router(svc_id=svc_id, text=request['text'], options=options,
+                   callbacks=callbacks, priority=priority)
+
+
+def get_cache_path(tts, request):
+    """
+    Returns where the given request (see dispatch()) would be cached,
+    without running it, or None for a group, whose choice of preset is
+    only known once it has run. Invalid requests raise an exception.
+    """
+
+    if request.get('group'):
+        return None
+
+    svc_id, options = _get_service(tts, request)
+    return tts.router.get_cache_path(svc_id, request['text'], options)
+
+
+def parse_svc_values(pairs, convert):
+    """
+    Returns a dict for a list of SVC=VALUE strings (e.g. from the
+    command line), with the service IDs normalized and aliases resolved
+    and each value passed through the given conversion.
+    """
+
+    aliases = {to.normalized_ascii(alias): to.normalized_ascii(svc_id)
+               for alias, svc_id in service.ALIASES}
+
+    values = {}
+    for pair in pairs:
+        svc_id, value = pair.split('=', 1)
+        svc_id = to.normalized_ascii(svc_id)
+        values[aliases.get(svc_id, svc_id)] = convert(value)
+    return values
+
+
+def _get_service(tts, request):
+    """
+    Returns the service ID and options for a service or preset request.
+    """
+
+    if request.get('preset'):
+        preset = dict(_lookup(tts.config, 'presets', request['preset']))
+        return preset.pop('service'), dict(preset,
+                                           **request.get('options', {}))
+
+    if request.get('service'):
+        return request['service'], dict(request.get('options', {}))
+
+    raise ValueError("No service, preset, or group was given")
+
+
+def _lookup(config, kind, name):
+    """Returns the named preset or group, raising KeyError if missing."""
+
+    try:
+        return config[kind][name]
+    except KeyError:
+        raise KeyError("There is no %s named '%s'" % (kind[:-1], name))
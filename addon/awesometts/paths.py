@@ -30,6 +30,7 @@ __all__ = [
     'CACHE',
     'CONFIG',
     'LOG',
+    'SCRATCH',
     'TEMP',
 ]
 
@@ -52,4 +53,9 @@ CONFIG = os.path.join(ADDON, 'config.db')
 
 LOG = os.path.join(ADDON, 'addon.log')
 
+# n.b. Scratch files (i.e. human-readable filenames) are kept alongside
+# the cache so that they can be hard links to the cached files.
+
+SCRATCH = os.path.join(CACHE, '.scratch')
+
 TEMP = tempfile.gettempdir()
@@ -83,6 +83,14 @@ class Player(object):
         self._insert_blanks(0, "on-the-fly shortcut", path)
         self._anki.native(path)
 
+    def otf_part(self, path):
+        """
+        Play path with no delay, as a later part of a clip whose earlier
+        parts were already played (or queued), so it follows them.
+        """
+
+        self._anki.native(path)
+
     def native_wrapper(self, path):
         """
         Provides a function that can be used as a wrapper around the
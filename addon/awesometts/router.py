@@ -20,26 +20,44 @@
 Dispatch management of available services
 """
 
+from collections import OrderedDict
+from multiprocessing import cpu_count
 import os
 import os.path
 from random import shuffle
 import re
-from httplib import IncompleteRead
-from socket import error as SocketError
+from shutil import copyfile, move
+import sys
+from threading import RLock
 from time import time
-from urllib2 import URLError
-
-from PyQt4 import QtCore, QtGui
 
+from .executors import Priority, ThreadExecutor, _prefixed
 from .service import Trait as BaseTrait
 
 __all__ = ['Router']
 
 
-_SIGNAL = QtCore.SIGNAL('awesomeTtsThreadDone')
+EVICTION_COUNT = 100  # most files each background eviction pass deletes
+
+EVICTION_SVC_ID = '_eviction'  # pseudo-service the executor runs passes as
+
+MIGRATION_COUNT = 500  # most files each background migration pass moves
+
+MIGRATION_SVC_ID = '_migration'  # pseudo-service for migration passes
+
+SCRATCH_STALE_SECS = 600  # delete human-readable files after ten minutes
+
+FICLONE = 0x40049409  # Linux ioctl for cloning a file, i.e. reflinking
+
+BATCH_SIZE = 50  # most bulk requests given to a service's run_batch()
 
-FAILURE_CACHE_SECS = 3600  # ignore/dump failures from cache after one hour
+CONCURRENCY_INTERNET = 2  # default simultaneous runs for online services
+try:
+    CONCURRENCY_LOCAL = cpu_count()  # default for services on this machine
+except NotImplementedError:
+    CONCURRENCY_LOCAL = 2
 
+RE_CACHE_FILENAME = re.compile(r'^(\w+)-([0-9a-f]{8})-[0-9a-f-]+\.mp3$')
 RE_MUSTACHE = re.compile(r'\{?\{\{(.+?)\}\}\}?')
 RE_UNSAFE = re.compile(r'[^\w\s()-]', re.UNICODE)
 RE_WHITESPACE = re.compile(r'[\0\s]+', re.UNICODE)
@@ -49,15 +67,6 @@ WINDOWS_RESERVED = ['com1', 'com2', 'com3', 'com4', 'com5', 'com6', 'com7',
                     'lpt5', 'lpt6', 'lpt7', 'lpt8', 'lpt9', 'nul', 'prn']
 
 
-def _prefixed(lines, prefix="!!! "):
-    """Take incoming `lines` and prefix each line with `prefix`."""
-
-    return "\n".join(
-        prefix + line
-        for line in (lines if isinstance(lines, list) else lines.split("\n"))
-    )
-
-
 class Router(object):
     """
     Allows the registration, lookup, and routing of concrete Service
@@ -66,25 +75,36 @@ class Router(object):
     By having a routing-like object sit in-between the UI and the actual
     service code, Service implementations can be lazily loaded and their
     results can be cached, transparently to both sides.
+
+    The router itself does not depend on Qt or Anki. Where service calls
+    run, and on which thread callbacks are delivered, is up to the
+    executor class it is given (see the executors module).
     """
 
-    Trait = BaseTrait
+    Priority = Priority
 
-    class BusyError(RuntimeError):
-        """Raised for requests for files that are already underway."""
+    Trait = BaseTrait
 
     __slots__ = [
-        '_busy',       # list of file paths that are in-progress
+        '_batches',    # open batches of bulk requests, by service & options
+        '_busy',       # in-progress file paths to their job and waiters
         '_cache_dir',  # path for writing cached media files
+        '_catalog',    # index of the files in the cache directory
         '_config',     # user configuration (dict-like)
-        '_failures',   # lookup of file paths that raised exceptions
+        '_evicting',   # True while a cache eviction pass is queued/running
+        '_executor',   # schedules and runs service calls; see executors
+        '_failures',   # store of requests that failed, by cache path
+        '_lock',       # guards in-progress and service lookups
+        '_migrating',  # True while a cache migration pass is queued/running
         '_logger',     # logger-like interface with debug(), info(), etc.
-        '_pool',       # instance of the _Pool class for managing threads
+        '_policies',   # dict of cache eviction policies besides plain LRU
+        '_scratch',    # human-readable files written to when, oldest first
         '_services',   # bundle with dead services, aliases, avail, lookup
         '_temp_dir',   # path for writing human-readable filenames
     ]
 
-    def __init__(self, services, cache_dir, temp_dir, logger, config):
+    def __init__(self, services, cache_dir, catalog, failures, temp_dir,
+                 logger, config, executor=ThreadExecutor, policies=None):
         """
         The services should be a bundle with the following:
 
@@ -97,11 +117,29 @@ class Router(object):
             - config (dict-like): user configuration lookup
 
         The cache directory should be one where media files get stored
-        for a semi-permanent time.
+        for a semi-permanent time. The catalog keeps track of the files
+        in that directory, so that hit checks do not have to go to the
+        file system. The failures store remembers which requests to
+        online services failed, so they are not made again too soon.
 
         The logger object should have an interface like the one used by
         the standard library logging module, with debug(), info(), and
         so on, available.
+
+        The executor should be an Executor subclass (or a compatible
+        callable), which is constructed with the pool size, a per-service
+        limit lookup, and the logger. If callbacks need to arrive on a
+        particular thread (e.g. a GUI thread), the executor must see to
+        that; the default ThreadExecutor calls them from its workers.
+
+        The policies, if given, are a dict of named cache eviction
+        policies (e.g. a catalog DuePolicy) that the user may choose
+        with the cache_policy setting instead of plain LRU.
+
+        Human-readable files are written to the temporary directory as
+        hard links to the cached files where possible, so it is best
+        kept on the same file system as the cache directory. They are
+        deleted again after a few minutes.
         """
 
         services.aliases = {
@@ -120,12 +158,21 @@ class Router(object):
             for svc_id, svc_class in services.mappings
         }
 
-        self._busy = []
+        self._batches = {}
+        self._busy = {}
         self._cache_dir = cache_dir
+        self._catalog = catalog
         self._config = config
-        self._failures = {}
+        self._evicting = False
+        self._executor = executor(size=lambda: config['pool_size'],
+                                  limit=self._get_limit,
+                                  logger=logger)
+        self._failures = failures
+        self._lock = RLock()
+        self._migrating = False
         self._logger = logger
-        self._pool = _Pool(logger)
+        self._policies = policies or {}
+        self._scratch = OrderedDict()
         self._services = services
         self._temp_dir = temp_dir
 
@@ -229,32 +276,178 @@ class Router(object):
         svc_id, service = self._fetch_options_and_extras(svc_id)
         return service['extras']
 
-    def get_failure_count(self):
+    def get_concurrency(self):
+        """
+        Returns a list of tuples with the service ID, name, and default
+        concurrency limit for every registered service, sorted by name.
+        The services themselves are not initialized.
+        """
+
+        return sorted([
+            (svc_id, service['name'], self._get_limit_default(service))
+            for svc_id, service in self._services.lookup.items()
+        ], key=lambda (svc_id, name, limit): name.lower())
+
+    def shutdown(self):
+        """
+        Stops the executor's workers once they finish whatever they are
+        running now. Workers are started again if more work arrives.
+        """
+
+        self._executor.shutdown()
+
+    def get_cache_stats(self):
+        """
+        Returns the number of files in the cache and their total size
+        in bytes.
+        """
+
+        return self._catalog.stats()
+
+    def get_cache_path(self, svc_id, text, options):
+        """
+        Returns the path that the given request would be cached at,
+        without running the service. The file may or may not be there.
+
+        Unlike with the bare call method, invalid requests raise their
+        exception (e.g. a KeyError for an unknown service or a
+        ValueError for bad options or text) directly.
         """
-        Returns the number of cached failures, after dumping any expired
-        entries from the cache.
+
+        return self._resolve(svc_id, text, options)[4]
+
+    def clear_cache(self):
+        """
+        Deletes all files in the cache, returning the number of files
+        that were deleted and the number that could not be.
+        """
+
+        return self._catalog.purge(self._catalog.paths())
+
+    def evict_cache(self):
         """
+        If the user has set a size budget for the cache (cache_mb) and
+        the cache is over it, queues a pass at bulk priority that deletes
+        the least recently used files, or the least needed ones according
+        to the eviction policy chosen with cache_policy. Passes are kept
+        short and keep queueing another one until the cache is under
+        budget, so a large eviction never holds up other work for long.
+
+        The policy is consulted on the calling thread, which is also the
+        thread that executor callbacks are delivered on.
+        """
+
+        budget = self._config['cache_mb'] * 1024 * 1024
+        if not budget or self._catalog.size() <= budget:
+            return
+
+        with self._lock:
+            if self._evicting:
+                return
+            self._evicting = True
+
+        policy = self._policies.get(self._config['cache_policy'])
+        try:
+            order = policy and policy(self._catalog.linked_cards())
+        except Exception as exception:  # catch all, pylint:disable=W0703
+            self._logger.warn("Cache eviction policy failed; using LRU: %s",
+                              exception)
+            order = None
+
+        evicted = []
+
+        def callback(exception):
+            """Clear the flag and queue another pass if warranted."""
+
+            with self._lock:
+                self._evicting = False
+
+            if exception:
+                self._logger.warn("Cache eviction failed: %s", exception)
+            elif evicted[0] >= EVICTION_COUNT:
+                self.evict_cache()
+
+        self._executor.spawn(
+            svc_id=EVICTION_SVC_ID,
+            task=lambda: evicted.append(self._catalog.evict(budget,
+                                                            EVICTION_COUNT,
+                                                            order)),
+            callback=callback,
+            priority=Priority.BULK,
+        )
+
+    def migrate_cache(self):
+        """
+        Queues a pass at bulk priority that moves files left at the top
+        of the cache directory by older versions into the subdirectories
+        that cache paths now use (see _path_cache()), queueing another
+        pass for as long as there are more, so startup is not held up
+        by a large cache. Until a file is moved, a hit on its new path
+        moves it right away.
+        """
+
+        with self._lock:
+            if self._migrating:
+                return
+            self._migrating = True
 
-        now = time()
-        for path, (when, _) in self._failures.items():
-            if now - when > FAILURE_CACHE_SECS:
-                del self._failures[path]
+        moved = []
 
-        return len(self._failures)
+        def callback(exception):
+            """Clear the flag and queue another pass if warranted."""
+
+            with self._lock:
+                self._migrating = False
+
+            if exception:
+                self._logger.warn("Cache migration failed: %s", exception)
+            elif moved[0] >= MIGRATION_COUNT:
+                self.migrate_cache()
+
+        self._executor.spawn(
+            svc_id=MIGRATION_SVC_ID,
+            task=lambda: moved.append(self._catalog.migrate(self._path_shard,
+                                                            MIGRATION_COUNT)),
+            callback=callback,
+            priority=Priority.BULK,
+        )
+
+    def rebuild_cache(self):
+        """
+        Repairs the cache catalog from the contents of the cache
+        directory, returning the number of entries added and dropped.
+        Any files found at the top of the cache directory are then
+        migrated in the background.
+        """
+
+        result = self._catalog.rebuild()
+        self.migrate_cache()
+        return result
+
+    def get_failure_count(self):
+        """
+        Returns the number of remembered failures, after dumping any
+        expired entries from the store.
+        """
+
+        return self._failures.count()
 
     def forget_failures(self):
-        """Delete the cache of remembered failures."""
+        """Delete the store of remembered failures."""
 
-        self._failures = {}
+        self._failures.clear()
 
     def group(self, text, group, presets, callbacks,
-              want_human=False, note=None):
+              want_human=False, note=None, priority=Priority.INTERACTIVE,
+              cards=None):
         """
         Execute a group playback request using the passed group to be
         looked up using the passed presets.
 
-        The callbacks follow the same rules as in the regular bare call
-        method.
+        The callbacks, priority, and cards follow the same rules as in
+        the regular bare call method, except that a part callback is
+        never called, as a preset whose segments have started to arrive
+        could still fail over to the next one in the group.
 
         If passed, want_human should be a template string that dictates
         how the caller wants the filename in the path to be formatted.
@@ -296,18 +489,7 @@ class Router(object):
                 if 'then' in callbacks:
                     callbacks['then']()
 
-            def on_fail(exception):
-                """Go to next, unless playback already queued."""
-                if isinstance(exception, self.BusyError):
-                    if 'done' in callbacks:
-                        callbacks['done']()
-                    callbacks['fail'](exception)
-                    if 'then' in callbacks:
-                        callbacks['then']()
-                else:
-                    try_next()
-
-            internal_callbacks = dict(okay=on_okay, fail=on_fail)
+            internal_callbacks = dict(okay=on_okay, fail=lambda _: try_next())
             if 'miss' in callbacks:
                 internal_callbacks['miss'] = callbacks['miss']
 
@@ -329,12 +511,14 @@ class Router(object):
                     svc_id = preset.pop('service')
                     self(svc_id=svc_id, text=text, options=preset,
                          callbacks=internal_callbacks,
-                         want_human=want_human, note=note)
+                         want_human=want_human, note=note, priority=priority,
+                         cards=cards)
 
             try_next()
 
     def __call__(self, svc_id, text, options, callbacks,
-                 want_human=False, note=None):
+                 want_human=False, note=None, priority=Priority.INTERACTIVE,
+                 cards=None):
         """
         Given the service ID and associated options, pass the text into
         the service for processing.
@@ -354,11 +538,18 @@ class Router(object):
 
             - 'done' (optional): called before the okay/fail callback
             - 'miss' (optional): called after done with a svc_id and download
-               count if a cache miss occurred running the service
+               count if a cache miss occurred running the service (for
+               callers that joined a run already in progress for the same
+               path, the count is zero)
             - 'okay' (required): called with a path to the media file
             - 'fail' (required): called with an exception for validation
                errors or failed service calls occurs
             - 'then' (optional): called after the okay/fail callback
+            - 'part' (optional): called on a cache miss with a path to
+               each segment of the media file, in order, as soon as the
+               service has it, if the service downloads it in segments
+               (see Service.run_progressive()); the okay callback still
+               gets the whole file once all of them are done
 
         Because it is asynchronous in nature, this method does not raise
         exceptions normally; they are passed to callbacks['fail'].
@@ -379,6 +570,19 @@ class Router(object):
         how the caller wants the filename in the path to be formatted.
         Additionally, note may be passed to provide mustache values for
         the given template string.
+
+        The priority should be one of the Priority values and determines
+        how soon the service is run if there is a cache miss; requests
+        from the user interface should be left as INTERACTIVE, whereas
+        batch processing should pass BULK. If the same file is requested
+        again at a more urgent priority while it is still waiting to be
+        run, the request is promoted. BULK requests to a service with a
+        run_batch() method (e.g. eSpeak) that wait in the queue behind
+        others are run together, one batch per set of options.
+
+        If the text comes from cards (e.g. an on-the-fly tag), their IDs
+        may be passed as cards, and the catalog will link them to the
+        file so that eviction can take their due dates into account.
         """
 
         self._call_assert_callbacks(callbacks)
@@ -386,14 +590,11 @@ class Router(object):
         try:
             self._logger.debug("Call for '%s' w/ %s", svc_id, options)
 
-            if not text:
-                raise ValueError("No speakable text is present")
-            svc_id, service, options = self._validate_service(svc_id, options)
-            text = service['instance'].modify(text)
-            if not text:
-                raise ValueError("Text not usable by " + service['class'].NAME)
-            path = self._validate_path(svc_id, text, options)
-            cache_hit = os.path.exists(path)
+            svc_id, service, text, options, path = \
+                self._resolve(svc_id, text, options)
+            cache_hit = self._catalog.hit(path)
+            if cards:
+                self._catalog.link(path, cards)
 
             self._logger.debug(
                 "Parsed call to '%s' w/ %s and \"%s\" at %s (cache %s)",
@@ -445,7 +646,7 @@ class Router(object):
                 return path
 
             if not os.path.isdir(self._temp_dir):
-                os.mkdir(self._temp_dir)
+                os.makedirs(self._temp_dir)
 
             def substitute(match):
                 """Perform variable substitution on filename."""
@@ -485,12 +686,39 @@ class Router(object):
                 filename = filename[0:90]  # accommodate NTFS path limits
             filename = 'ATTS ' + filename + '.mp3'
 
-            from shutil import copyfile
             new_path = os.path.join(self._temp_dir, filename)
-            copyfile(path, new_path)
+            self._sweep_scratch()
+            _materialize(path, new_path)
+
+            with self._lock:
+                self._scratch.pop(new_path, None)
+                self._scratch[new_path] = time()
 
             return new_path
 
+        failure = None if cache_hit else self._failures.get(path)
+
+        with self._lock:
+            busy = None if cache_hit or failure else self._busy.get(path)
+            attached = bool(busy)
+            if attached:
+                self._logger.debug("Attaching to request already underway "
+                                   "for %s", path)
+                busy['waiters'].append((callbacks, human))
+
+                if priority < busy['priority']:
+                    busy['priority'] = priority
+                    if busy['job']:
+                        self._executor.promote(busy['job'], priority)
+
+            elif not cache_hit and not failure:
+                # n.b. The creator's own waiter goes in while the lock is
+                # still held, so that a caller attaching right after this
+                # can never be mistaken for (or by) the creator.
+                busy = self._busy[path] = dict(job=None, priority=priority,
+                                               waiters=[(callbacks, human)],
+                                               parts=[], sent={})
+
         if cache_hit:
             if 'done' in callbacks:
                 callbacks['done']()
@@ -498,63 +726,140 @@ class Router(object):
             if 'then' in callbacks:
                 callbacks['then']()
 
-        elif (path in self._failures and
-              time() - self._failures[path][0] < FAILURE_CACHE_SECS):
+        elif failure:
             if 'done' in callbacks:
                 callbacks['done']()
-            callbacks['fail'](self._failures[path][1])
+            callbacks['fail'](failure)
             if 'then' in callbacks:
                 callbacks['then']()
 
+        elif attached:
+            # attached above; callbacks fire when the job completes, but
+            # any parts that have already arrived can be passed on now
+            if 'part' in callbacks:
+                self._pass_parts(busy)
+
         else:
             def on_error(exception):
                 """
-                For Internet-based services, cache errors. Certain
-                exceptions are not cached, as they are usually network
-                or connectivity errors.
-
-                Afterward, pass exception to the fail handler.
+                For Internet-based services, remember errors. The store
+                decides how long for (and skips network errors on our
+                end, e.g. connectivity problems).
                 """
 
-                if BaseTrait.INTERNET in service['class'].TRAITS and \
-                   not isinstance(exception, IncompleteRead) and \
-                   not isinstance(exception, SocketError) and \
-                   not isinstance(exception, URLError):
-                    self._failures[path] = time(), exception
-                callbacks['fail'](exception)
+                if BaseTrait.INTERNET in service['class'].TRAITS:
+                    self._failures.add(path, svc_id, exception)
 
             service['instance'].net_reset()
-            self._busy.append(path)
 
-            def completion_callback(exception):
-                """Intermediate callback handler for all service calls."""
+            # the service writes to a staging path, which is only moved to
+            # the cache path once it is known to hold a complete MP3
+            staging = self._catalog.staging(path)
 
-                self._busy.remove(path)
+            def completion_callback(exception):
+                """
+                Intermediate callback handler for all service calls,
+                which passes the result on to every caller that asked
+                for this path while it was in-progress.
+                """
 
-                if 'done' in callbacks:
-                    callbacks['done']()
+                with self._lock:
+                    waiters = self._busy.pop(path)['waiters']
+                    busy['parts'] = None  # too late for any more parts
 
-                if 'miss' in callbacks:
-                    callbacks['miss'](svc_id, service['instance'].net_count())
+                self._sweep_scratch()
 
                 if exception:
+                    self._catalog.discard(staging)
                     on_error(exception)
-                elif os.path.exists(path):
-                    callbacks['okay'](human(path))
+                elif os.path.exists(staging):
+                    try:
+                        self._catalog.commit(staging, path, svc_id)
+                    except (EnvironmentError, ValueError) as error:
+                        exception = RuntimeError(
+                            "The %s service did not write out a usable MP3 "
+                            "(%s)." % (service['name'], error)
+                        )
+                        on_error(exception)
+                    else:
+                        if BaseTrait.INTERNET in service['class'].TRAITS:
+                            self._failures.forget(path)
+                        self.evict_cache()
                 else:
-                    on_error(RuntimeError(
+                    exception = RuntimeError(
                         "The %s service did not successfully write out an "
                         "MP3." % service['name']
-                    ))
+                    )
+                    on_error(exception)
 
-                if 'then' in callbacks:
-                    callbacks['then']()
+                for number, (waiter, waiter_human) in enumerate(waiters):
+                    if 'done' in waiter:
+                        waiter['done']()
+
+                    # every waiter missed the cache, but only the original
+                    # caller incurred the network ops
+                    if 'miss' in waiter:
+                        waiter['miss'](svc_id,
+                                       service['instance'].net_count()
+                                       if number == 0 else 0)
+
+                    if exception:
+                        waiter['fail'](exception)
+                    else:
+                        waiter['okay'](waiter_human(path))
+
+                    if 'then' in waiter:
+                        waiter['then']()
+
+            def on_part(part_path):
+                """
+                Moves a segment passed on by the service into the scratch
+                directory, recording it so that it gets cleaned up later,
+                and passes it on to the waiters that want parts, on the
+                executor's callback thread.
+                """
+
+                scratch_path = os.path.join(self._temp_dir,
+                                            os.path.basename(part_path))
+                try:
+                    if not os.path.isdir(self._temp_dir):
+                        os.makedirs(self._temp_dir)
+                    move(part_path, scratch_path)
+                except EnvironmentError as error:  # swept where it is
+                    self._logger.warn("Cannot move part %s to scratch: %s",
+                                      part_path, error)
+                else:
+                    part_path = scratch_path
+                self._sweep_scratch()
+
+                with self._lock:
+                    busy['parts'].append(part_path)
+                    self._scratch.pop(part_path, None)
+                    self._scratch[part_path] = time()
+
+                self._executor.notify(self._pass_parts, busy)
 
             def do_spawn():
-                """Call if ready to start a thread to run the service."""
-                self._pool.spawn(
-                    task=lambda: service['instance'].run(text, options, path),
+                """Call if ready to have the executor run the service."""
+                if busy['priority'] == Priority.BULK and \
+                        hasattr(service['instance'], 'run_batch'):
+                    self._spawn_batched(svc_id, service, options,
+                                        (text, staging, busy,
+                                         completion_callback))
+                    return
+
+                busy['job'] = self._executor.spawn(
+                    svc_id=svc_id,
+                    task=(
+                        lambda: service['instance'].run_progressive(
+                            text, options, staging, on_part,
+                        )
+                    ) if 'part' in callbacks else (
+                        lambda: service['instance'].run(text, options,
+                                                        staging)
+                    ),
                     callback=completion_callback,
+                    priority=busy['priority'],
                 )
 
             if hasattr(service['instance'], 'prerun'):
@@ -570,7 +875,7 @@ class Router(object):
                     completion_callback(exception)
 
                 try:
-                    service['instance'].prerun(text, options, path,
+                    service['instance'].prerun(text, options, staging,
                                                prerun_ok, prerun_error)
                 except Exception as exception:  # all, pylint:disable=W0703
                     self._logger.error("Synchronous exception in prerun: %s",
@@ -579,6 +884,98 @@ class Router(object):
             else:
                 do_spawn()
 
+    def _pass_parts(self, busy):
+        """
+        Passes the segments of an in-progress request that have arrived
+        so far on to each of its waiters with a part callback, skipping
+        the ones each has already had, unless the request is complete.
+        """
+
+        calls = []
+
+        with self._lock:
+            if not busy['parts']:
+                return
+
+            for number, (waiter, _) in enumerate(busy['waiters']):
+                if 'part' in waiter:
+                    sent = busy['sent'].get(number, 0)
+                    calls.extend((waiter['part'], part_path)
+                                 for part_path in busy['parts'][sent:])
+                    busy['sent'][number] = len(busy['parts'])
+
+        for callback, part_path in calls:
+            callback(part_path)
+
+    def _spawn_batched(self, svc_id, service, options, request):
+        """
+        Adds a bulk request (a tuple of its text, staging path, busy
+        entry, and completion callback) to the batch that is waiting in
+        the executor's queue for the same service and options, or spawns
+        a new batch if there is none (or it is full). Once the executor
+        gets to the batch, the service's run_batch() gets all of the
+        requests added to it by then, and each request's completion
+        callback is called with its own result.
+        """
+
+        key = (svc_id, repr(sorted(options.items())))
+
+        with self._lock:
+            batch = self._batches.get(key)
+            if batch and len(batch['requests']) < BATCH_SIZE:
+                batch['requests'].append(request)
+                request[2]['job'] = batch['job']
+                return
+
+            batch = self._batches[key] = dict(job=None, requests=[request])
+
+        results = []
+
+        def close():
+            """Stops any further requests being added to the batch."""
+
+            with self._lock:
+                if self._batches.get(key) is batch:
+                    del self._batches[key]
+
+        def task():
+            """Runs all of the requests in the batch as one call."""
+
+            close()
+            requests = batch['requests']
+            self._logger.debug("Running %d %s requests as a batch",
+                               len(requests), service['name'])
+            results.extend(service['instance'].run_batch(
+                [text for text, _, _, _ in requests],
+                options,
+                [staging for _, staging, _, _ in requests],
+            ))
+
+        def callback(exception):
+            """Completes each request in the batch with its result."""
+
+            close()
+            for number, (_, _, _, completion_callback) in \
+                    enumerate(batch['requests']):
+                completion_callback(
+                    exception or
+                    (results[number] if number < len(results)
+                     else RuntimeError("The %s service did not return a "
+                                       "result." % service['name']))
+                )
+
+        job = self._executor.spawn(
+            svc_id=svc_id,
+            task=task,
+            callback=callback,
+            priority=Priority.BULK,
+        )
+
+        with self._lock:
+            batch['job'] = job
+            for _, _, busy, _ in batch['requests']:
+                busy['job'] = job
+
     def _call_assert_callbacks(self, callbacks):
         """Checks the callbacks argument for validity."""
 
@@ -587,6 +984,24 @@ class Router(object):
         assert 'okay' in callbacks and callable(callbacks['okay'])
         assert 'fail' in callbacks and callable(callbacks['fail'])
         assert 'then' not in callbacks or callable(callbacks['then'])
+        assert 'part' not in callbacks or callable(callbacks['part'])
+
+    def _resolve(self, svc_id, text, options):
+        """
+        Validates the request, returning a tuple of the normalized
+        service ID, its service lookup, the text as modified by the
+        service, the normalized options, and the cache path.
+        """
+
+        if not text:
+            raise ValueError("No speakable text is present")
+        svc_id, service, options = self._validate_service(svc_id, options)
+        text = service['instance'].modify(text)
+        if not text:
+            raise ValueError("Text not usable by " + service['class'].NAME)
+
+        return svc_id, service, text, options, \
+            self._path_cache(svc_id, text, options)
 
     def _validate_service(self, svc_id, options):
         """
@@ -686,22 +1101,6 @@ class Router(object):
 
         return problems
 
-    def _validate_path(self, svc_id, text, options):
-        """
-        Given the service ID, its associated options, and the desired
-        text, generate a cache path. If the file is already being
-        processed, raise a BusyError.
-        """
-
-        path = self._path_cache(svc_id, text, options)
-        if path in self._busy:
-            raise self.BusyError(
-                "The '%s' service is already busy processing %s." %
-                (svc_id, path)
-            )
-
-        return path
-
     def _fetch_options_and_extras(self, svc_id):
         """
         Identifies the service by its ID, checks to see if the options
@@ -816,6 +1215,12 @@ class Router(object):
         set the 'instance' to the resulting object.
         """
 
+        with self._lock:
+            self._load_service_locked(service)
+
+    def _load_service_locked(self, service):
+        """Helper method for _load_service(); caller holds the lock."""
+
         if 'instance' in service:
             return
 
@@ -838,6 +1243,53 @@ class Router(object):
                 service['name'], _prefixed(format_exc()),
             )
 
+    def _get_limit(self, svc_id):
+        """
+        Returns how many runs of the given (normalized) service may be
+        underway at once, preferring the user's configured limit.
+        """
+
+        if svc_id in [EVICTION_SVC_ID, MIGRATION_SVC_ID]:
+            return 1
+
+        return self._config['concurrency'].get(svc_id) or \
+            self._get_limit_default(self._services.lookup[svc_id])
+
+    def _get_limit_default(self, service):
+        """
+        Returns the concurrency limit advertised by the service class,
+        or a default based on whether the service is online or local.
+        """
+
+        return (
+            service['class'].CONCURRENCY or
+            (CONCURRENCY_INTERNET if BaseTrait.INTERNET in service['traits']
+             else CONCURRENCY_LOCAL)
+        )
+
+    def _sweep_scratch(self):
+        """
+        Deletes the human-readable files written more than a few minutes
+        ago, by which point their callers are done with them.
+        """
+
+        limit = time() - SCRATCH_STALE_SECS
+        stale = []
+
+        with self._lock:
+            while self._scratch:
+                path, when = next(self._scratch.iteritems())
+                if when >= limit:
+                    break
+                del self._scratch[path]
+                stale.append(path)
+
+        for path in stale:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
     def _path_cache(self, svc_id, text, options):
         """
         Returns a consistent cache path given the svc_id, text, and
@@ -868,150 +1320,105 @@ class Router(object):
         assert len(hex_digest) == 40, "unexpected output from hash library"
         return os.path.join(
             self._cache_dir,
-            '.'.join([
+            self._path_shard('.'.join([
                 '-'.join([
                     svc_id, hex_digest[:8], hex_digest[8:16],
                     hex_digest[16:24], hex_digest[24:32], hex_digest[32:],
                 ]),
                 'mp3',
-            ]),
-        )
-
-
-class _Pool(QtGui.QWidget):
-    """
-    Managers a pool of worker threads to keep the UI responsive.
-    """
-
-    __slots__ = [
-        '_current_id',  # the last/current worker ID in-use
-        '_logger',      # for writing messages about threads
-        '_threads',     # dict of IDs mapping workers and callbacks in Router
-    ]
-
-    def __init__(self, logger, *args, **kwargs):
-        """
-        Initialize my internal state (next ID and lookup pools for the
-        callbacks and workers).
-        """
-
-        super(_Pool, self).__init__(*args, **kwargs)
-
-        self._current_id = 0
-        self._logger = logger
-        self._threads = {}
-
-    def spawn(self, task, callback):
-        """
-        Create a worker thread for the given task. When the thread
-        completes, the callback will be called.
-        """
-
-        self._current_id += 1
-        thread = self._threads[self._current_id] = {
-            # keeping a reference to worker prevents garbage collection
-            'callback': callback,
-            'done': False,
-            'worker': _Worker(self._current_id, task),
-        }
-
-        self.connect(thread['worker'], _SIGNAL, self._on_worker_signal)
-        thread['worker'].finished.connect(self._on_worker_finished)
-        thread['worker'].start()
-
-        self._logger.debug(
-            "Spawned thread [%d]; pool=%s",
-            self._current_id, self._threads,
+            ])),
         )
 
-    def _on_worker_signal(self, thread_id, exception=None, stack_trace=None):
+    @staticmethod
+    def _path_shard(filename):
         """
-        When the worker signals it's done with its task, execute the
-        callback that was registered for it, passing on any exception.
+        Returns where a cache file with the given filename goes relative
+        to the cache directory, i.e. in a subdirectory for its service
+        and two more levels named after the start of its hash, so no
+        one directory ever holds too many files. Returns None if the
+        filename is not one that _path_cache() would produce.
         """
 
-        if exception:
-            if not (hasattr(exception, 'message') and
-                    isinstance(exception.message, basestring) and
-                    exception.message):
-                exception.message = format(exception) or \
-                    "No additional details available"
-
-            self._logger.debug(
-                "Exception from thread [%d] (%s); executing callback\n%s",
+        match = RE_CACHE_FILENAME.match(filename)
+        if not match:
+            return None
 
-                thread_id, exception.message,
+        svc_id, hex_digest = match.groups()
+        return os.path.join(svc_id, hex_digest[0:2], hex_digest[2:4],
+                            filename)
 
-                _prefixed(stack_trace)
-                if isinstance(stack_trace, basestring)
-                else "Stack trace unavailable",
-            )
 
-        else:
-            self._logger.debug(
-                "Completion from thread [%d]; executing callback",
-                thread_id,
-            )
+def _materialize(source, destination):
+    """
+    Puts the file at the source path at the destination path too,
+    replacing anything there, without copying its contents if that can
+    be helped: a hard link is tried first, then a reflink (copy-on-write
+    clone) where the file system supports them, then a plain copy.
+    """
 
-        self._threads[thread_id]['callback'](exception)
-        self._threads[thread_id]['done'] = True
+    try:
+        os.unlink(destination)
+    except OSError:
+        pass
 
-    def _on_worker_finished(self):
-        """
-        When the worker is finished, which happens sometime briefly
-        after it's done with its task, delete it from the thread pool if
-        its callback has already executed.
-        """
+    if not (_hard_link(source, destination) or
+            _reflink(source, destination)):
+        copyfile(source, destination)
 
-        thread_ids = [
-            thread_id
-            for thread_id, thread in self._threads.items()
-            if thread['done'] and thread['worker'].isFinished()
-        ]
 
-        if not thread_ids:
-            return
+def _hard_link(source, destination):
+    """Tries to hard link the destination to the source file."""
 
-        for thread_id in thread_ids:
-            del self._threads[thread_id]
+    if hasattr(os, 'link'):
+        try:
+            os.link(source, destination)
+        except OSError:
+            return False
+        return True
 
-        self._logger.debug(
-            "Reaped thread%s %s; pool=%s",
-            "s" if len(thread_ids) != 1 else "", thread_ids, self._threads,
-        )
+    if sys.platform.startswith('win'):
+        try:
+            from ctypes import windll
+            return bool(windll.kernel32.CreateHardLinkW(
+                unicode(destination), unicode(source), None))
+        except Exception:  # catch all, pylint:disable=broad-except
+            return False
 
+    return False
 
-class _Worker(QtCore.QThread):
-    """
-    Generic worker for running processes in the background.
-    """
 
-    __slots__ = [
-        '_thread_id',  # my thread ID; used to communicate back to main thread
-        '_task',       # the task I will need to call when run
-    ]
+def _reflink(source, destination):
+    """Tries to clone the source file copy-on-write at the destination."""
 
-    def __init__(self, thread_id, task):
-        """
-        Save my worker ID and task.
-        """
+    if sys.platform.startswith('linux'):
+        from fcntl import ioctl
+        try:
+            with open(source, 'rb') as input_file, \
+                    open(destination, 'wb') as output_file:
+                ioctl(output_file.fileno(), FICLONE, input_file.fileno())
+        except EnvironmentError:
+            try:
+                os.unlink(destination)
+            except OSError:
+                pass
+            return False
+        return True
 
-        super(_Worker, self).__init__()
+    if sys.platform == 'darwin':
+        try:
+            from ctypes import CDLL
+            from ctypes.util import find_library
+            clonefile = CDLL(find_library('c')).clonefile  # macOS 10.12+
+            return clonefile(_encode_path(source), _encode_path(destination),
+                             0) == 0
+        except Exception:  # catch all, pylint:disable=broad-except
+            return False
 
-        self._id = thread_id
-        self._task = task
+    return False
 
-    def run(self):
-        """
-        Run my assigned task. If an exception is raised, pass it back to
-        the main thread via the callback.
-        """
 
-        try:
-            self._task()
-        except Exception as exception:  # catch all, pylint:disable=W0703
-            from traceback import format_exc
-            self.emit(_SIGNAL, self._id, exception, format_exc())
-            return
+def _encode_path(path):
+    """Returns the path as a byte string for the file system."""
 
-        self.emit(_SIGNAL, self._id)
+    return path.encode(sys.getfilesystemencoding() or 'utf-8') \
+        if isinstance(path, unicode) else path
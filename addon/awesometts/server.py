@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+HTTP synthesis server sharing the router and cache with other tools
+
+    GET /tts?service=google&voice=en&text=Hello
+    GET /tts?preset=My+Voice&text=Hello
+    GET /tts?group=My+Group&text=Hello
+    GET /stats
+
+Every query parameter other than text, service, preset, and group is
+passed on as a service option. Clips are returned as audio/mpeg with
+an ETag derived from their cache path (i.e. a hash of the service,
+text, and options), so clients sending If-None-Match get a 304 without
+anything being generated.
+
+Identical requests running at the same time share one service call
+(the router coalesces them), and the number of service calls is held
+to the configured pool size and per-service limits.
+"""
+
+import argparse
+from json import dumps
+import logging
+import os.path
+from SocketServer import ThreadingMixIn
+import sys
+from threading import Event, Lock
+from time import time
+from urlparse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from . import headless, paths
+from .service.base import Service
+
+__all__ = ['Server', 'main']
+
+
+_CODE_200 = '200 OK'
+_CODE_304 = '304 Not Modified'
+_CODE_400 = '400 Bad Request'
+_CODE_404 = '404 Not Found'
+_CODE_405 = '405 Method Not Allowed'
+_CODE_502 = '502 Bad Gateway'
+_CODE_503 = '503 Service Unavailable'
+_CODE_504 = '504 Gateway Timeout'
+
+_HEADERS_JSON = [('Content-Type', 'application/json')]
+
+_REQUEST_KEYS = ['text', 'service', 'preset', 'group']
+
+
+def _get_message(msg):
+    "Returns a list-of-one-string payload for returning from handlers."
+    return [dumps(dict(message=msg), separators=(',', ':'))]
+
+_MSG_CAPACITY = _get_message("This server is over capacity")
+_MSG_NOT_FOUND = _get_message("There is nothing here")
+_MSG_TIMEOUT = _get_message("The clip is still being generated; try again")
+_MSG_UNACCEPTABLE = _get_message("Your request is unacceptable")
+
+
+class Server(object):
+    """
+    WSGI application for a bundle from headless.build(), dispatching
+    to the /tts and /stats handlers.
+    """
+
+    __slots__ = [
+        '_counts',       # dict of response counters reported by /stats
+        '_lock',         # guards counts and the number waiting
+        '_logger',       # logger-like interface with debug(), info(), etc.
+        '_max_waiting',  # how many requests may wait on the router at once
+        '_started',      # when the server was created, for /stats
+        '_timeout',      # seconds to wait for a clip before giving up
+        '_tts',          # bundle with the config, catalog, router, strip
+        '_waiting',      # how many requests are waiting on the router now
+    ]
+
+    def __init__(self, tts, logger, max_waiting=100, timeout=60):
+        """
+        Given a bundle from headless.build(), serve its router.
+        """
+
+        self._counts = dict(requests=0, hits=0, generated=0, unmodified=0,
+                            errors=0, rejected=0, timeouts=0)
+        self._lock = Lock()
+        self._logger = logger
+        self._max_waiting = max_waiting
+        self._started = time()
+        self._timeout = timeout
+        self._tts = tts
+        self._waiting = 0
+
+    def __call__(self, environ, start_response):
+        """
+        Route the request to the handler for its path.
+        """
+
+        self._count('requests')
+
+        if environ.get('REQUEST_METHOD') not in ['GET', 'HEAD']:
+            start_response(_CODE_405, _HEADERS_JSON)
+            return _MSG_UNACCEPTABLE
+
+        path = environ.get('PATH_INFO', '').rstrip('/')
+        if path == '/tts':
+            return self._tts_handler(environ, start_response)
+        elif path == '/stats':
+            return self._stats_handler(environ, start_response)
+
+        start_response(_CODE_404, _HEADERS_JSON)
+        return _MSG_NOT_FOUND
+
+    def _count(self, name):
+        """Increments the named counter for /stats."""
+
+        with self._lock:
+            self._counts[name] += 1
+
+    def _tts_handler(self, environ, start_response):
+        """
+        Validate the request, answer If-None-Match from the cache path
+        if possible, and otherwise wait on the router for the clip.
+        """
+
+        try:
+            request = self._get_request(environ.get('QUERY_STRING', ''))
+            path = headless.get_cache_path(self._tts, request)
+        except Exception as exception:  # catch all, pylint:disable=W0703
+            self._count('errors')
+            start_response(_CODE_400, _HEADERS_JSON)
+            return _get_message(_get_error(exception))
+
+        if path and self._is_unmodified(environ, path):
+            self._count('unmodified')
+            start_response(_CODE_304, [('ETag', _get_etag(path))])
+            return []
+
+        with self._lock:
+            if self._waiting >= self._max_waiting:
+                self._counts['rejected'] += 1
+                start_response(_CODE_503, _HEADERS_JSON)
+                return _MSG_CAPACITY
+            self._waiting += 1
+
+        try:
+            result = self._wait(request)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        if result is None:
+            self._count('timeouts')
+            start_response(_CODE_504, _HEADERS_JSON)
+            return _MSG_TIMEOUT
+
+        path, exception, missed = result
+
+        if exception:
+            self._count('errors')
+            start_response(_CODE_502, _HEADERS_JSON)
+            return _get_message(_get_error(exception))
+
+        self._count('generated' if missed else 'hits')
+
+        if self._is_unmodified(environ, path):
+            self._count('unmodified')
+            start_response(_CODE_304, [('ETag', _get_etag(path))])
+            return []
+
+        start_response(_CODE_200, [
+            ('Content-Type', 'audio/mpeg'),
+            ('Content-Length', str(os.path.getsize(path))),
+            ('ETag', _get_etag(path)),
+        ])
+
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return []
+
+        stream = open(path, 'rb')
+        if 'wsgi.file_wrapper' in environ:
+            return environ['wsgi.file_wrapper'](stream)
+        try:
+            return [stream.read()]
+        finally:
+            stream.close()
+
+    def _get_request(self, query_string):
+        """
+        Returns a request dict (see headless.dispatch()) for the given
+        query string, with its text cleaned up like user input.
+        """
+
+        query = {
+            key: values[-1].decode('utf-8')
+            for key, values in parse_qs(query_string).items()
+        }
+
+        request = {key: query.get(key, u'') for key in _REQUEST_KEYS}
+        request['text'] = self._tts.strip.from_user(request['text'])
+        request['options'] = {
+            key: value
+            for key, value in query.items()
+            if key not in _REQUEST_KEYS
+        }
+
+        return request
+
+    def _is_unmodified(self, environ, path):  # pylint:disable=no-self-use
+        """
+        Returns True if the client already has the clip at the given
+        path, according to its If-None-Match header.
+        """
+
+        etags = environ.get('HTTP_IF_NONE_MATCH')
+        if not etags:
+            return False
+
+        etag = _get_etag(path)
+        return any(candidate.strip() in [etag, '*', 'W/' + etag]
+                   for candidate in etags.split(','))
+
+    def _wait(self, request):
+        """
+        Sends the request to the router and waits for the outcome,
+        returning a tuple of the path, any exception, and whether the
+        service had to be called, or None if it timed out.
+        """
+
+        done = Event()
+        result = {}
+        missed = []
+
+        def okay(path):
+            """Record the path and wake up the handler."""
+            result['path'] = path
+            done.set()
+
+        def fail(exception):
+            """Record the exception and wake up the handler."""
+            result['exception'] = exception
+            done.set()
+
+        headless.dispatch(
+            self._tts, request,
+            callbacks=dict(okay=okay, fail=fail,
+                           miss=lambda svc_id, count: missed.append(svc_id)),
+            priority=self._tts.router.Priority.INTERACTIVE,
+        )
+
+        if not done.wait(self._timeout):
+            return None
+
+        return result.get('path'), result.get('exception'), bool(missed)
+
+    def _stats_handler(self, environ, start_response):  # pylint:disable=W0613
+        """
+        Return the response counters and the state of the cache.
+        """
+
+        with self._lock:
+            stats = dict(self._counts, waiting=self._waiting)
+
+        router = self._tts.router
+        count, size = router.get_cache_stats()
+        stats.update(
+            uptime=int(time() - self._started),
+            cache=dict(files=count, bytes=size),
+            failures=router.get_failure_count(),
+            connections=Service.NET_POOL.stats(),
+            processes=Service.CLI_SCHEDULER.stats(),
+        )
+
+        start_response(_CODE_200, _HEADERS_JSON)
+        return [dumps(stats, separators=(',', ':'), sort_keys=True)]
+
+
+def _get_error(exception):
+    """Returns a one-line message for the given exception."""
+
+    message = getattr(exception, 'message', None)
+    if not isinstance(message, basestring) or not message:
+        message = format(exception) or type(exception).__name__
+    return ' '.join(message.split())
+
+
+def _get_etag(path):
+    """Returns the ETag for the cache file at the given path."""
+
+    return '"%s"' % os.path.splitext(os.path.basename(path))[0]
+
+
+class _ThreadingServer(ThreadingMixIn, WSGIServer):
+    """WSGI server that handles each connection on its own thread."""
+
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    """Request handler that does not log every request to stderr."""
+
+    def log_message(self, *args):  # pylint:disable=arguments-differ
+        """Discard the message."""
+
+
+def main(argv):
+    """
+    Runs the server described by the given command-line arguments
+    until interrupted.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog='serve.py',
+        description="Serves AwesomeTTS clips over HTTP from a shared cache.",
+    )
+    parser.add_argument('-a', '--address', default='127.0.0.1',
+                        help="address to listen on; use 0.0.0.0 to serve "
+                             "other machines (default: %(default)s)")
+    parser.add_argument('-p', '--port', type=int, default=8015,
+                        help="port to listen on (default: %(default)s)")
+    parser.add_argument('-j', '--parallel', type=int, metavar='N',
+                        help="how many service calls to run at once; "
+                             "defaults to the add-on's setting")
+    parser.add_argument('-l', '--limit', action='append', default=[],
+                        metavar='SVC=N',
+                        help="at most N calls at once for the service "
+                             "(may be repeated)")
+    parser.add_argument('-w', '--max-waiting', type=int, default=100,
+                        metavar='N',
+                        help="reject requests with a 503 while N are "
+                             "already waiting (default: %(default)s)")
+    parser.add_argument('-t', '--timeout', type=int, default=60,
+                        metavar='SECS',
+                        help="give up waiting on a clip with a 504 after "
+                             "this long (default: %(default)s)")
+    parser.add_argument('--config', default=paths.CONFIG,
+                        help="configuration database to read presets, "
+                             "groups, and limits from; defaults to the "
+                             "add-on's")
+    parser.add_argument('--cache', default=paths.CACHE,
+                        help="cache directory; defaults to the add-on's "
+                             "(use a different --config with this)")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="do not log each request")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="log debugging output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr,
+                        level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('awesometts')
+
+    limits = headless.parse_svc_values(args.limit, int)
+
+    tts = headless.build(
+        logger=logger,
+        config_path=args.config,
+        cache_dir=args.cache,
+        overrides=dict(pool_size=args.parallel) if args.parallel else None,
+    )
+    if limits:
+        tts.config['concurrency'] = dict(tts.config['concurrency'], **limits)
+
+    server = make_server(args.address, args.port,
+                         Server(tts, logger, max_waiting=args.max_waiting,
+                                timeout=args.timeout),
+                         server_class=_ThreadingServer,
+                         handler_class=(_QuietHandler if args.quiet
+                                        else WSGIRequestHandler))
+    logger.info("Serving on http://%s:%d/", args.address, args.port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        server.server_close()
+        tts.router.shutdown()
+        tts.catalog.flush()
+
+    return 0
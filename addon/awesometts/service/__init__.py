@@ -20,7 +20,7 @@
 Service classes for AwesomeTTS
 """
 
-from .common import Trait
+from .common import NotFound, Trait
 
 from .abair import Abair
 from .ariana import Ariana
@@ -51,8 +51,14 @@ from .youdao import Youdao
 
 __all__ = [
     # common
+    'NotFound',
     'Trait',
 
+    # lookups
+    'MAPPINGS',
+    'DEAD',
+    'ALIASES',
+
     # services
     'Abair',
     'Ariana',
@@ -81,3 +87,51 @@ __all__ = [
     'Yandex',
     'Youdao',
 ]
+
+
+# Lookups for the router, which is given these by both the add-on and the
+# headless tools, so that service IDs in tags, presets, and caches agree
+
+MAPPINGS = [
+    ('abair', Abair),
+    ('ariana', Ariana),
+    ('baidu', Baidu),
+    ('collins', Collins),
+    ('duden', Duden),
+    ('ekho', Ekho),
+    ('espeak', ESpeak),
+    ('festival', Festival),
+    ('fluencynl', FluencyNl),
+    ('google', Google),
+    ('howjsay', Howjsay),
+    ('imtranslator', ImTranslator),
+    ('ispeech', ISpeech),
+    ('naver', Naver),
+    ('neospeech', NeoSpeech),
+    ('oddcast', Oddcast),
+    ('oxford', Oxford),
+    ('pico2wave', Pico2Wave),
+    ('rhvoice', RHVoice),
+    ('sapi5js', SAPI5JS),
+    ('say', Say),
+    ('spanishdict', SpanishDict),
+    ('voicetext', VoiceText),
+    ('wiktionary', Wiktionary),
+    ('yandex', Yandex),
+    ('youdao', Youdao),
+]
+
+DEAD = dict(
+    ttsapicom="TTS-API.com has gone offline and can no longer be "
+              "used. Please switch to another service with English.",
+)
+
+ALIASES = [('b', 'baidu'), ('g', 'google'), ('macosx', 'say'),
+           ('microsoft', 'sapi5js'), ('microsoftjs', 'sapi5js'),
+           ('microsoftjscript', 'sapi5js'), ('oed', 'oxford'),
+           ('osx', 'say'), ('sapi', 'sapi5js'), ('sapi5', 'sapi5js'),
+           ('sapi5jscript', 'sapi5js'), ('sapijs', 'sapi5js'),
+           ('sapijscript', 'sapi5js'), ('svox', 'pico2wave'),
+           ('svoxpico', 'pico2wave'), ('ttsapi', 'ttsapicom'),
+           ('windows', 'sapi5js'), ('windowsjs', 'sapi5js'),
+           ('windowsjscript', 'sapi5js'), ('y', 'yandex')]
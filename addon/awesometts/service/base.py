@@ -24,10 +24,21 @@ TTS services for use with AwesomeTTS.
 """
 
 import abc
+from cStringIO import StringIO
+from httplib import IncompleteRead
 import os
+from random import uniform
 import shutil
 import sys
 import subprocess
+from socket import error as SocketError
+from threading import Lock, Thread, local
+from time import sleep
+from urllib2 import HTTPError, URLError
+from uuid import uuid4
+
+from .pool import ConnectionPool
+from .scheduler import ProcessScheduler
 
 __all__ = ['Service']
 
@@ -37,6 +48,12 @@ DEFAULT_TIMEOUT = 15
 
 PADDING = '\0' * 2**11
 
+NET_CHUNK = 2**16  # bytes copied at a time from a response to its output
+
+CLI_CHUNK = 2**16  # bytes piped at a time from a service binary to LAME
+
+_PROGRESSIVE = local()  # output path and part callback of run_progressive()
+
 
 class Service(object):
     """
@@ -130,6 +147,27 @@ class Service(object):
     # e.g. TRAITS = [Trait.INTERNET, Trait.TRANSCODING]
     TRAITS = None
 
+    # optional; to be overridden by concrete classes that cannot safely run
+    # too many requests at once, e.g. CONCURRENCY = 1 (None uses the default
+    # for the service's TRAITS; the user may still override it either way)
+    CONCURRENCY = None
+
+    # keep-alive connections, shared by the net_*() calls of all services
+    NET_POOL = ConnectionPool()
+
+    # caps the CPU-heavy processes (engines, LAME) run by all services at
+    # once, by default to the number of cores, and times each binary
+    CLI_SCHEDULER = ProcessScheduler()
+
+    # how many targets net_stream() may download at once (e.g. the segments
+    # of a long phrase); can be lowered by services whose servers object
+    NET_PARALLEL = 4
+
+    # how net_stream() retries a target whose download fails in a way that
+    # might work next time (see _net_retryable()); can be raised by services
+    # with flaky servers or per call, e.g. retry=dict(attempts=5)
+    NET_RETRY = dict(attempts=1, delay=0.5)
+
     def __init__(self, temp_dir, lame_flags, normalize, logger, ecosystem):
         """
         Attempt to initialize the service, raising a exception if the
@@ -260,14 +298,40 @@ class Service(object):
         raised so the caller knows why.
         """
 
+    def run_progressive(self, text, options, path, part):
+        """
+        Runs the service like run() does, but if the MP3 for the path
+        is downloaded in several segments (i.e. net_download() is given
+        several targets for it), calls part() with a copy of each one,
+        in order, as soon as it and all of the ones before it are done,
+        so that playback can start before the whole MP3 has arrived.
+
+        The copies are written to temporary paths that the part()
+        callback takes over (e.g. to move and later delete them). Services
+        that do not download in segments never call part().
+        """
+
+        _PROGRESSIVE.path = path
+        _PROGRESSIVE.part = part
+
+        try:
+            self.run(text, options, path)
+        finally:
+            _PROGRESSIVE.path = _PROGRESSIVE.part = None
+
     def cli_call(self, *args):
         """
         Executes a command line call for its side effects. May be passed
         as a single list or as multiple arguments.
+
+        As such calls are usually a service's CPU-heavy work (e.g. an
+        engine writing a wave file), the call waits for a CLI_SCHEDULER
+        slot. The cli_output() calls, used to inspect voices and the
+        like, do not.
         """
 
         self._cli_exec(
-            subprocess.check_call,
+            self.CLI_SCHEDULER.check_call,
             args,
             "for processing",
         )
@@ -355,14 +419,13 @@ class Service(object):
         """
         Runs the LAME transcoder to create a new MP3 file.
 
-        Note that instead of writing the file immediately to the given
-        output path, this method first writes it a temporary file and
-        then moves it to the output path afterward. This works around a
-        bug on Windows where a user with a non-ASCII username would have
-        a non-ASCII output_path, causing an error when the path is sent
-        via the CLI. However, because the temporary directory on Windows
-        will be of the all-ASCII variety, we can send it through there
-        first and then move it to its final home.
+        Note that LAME is told to write the MP3 to its stdout, which is
+        already open on the output path, rather than being passed the
+        output path itself. This works around a bug on Windows where a
+        user with a non-ASCII username would have a non-ASCII
+        output_path, causing an error when the path is sent via the CLI.
+        (The input path should come from path_temp(), whose temporary
+        directory on Windows will be of the all-ASCII variety.)
 
         If add_padding is True, then some additional null padding will
         be added onto the resulting MP3. This can be helpful to ensure
@@ -385,16 +448,146 @@ class Service(object):
                 )
             )
 
-        intermediate_path = self.path_temp('mp3')  # see note above
+        with self.CLI_SCHEDULER, open(output_path, 'wb') as output_stream:
+            lame = self._cli_lame(input_path, None, output_stream)
+            self.CLI_SCHEDULER.wait(lame)
 
-        try:
-            self.cli_call(
-                self.CLI_LAME,
-                self._lame_flags().split(),
-                input_path,
-                intermediate_path,
+        self._cli_lame_check(lame, output_path, add_padding)
+
+    def cli_transcode_pipe(self, args, output_path, input_path=None,
+                           require=None, add_padding=False):
+        """
+        Runs a service binary that writes wave audio to its stdout (e.g.
+        `espeak --stdout`), piping that straight into the LAME
+        transcoder, whose stdout in turn goes straight into the output
+        path, so that no intermediate wave or MP3 files are needed. May
+        be passed an input path to feed to the binary as its stdin.
+
+        The require and add_padding arguments are as for cli_transcode(),
+        with size_in checked against what the binary wrote.
+        """
+
+        args = [
+            arg if isinstance(arg, basestring) else str(arg)
+            for arg in self._flatten(args)
+        ]
+
+        self._logger.debug(
+            "Calling %s binary with %s%s and piping it to %s",
+            args[0],
+            args[1:] if len(args) > 1 else "no arguments",
+            " on %s" % input_path if input_path else "",
+            self.CLI_LAME,
+        )
+
+        scheduler = self.CLI_SCHEDULER
+
+        with scheduler, open(input_path, 'rb') if input_path else \
+                open(os.devnull, 'rb') as input_stream, \
+                open(output_path, 'wb') as output_stream:
+            binary = scheduler.popen(args,
+                                     stdin=input_stream,
+                                     stdout=subprocess.PIPE,
+                                     startupinfo=self.CLI_SI)
+
+            try:
+                lame = self._cli_lame('-', subprocess.PIPE, output_stream)
+            except OSError:
+                self._cli_kill(binary)
+                scheduler.wait(binary)
+                raise
+
+            size = 0
+            try:
+                while True:
+                    chunk = binary.stdout.read(CLI_CHUNK)
+                    if not chunk:
+                        break
+                    lame.stdin.write(chunk)
+                    size += len(chunk)
+            except EnvironmentError:  # e.g. LAME died, so the pipe broke
+                self._cli_kill(binary)
+            finally:
+                binary.stdout.close()
+                try:
+                    lame.stdin.close()
+                except EnvironmentError:
+                    pass
+                scheduler.wait(binary)
+                scheduler.wait(lame)
+
+        if binary.returncode:
+            raise subprocess.CalledProcessError(binary.returncode, args[0])
+
+        if require and 'size_in' in require and size < require['size_in']:
+            raise ValueError(
+                "Input to transcoder was %d-byte stream; wanted %d+ bytes "
+                "(the service might not have liked your input text)" %
+                (size, require['size_in'])
             )
 
+        self._cli_lame_check(lame, output_path, add_padding)
+
+    def cli_transcode_data(self, data, output_path, require=None,
+                           add_padding=False):
+        """
+        Pipes wave audio that is already in memory (e.g. as received
+        from a synthesis server) into the LAME transcoder, whose stdout
+        goes straight into the output path.
+
+        The require and add_padding arguments are as for cli_transcode(),
+        with size_in checked against the length of the data.
+        """
+
+        if require and 'size_in' in require and \
+           len(data) < require['size_in']:
+            raise ValueError(
+                "Input to transcoder was %d-byte stream; wanted %d+ bytes "
+                "(the service might not have liked your input text)" %
+                (len(data), require['size_in'])
+            )
+
+        with self.CLI_SCHEDULER, open(output_path, 'wb') as output_stream:
+            lame = self._cli_lame('-', subprocess.PIPE, output_stream)
+            try:
+                lame.stdin.write(data)
+            except EnvironmentError:  # i.e. LAME died, so the pipe broke
+                pass
+            finally:
+                try:
+                    lame.stdin.close()
+                except EnvironmentError:
+                    pass
+                self.CLI_SCHEDULER.wait(lame)
+
+        self._cli_lame_check(lame, output_path, add_padding)
+
+    @staticmethod
+    def _cli_kill(process):
+        """Kills the process, ignoring it if it has already exited."""
+
+        try:
+            process.kill()
+        except EnvironmentError:
+            pass
+
+    def _cli_lame(self, input_arg, stdin, output_stream):
+        """
+        Starts LAME on the given input path (or '-' for its stdin),
+        writing the MP3 to the given output stream. The caller must
+        hold a CLI_SCHEDULER slot and reap LAME with its wait().
+        """
+
+        args = [self.CLI_LAME] + self._lame_flags().split() + [input_arg, '-']
+        self._logger.debug("Calling %s binary with %s to transcode",
+                           args[0], args[1:])
+
+        try:
+            return self.CLI_SCHEDULER.popen(args,
+                                            stdin=stdin,
+                                            stdout=output_stream,
+                                            startupinfo=self.CLI_SI)
+
         except OSError as os_error:
             from errno import ENOENT
             if os_error.errno == ENOENT:
@@ -406,16 +599,20 @@ class Service(object):
             else:
                 raise
 
-        if not os.path.exists(intermediate_path):
+    def _cli_lame_check(self, lame, output_path, add_padding):
+        """
+        Raises an error if LAME failed or wrote nothing, and otherwise
+        pads the MP3 if requested.
+        """
+
+        if lame.returncode or not os.path.getsize(output_path):
             raise RuntimeError(
                 "Transcoding the audio stream failed. Are the flags you "
                 "specified for LAME (%s) okay?" % self._lame_flags()
             )
 
         if add_padding:
-            self.util_pad(intermediate_path)
-
-        shutil.move(intermediate_path, output_path)  # see note above
+            self.util_pad(output_path)
 
     def _cli_exec(self, callee, args, purpose, redirect_stderr=False):
         """
@@ -457,15 +654,20 @@ class Service(object):
                            args[1:] if len(args) > 1 else "no arguments",
                            output_path)
 
-        with open(input_path, input_mode) as input_stream, \
+        with self.CLI_SCHEDULER, \
+                open(input_path, input_mode) as input_stream, \
                 open(output_path, output_mode) as output_stream:
-            subprocess.Popen(args, stdin=input_stream.fileno(),
-                             stdout=output_stream.fileno()).communicate()
+            self.CLI_SCHEDULER.wait(self.CLI_SCHEDULER.popen(
+                args,
+                stdin=input_stream.fileno(),
+                stdout=output_stream.fileno(),
+            ))
 
     def cli_background(self, *args):
         """
         Puts a CLI-based command in the background, terminating it once
-        the session has ended.
+        the session has ended (unless it has exited by then). Returns
+        the process, e.g. so the caller can check that it is running.
         """
 
         args = [arg if isinstance(arg, basestring) else str(arg)
@@ -477,8 +679,16 @@ class Service(object):
 
         service = subprocess.Popen(args)
 
+        def terminate():
+            """Terminates the process if it is still running."""
+
+            if service.poll() is None:
+                service.terminate()
+
         import atexit
-        atexit.register(service.terminate)
+        atexit.register(terminate)
+
+        return service
 
     def net_headers(self, url):
         """Returns the headers for a URL."""
@@ -486,15 +696,15 @@ class Service(object):
         self._logger.debug("GET %s for headers", url)
         self._netops += 1
 
-        from urllib2 import urlopen, Request
-        return urlopen(
-            Request(url=url, headers={'User-Agent': DEFAULT_UA}),
-            timeout=DEFAULT_TIMEOUT,
-        ).headers
+        response = self.NET_POOL.open(url, headers={'User-Agent': DEFAULT_UA},
+                                      timeout=DEFAULT_TIMEOUT)
+        response.close()
+        return response.headers
 
     def net_stream(self, targets, require=None, method='GET',
                    awesome_ua=False, add_padding=False,
-                   custom_quoter=None, custom_headers=None):
+                   custom_quoter=None, custom_headers=None, parallel=None,
+                   retry=None):
         """
         Returns the raw payload string from the specified target(s).
         If multiple targets are specified, their resulting payloads are
@@ -508,19 +718,133 @@ class Service(object):
         If using multiple targets, these requirements apply to each
         response.
 
-        The underlying library here already understands how to search
-        the environment for proxy settings (e.g. HTTP_PROXY), so we do
-        not need to do anything extra for that.
+        Multiple targets are downloaded up to `parallel` (by default,
+        the service's NET_PARALLEL) at a time, but their payloads are
+        always glued together in the order given. If any of them fails,
+        the error from the earliest failing target is raised.
+
+        A target that fails in a retryable way (a tiny download, a cut
+        off or timed-out connection, or a 5xx status) is downloaded
+        again, up to the number of attempts in the retry dict (merged
+        over the service's NET_RETRY), waiting `delay` seconds before
+        the first retry and about twice as long before each one after
+        that. Only the failing target is downloaded again.
+
+        Requests go through the shared NET_POOL, which keeps connections
+        open for reuse and, like urllib2, searches the environment for
+        proxy settings (e.g. HTTP_PROXY).
 
         If add_padding is True, then some additional null padding will
         be added onto the stream returned. This is helpful for some web
         services that sometimes return MP3s that `mplayer` clips early.
         """
 
-        assert method in ['GET', 'POST'], "method must be GET or POST"
-        from urllib2 import urlopen, Request, quote
+        targets = targets if isinstance(targets, list) else [targets]
+        buffers = [StringIO() for _ in targets]
+
+        self._net_transfer(buffers, targets, require, method, awesome_ua,
+                           custom_quoter, custom_headers, parallel, retry)
+
+        payloads = [buffer.getvalue() for buffer in buffers]
+        if add_padding:
+            payloads.append(PADDING)
+        return ''.join(payloads)
+
+    def net_download(self, path, targets, require=None, method='GET',
+                     awesome_ua=False, add_padding=False,
+                     custom_quoter=None, custom_headers=None, parallel=None,
+                     retry=None):
+        """
+        Downloads a file to the given path from the specified target(s).
+        See net_stream() for information about available options.
+
+        Unlike net_stream(), the payloads are never held in memory;
+        each one is copied in chunks into a part file next to the path,
+        and the parts are glued together and renamed into place only
+        once all of them have succeeded, so the path never holds a
+        partial download. When called for the output path of a
+        run_progressive(), each part is also passed on as it is done.
+        """
 
         targets = targets if isinstance(targets, list) else [targets]
+        directory, filename = os.path.split(path)
+        parts = []
+
+        try:
+            for _ in targets:
+                part_path = os.path.join(directory, '.%s.%s.part' %
+                                         (filename, uuid4().hex[:12]))
+                parts.append((open(part_path, 'w+b'), part_path))
+
+            outputs = [output for output, _ in parts]
+            self._net_transfer(outputs, targets, require, method,
+                               awesome_ua, custom_quoter, custom_headers,
+                               parallel, retry,
+                               self._net_progress(path, parts))
+
+            for output in outputs[1:]:
+                output.seek(0)
+                shutil.copyfileobj(output, outputs[0], NET_CHUNK)
+            if add_padding:
+                outputs[0].write(PADDING)
+            outputs[0].close()
+
+            _replace(parts[0][1], path)
+
+        finally:
+            for output, part_path in parts:
+                output.close()
+                if os.path.exists(part_path):
+                    os.unlink(part_path)
+
+    def _net_progress(self, path, parts):
+        """
+        Returns a callable for _net_transfer() to call with the index of
+        each part of a download to the given path as it is done, which
+        passes copies of the parts on to the part() callback of the
+        run_progressive() writing that path, in order. Returns None if
+        there is no such callback or only one part.
+        """
+
+        part = getattr(_PROGRESSIVE, 'part', None)
+        if not part or len(parts) < 2 or \
+                getattr(_PROGRESSIVE, 'path', None) != path:
+            return None
+
+        done = set()
+        lock = Lock()
+        passed = [0]  # how many parts have been passed on, as a closure
+
+        def fetched(index):
+            """Passes on any parts that are now done in order."""
+
+            with lock:
+                done.add(index)
+                while passed[0] in done:
+                    output, part_path = parts[passed[0]]
+                    output.flush()
+                    copy_path = self.path_temp('mp3')
+                    shutil.copyfile(part_path, copy_path)
+                    self._logger.debug("Passing on part %d of %d for %s",
+                                       passed[0] + 1, len(parts), path)
+                    part(copy_path)
+                    passed[0] += 1
+
+        return fetched
+
+    def _net_transfer(self, outputs, targets, require, method, awesome_ua,
+                      custom_quoter, custom_headers, parallel, retry,
+                      fetched=None):
+        """
+        Downloads each of the targets into the file-like output at the
+        same index, running them in parallel and retrying them as
+        described for net_stream(). If given, fetched() is called with
+        the index of each target once it has downloaded successfully.
+        """
+
+        assert method in ['GET', 'POST'], "method must be GET or POST"
+        from urllib2 import quote
+
         targets = [
             (target, None) if isinstance(target, basestring)
             else (
@@ -547,81 +871,136 @@ class Service(object):
 
         require = require or {}
 
-        payloads = []
+        headers = {'User-Agent': (self.ecosystem.agent
+                                  if awesome_ua else DEFAULT_UA)}
+        if custom_headers:
+            headers.update(custom_headers)
+
+        retry = dict(self.NET_RETRY, **(retry or {}))
+        retried = []
+
+        def fetch(index):
+            """
+            Downloads the target at the given index, retrying it
+            according to the retry policy.
+            """
 
-        for number, (url, params) in enumerate(targets, 1):
+            url, params = targets[index]
+            output = outputs[index]
             desc = "web request" if len(targets) == 1 \
-                else "web request (%d of %d)" % (number, len(targets))
+                else "web request (%d of %d)" % (index + 1, len(targets))
 
-            self._logger.debug("%s %s%s%s for %s", method, url,
-                               "?" if params else "", params or "", desc)
+            for attempt in range(1, retry['attempts'] + 1):
+                try:
+                    output.seek(0)
+                    output.truncate()
+                    self._net_fetch(output=output, url=url, params=params,
+                                    method=method, headers=headers,
+                                    require=require, desc=desc)
+
+                except Exception as exception:  # pylint:disable=W0703
+                    if attempt == retry['attempts'] or \
+                            not self._net_retryable(exception):
+                        raise
+
+                    # exponential backoff, half of it randomized so that
+                    # the parallel segments do not all retry together
+                    wait = retry['delay'] * 2 ** (attempt - 1)
+                    wait = wait / 2 + uniform(0, wait / 2)
+                    self._logger.warn("%s failed (%s); retrying in %.1f "
+                                      "seconds", desc, exception, wait)
+                    retried.append(index)
+                    sleep(wait)
+
+                else:
+                    if fetched:
+                        fetched(index)
+                    return
 
-            headers = {'User-Agent': (self.ecosystem.agent
-                                      if awesome_ua else DEFAULT_UA)}
-            if custom_headers:
-                headers.update(custom_headers)
+        try:
+            _map_ordered(fetch, len(targets), parallel or self.NET_PARALLEL)
+        finally:
+            self._netops += len(targets) + len(retried)
 
-            self._netops += 1
-            response = urlopen(
-                Request(
-                    url=('?'.join([url, params]) if params and method == 'GET'
-                         else url),
-                    headers=headers,
-                ),
-                data=params if params and method == 'POST' else None,
-                timeout=DEFAULT_TIMEOUT,
-            )
+    def _net_fetch(self, output, url, params, method, headers, require,
+                   desc):
+        """
+        Copies the payload for a single target into the output in
+        chunks, checking it against the require dict.
+        """
 
-            if not response:
-                raise IOError("No response for %s" % desc)
+        self._logger.debug("%s %s%s%s for %s", method, url,
+                           "?" if params else "", params or "", desc)
 
-            if response.getcode() != 200:
-                value_error = ValueError(
-                    "Got %d status for %s" %
-                    (response.getcode(), desc)
-                )
-                try:
-                    value_error.payload = response.read()
-                    response.close()
-                except StandardError:
-                    pass
-                raise value_error
-
-            if 'mime' in require and \
-                    require['mime'] != format(response.info().
-                                              gettype()).replace('/x-', '/'):
-                value_error = ValueError(
-                    "Request got %s Content-Type for %s; wanted %s" %
-                    (response.info().gettype(), desc, require['mime'])
-                )
-                value_error.got_mime = response.info().gettype()
-                value_error.wanted_mime = require['mime']
-                raise value_error
+        response = self.NET_POOL.open(
+            url=('?'.join([url, params]) if params and method == 'GET'
+                 else url),
+            data=params if params and method == 'POST' else None,
+            headers=headers,
+            timeout=DEFAULT_TIMEOUT,
+        )
 
-            payload = response.read()
-            response.close()
+        if not response:
+            raise IOError("No response for %s" % desc)
 
-            if 'size' in require and len(payload) < require['size']:
-                raise self.TinyDownloadError(
-                    "Request got %d-byte stream for %s; wanted %d+ bytes" %
-                    (len(payload), desc, require['size'])
-                )
+        if response.reused:
+            self._logger.debug("Reused connection for %s", desc)
 
-            payloads.append(payload)
+        if response.getcode() != 200:
+            value_error = ValueError(
+                "Got %d status for %s" %
+                (response.getcode(), desc)
+            )
+            try:
+                value_error.payload = response.read()
+                response.close()
+            except StandardError:
+                pass
+            raise value_error
+
+        if 'mime' in require and \
+                require['mime'] != format(response.info().
+                                          gettype()).replace('/x-', '/'):
+            value_error = ValueError(
+                "Request got %s Content-Type for %s; wanted %s" %
+                (response.info().gettype(), desc, require['mime'])
+            )
+            value_error.got_mime = response.info().gettype()
+            value_error.wanted_mime = require['mime']
+            response.close()
+            raise value_error
 
-        if add_padding:
-            payloads.append(PADDING)
-        return ''.join(payloads)
+        size = 0
+        try:
+            while True:
+                chunk = response.read(NET_CHUNK)
+                if not chunk:
+                    break
+                output.write(chunk)
+                size += len(chunk)
+        finally:
+            response.close()
 
-    def net_download(self, path, *args, **kwargs):
+        if 'size' in require and size < require['size']:
+            raise self.TinyDownloadError(
+                "Request got %d-byte stream for %s; wanted %d+ bytes" %
+                (size, desc, require['size'])
+            )
+
+    def _net_retryable(self, exception):
         """
-        Downloads a file to the given path from the specified target(s).
-        See net_stream() for information about available options.
+        Returns True if the given net_stream() failure might not happen
+        again on another attempt. Services may extend this.
         """
 
-        payload = self.net_stream(*args, **kwargs)
-        with open(path, 'wb') as response_output:
-            response_output.write(payload)
+        if isinstance(exception, HTTPError):
+            return exception.code >= 500
+
+        if isinstance(exception, URLError):
+            exception = exception.reason
+
+        return isinstance(exception, (self.TinyDownloadError,
+                                      IncompleteRead, SocketError))
 
     def net_dump(self, output_path, url):
         """
@@ -629,8 +1008,8 @@ class Service(object):
         wave audio file.
 
         Note that output_path must be a safe ASCII one (i.e. generated
-        by path_temp()); this method does NOT have the non-ASCII home
-        directory workaround like cli_transcode() does.
+        by path_temp()); unlike with cli_transcode(), mplayer is given
+        this path directly.
         """
 
         if url.startswith('http'):
@@ -880,3 +1259,61 @@ elif sys.platform.startswith('darwin'):
 
 elif sys.platform.startswith('linux'):
     Service.IS_LINUX = True
+
+
+def _map_ordered(func, count, parallel):
+    """
+    Returns [func(0), func(1), ...] for `count` indices, calling up to
+    `parallel` of them at once (the calling thread takes a share). Once
+    a call fails, no further ones are started and, after the others in
+    flight finish, the exception from the lowest failed index is raised.
+    """
+
+    if parallel < 2 or count < 2:
+        return [func(index) for index in range(count)]
+
+    results = [None] * count
+    failures = {}
+    indices = iter(range(count))
+    lock = Lock()
+
+    def work():
+        """Calls func() for the next index until none remain."""
+
+        while True:
+            with lock:
+                index = None if failures else next(indices, None)
+            if index is None:
+                return
+
+            try:
+                results[index] = func(index)
+            except Exception:  # catch all, pylint:disable=W0703
+                with lock:
+                    failures[index] = sys.exc_info()
+
+    threads = [Thread(target=work) for _ in range(min(parallel, count) - 1)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    work()
+    for thread in threads:
+        thread.join()
+
+    if failures:
+        exc_type, exc_value, exc_traceback = failures[min(failures)]
+        raise exc_type, exc_value, exc_traceback
+
+    return results
+
+
+def _replace(source, destination):
+    """
+    Renames the source file to the destination, replacing any file
+    already there. This is atomic except on Windows, where the old file
+    must first be removed.
+    """
+
+    if sys.platform.startswith('win') and os.path.exists(destination):
+        os.unlink(destination)
+    os.rename(source, destination)
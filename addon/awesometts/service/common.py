@@ -20,10 +20,19 @@
 Common classes for services
 
 Provides an enum-like Trait class for specifying the characteristics of
-a service.
+a service and the NotFound exception for services to reject input with.
 """
 
-__all__ = ['Trait']
+__all__ = ['NotFound', 'Trait']
+
+
+class NotFound(IOError):
+    """
+    Raised by a service whose vocabulary does not cover the input text
+    (e.g. a dictionary that does not know the word), as opposed to a
+    failure that might go away if the request is made again later.
+    Such failures are remembered for a long time.
+    """
 
 
 class Trait(object):  # enum class, pylint:disable=R0903
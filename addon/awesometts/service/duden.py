@@ -26,7 +26,7 @@ from re import compile as re
 from unicodedata import normalize as unicode_normalize
 
 from .base import Service
-from .common import Trait
+from .common import NotFound, Trait
 
 __all__ = ['Duden']
 
@@ -159,7 +159,7 @@ class Duden(Service):
                                           require=dict(mime='text/html'))
         except IOError as io_error:
             if getattr(io_error, 'code', None) == 404:
-                raise IOError("Duden does not recognize this input.")
+                raise NotFound("Duden does not recognize this input.")
             else:
                 raise
 
@@ -241,4 +241,4 @@ class Duden(Service):
                                        'and does not match our input',
                                        mp3_url, guide, guide_normalized)
 
-        raise IOError("Duden does not have recorded audio for this word.")
+        raise NotFound("Duden does not have recorded audio for this word.")
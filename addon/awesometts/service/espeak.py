@@ -20,12 +20,25 @@
 Service implementation for eSpeak text-to-speech engine
 """
 
+from array import array
+import struct
+import subprocess
+import sys
+from xml.sax.saxutils import escape
+
 from .base import Service
 from .common import Trait
 
 __all__ = ['ESpeak']
 
 
+BATCH_BREAK_SECS = 3.0  # pause put between the texts of a batch (plus gap)
+BATCH_SPLIT_SECS = 2.0  # shortest pause a batch is split on (plus gap)
+BATCH_EDGE_SECS = 0.1  # most silence kept before and after each text
+
+SILENCE_LEVEL = 64  # 16-bit samples this close to zero count as silence
+
+
 class ESpeak(Service):
     """
     Provides a Service-compliant implementation for eSpeak.
@@ -318,35 +331,18 @@ class ESpeak(Service):
 
     def run(self, text, options, path):
         """
-        Checks for unicode workaround on Windows, writes a temporary
-        wave file, and then transcodes to MP3.
+        Checks for unicode workaround on Windows and pipes the wave
+        audio from eSpeak through LAME into the MP3 at the given path.
         """
 
         input_file = self.path_workaround(text)
-        output_wav = self.path_temp('wav')
-
-        voice = ('+'.join([options['voice'], options['variant']])
-                 if options['variant'] and options['variant'] != "normal"
-                 else options['voice'])
 
         try:
-            self.cli_call(
-                [
-                    self._binary,
-                    '-v', voice,
-                    '-s', options['speed'],
-                    '-g', int(options['gap'] * 100.0),
-                    '-p', options['pitch'],
-                    '-a', options['volume'],
-                    '-w', output_wav,
-                ] + (
+            self.cli_transcode_pipe(
+                self._args(options) + (
                     ['-f', input_file] if input_file
                     else ['--', text]
-                )
-            )
-
-            self.cli_transcode(
-                output_wav,
+                ),
                 path,
                 require=dict(
                     size_in=4096,
@@ -355,4 +351,175 @@ class ESpeak(Service):
             )
 
         finally:
-            self.path_unlink(input_file, output_wav)
+            self.path_unlink(input_file)
+
+    def run_batch(self, texts, options, paths):
+        """
+        Synthesizes several texts sharing the same options with just one
+        eSpeak process, reading them from an SSML file with a long break
+        between each, then splits the wave audio on those breaks and
+        pipes each piece through LAME into the MP3 at its path.
+
+        Returns a list with None for each text whose MP3 was written or
+        the exception for each one that could not be. If the audio does
+        not split into exactly one piece per text (e.g. if one of them
+        makes no sound), every text is run on its own instead.
+        """
+
+        if len(texts) < 2:
+            return _each(self.run, zip(texts, paths), options)
+
+        input_file = self.path_input(u'<speak>%s</speak>' % (
+            u'<break time="%dms"/>' %
+            ((options['gap'] + BATCH_BREAK_SECS) * 1000)
+        ).join(escape(text) for text in texts))
+
+        try:
+            wave = self._cli_exec(
+                self.CLI_SCHEDULER.check_output,
+                self._args(options) + ['-m', '-f', input_file],
+                "to synthesize %d texts" % len(texts),
+            )
+
+        except subprocess.CalledProcessError as error:
+            self._logger.warn("eSpeak failed on a batch of %d texts (%s); "
+                              "running each on its own", len(texts), error)
+            return _each(self.run, zip(texts, paths), options)
+
+        finally:
+            self.path_unlink(input_file)
+
+        pieces = _split(wave, options['gap'] + BATCH_SPLIT_SECS)
+        if not pieces or len(pieces) != len(texts):
+            self._logger.warn("eSpeak audio for a batch of %d texts split "
+                              "into %d pieces; running each on its own",
+                              len(texts), len(pieces or []))
+            return _each(self.run, zip(texts, paths), options)
+
+        return _each(
+            lambda piece, options, path: self.cli_transcode_data(
+                piece,
+                path,
+                require=dict(
+                    size_in=4096,
+                ),
+                add_padding=True,
+            ),
+            zip(pieces, paths),
+            options,
+        )
+
+    def _args(self, options):
+        """
+        Returns the eSpeak command line for the given options, writing
+        wave audio to stdout, without the input text.
+        """
+
+        voice = ('+'.join([options['voice'], options['variant']])
+                 if options['variant'] and options['variant'] != "normal"
+                 else options['voice'])
+
+        return [
+            self._binary,
+            '-v', voice,
+            '-s', options['speed'],
+            '-g', int(options['gap'] * 100.0),
+            '-p', options['pitch'],
+            '-a', options['volume'],
+            '--stdout',
+        ]
+
+
+def _each(run, pairs, options):
+    """
+    Calls run() with each pair of input and path plus the options,
+    returning a list with None or the exception raised for each.
+    """
+
+    results = []
+
+    for value, path in pairs:
+        try:
+            run(value, options, path)
+        except Exception as exception:  # catch-all, pylint:disable=W0703
+            results.append(exception)
+        else:
+            results.append(None)
+
+    return results
+
+
+def _split(wave, split_secs):
+    """
+    Splits eSpeak's wave audio on every silence lasting at least the
+    given number of seconds, returning a list of wave files (as byte
+    strings) for the sounds in between, or None if the audio is not
+    the 16-bit mono PCM that eSpeak writes.
+
+    The silence is found in blocks of 10 ms, and the size in eSpeak's
+    own header is ignored, as it is not filled in when writing to a
+    pipe; the data chunk is taken to run to the end.
+    """
+
+    if wave[0:4] != 'RIFF' or wave[8:12] != 'WAVE':
+        return None
+
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(wave):
+        chunk_id = wave[offset:offset + 4]
+        size = struct.unpack('<I', wave[offset + 4:offset + 8])[0]
+        offset += 8
+        if chunk_id == 'data':
+            break
+        if chunk_id == 'fmt ':
+            fmt = wave[offset:offset + 16]
+        offset += size + size % 2
+    else:
+        return None
+
+    if not fmt or len(fmt) < 16:
+        return None
+    audio_format, channels, rate, _, _, bits = struct.unpack('<HHIIHH', fmt)
+    if audio_format != 1 or channels != 1 or bits != 16 or rate < 100:
+        return None
+
+    data = wave[offset:len(wave) - (len(wave) - offset) % 2]
+    samples = array('h', data)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+
+    block = rate // 100
+    silent = [
+        max(chunk) < SILENCE_LEVEL and min(chunk) > -SILENCE_LEVEL
+        for chunk in (samples[start:start + block]
+                      for start in xrange(0, len(samples), block))
+    ]
+
+    split = int(split_secs * 100)
+    sounds = []
+    start = None
+    quiet = 0
+    for number, is_silent in enumerate(silent):
+        if is_silent:
+            quiet += 1
+            continue
+        if start is None:
+            start = number
+        elif quiet >= split:
+            sounds.append((start, number - quiet))
+            start = number
+        quiet = 0
+    if start is not None:
+        sounds.append((start, len(silent) - quiet))
+
+    edge = int(BATCH_EDGE_SECS * 100)
+    pieces = []
+    for start, end in sounds:
+        piece = data[max(start - edge, 0) * block * 2:
+                     min(end + edge, len(silent)) * block * 2]
+        pieces.append(struct.pack('<4sI4s4sIHHIIHH4sI',
+                                  'RIFF', 36 + len(piece), 'WAVE',
+                                  'fmt ', 16, 1, 1, rate, rate * 2, 2, 16,
+                                  'data', len(piece)) + piece)
+    return pieces
@@ -20,18 +20,41 @@
 Service implementation for Festival Speech Synthesis System
 """
 
+import socket
+from threading import Lock
+from time import sleep, time
+
 from .base import Service
 from .common import Trait
 
 __all__ = ['Festival']
 
 
+SERVER_HOST = '127.0.0.1'
+
+SERVER_KEY = 'ft_StUfF_key'  # ends files sent by the server; see _receive()
+
+SERVER_STARTUP_SECS = 15  # how long to wait for the server to listen
+
+SERVER_TIMEOUT = 60  # how long to wait on the server for a clip
+
+
 class Festival(Service):
     """
     Provides a Service-compliant implementation for Festival.
     """
 
+    class _ServerUnavailable(EnvironmentError):
+        """Raised if the Festival server could not be started."""
+
+    class _ServerError(IOError):
+        """Raised if the Festival server reports an error."""
+
     __slots__ = [
+        '_idle',          # idle server connections, with their voice
+        '_lock',          # guards the server process and idle connections
+        '_server',        # festival --server process, False if unusable
+        '_server_port',   # port that the server process listens on
         '_version',       # we get this while testing for the festival binary
         '_voice_list',    # list of installed voices as a list of tuples
     ]
@@ -57,6 +80,11 @@ class Festival(Service):
 
         super(Festival, self).__init__(*args, **kwargs)
 
+        self._idle = []
+        self._lock = Lock()
+        self._server = None
+        self._server_port = None
+
         self._version = self.cli_output('festival', '--version').pop(0)
         self.cli_call('text2wave', '--help')
 
@@ -131,24 +159,36 @@ class Festival(Service):
 
     def run(self, text, options, path):
         """
-        Write a temporary input text file, calls `text2wave` to write a
-        temporary wave file, and then transcodes that to MP3.
+        Asks a long-lived `festival --server` process for the wave audio
+        and pipes it through LAME into the MP3 at the given path, which
+        saves booting Festival and loading the voice for every clip.
+
+        If the server cannot be started, falls back to writing a
+        temporary input text file and piping the wave audio that
+        `text2wave` writes to its stdout through LAME instead.
         """
 
+        try:
+            # the server does the synthesis, but it is CPU-heavy all the
+            # same, so it counts against the scheduler like an engine
+            with self.CLI_SCHEDULER:
+                wave = self._synthesize(text, options)
+        except self._ServerUnavailable:
+            pass
+        else:
+            self.cli_transcode_data(wave, path, require=dict(size_in=4096))
+            return
+
         input_file = self.path_input(text)
-        output_wav = self.path_temp('wav')
 
         try:
-            self.cli_call(
-                'text2wave',
-                '-o', output_wav,
-                '-eval', '(voice_%s)' % options['voice'],
-                '-scale', options['volume'] / 100.0,
-                input_file,
-            )
-
-            self.cli_transcode(
-                output_wav,
+            self.cli_transcode_pipe(
+                [
+                    'text2wave',
+                    '-eval', '(voice_%s)' % options['voice'],
+                    '-scale', options['volume'] / 100.0,
+                    input_file,
+                ],
                 path,
                 require=dict(
                     size_in=4096,
@@ -156,4 +196,192 @@ class Festival(Service):
             )
 
         finally:
-            self.path_unlink(input_file, output_wav)
+            self.path_unlink(input_file)
+
+    def _synthesize(self, text, options):
+        """
+        Returns the wave audio for the text from the Festival server.
+        A request that fails on a connection that had been used before
+        (e.g. because the server crashed in the meantime) is retried
+        once on a fresh connection, restarting the server if need be.
+        """
+
+        text = text.encode('utf-8') if isinstance(text, unicode) else text
+        command = (
+            '(let ((utt (utt.synth (Utterance Text "%s")))) '
+            '(utt.wave.rescale utt %s) (utt.send.wave.client utt))' % (
+                text.replace('\\', '\\\\').replace('"', '\\"'),
+                options['volume'] / 100.0,
+            )
+        )
+
+        for attempt in range(2):
+            connection, voice, reused = self._acquire()
+
+            try:
+                if voice != options['voice']:
+                    self._request(connection, '(voice_%s)' % options['voice'])
+                    voice = options['voice']
+                waves = self._request(connection, command)
+
+            except (EnvironmentError, EOFError) as error:
+                connection.close()
+                if reused and attempt == 0 and \
+                        not isinstance(error, self._ServerError):
+                    self._logger.debug("Festival server connection failed "
+                                       "(%s); retrying", error)
+                    continue
+                raise
+
+            with self._lock:
+                self._idle.append((connection, voice))
+
+            if not waves:
+                raise IOError("The Festival server returned no audio.")
+            return waves[-1]
+
+    def _acquire(self):
+        """
+        Returns an idle connection to the server (or a new one, starting
+        the server if it is not running), the voice last selected on it,
+        and whether it had been used before.
+        """
+
+        with self._lock:
+            if self._server is False:
+                raise self._ServerUnavailable("Festival server is unusable")
+
+            if self._server and self._server.poll() is None:
+                if self._idle:
+                    connection, voice = self._idle.pop()
+                    return connection, voice, True
+
+            else:
+                for connection, _ in self._idle:
+                    connection.close()
+                self._idle = []
+                self._start()
+
+            port = self._server_port
+
+        return (socket.create_connection((SERVER_HOST, port),
+                                         SERVER_TIMEOUT),
+                None, False)
+
+    def _start(self):
+        """
+        Starts (or restarts, if it has died) the Festival server on a
+        free port and waits for it to listen. Callers must hold the lock.
+        """
+
+        if self._server:
+            self._logger.warn("Festival server exited with %d; restarting",
+                              self._server.returncode)
+
+        probe = socket.socket()
+        probe.bind((SERVER_HOST, 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        try:
+            server = self.cli_background(
+                'festival',
+                "(set! server_port %d)" % port,
+                "(Parameter.set 'Wavefiletype 'riff)",
+                '--server',
+            )
+        except OSError as os_error:
+            self._logger.warn("Cannot start Festival server (%s); using "
+                              "text2wave instead", os_error)
+            self._server = False
+            raise self._ServerUnavailable(os_error)
+
+        deadline = time() + SERVER_STARTUP_SECS
+        while True:
+            try:
+                socket.create_connection((SERVER_HOST, port), 1).close()
+                break
+            except socket.error:
+                if server.poll() is not None or time() > deadline:
+                    if server.poll() is None:
+                        server.terminate()
+                    self._logger.warn("Festival server did not start; "
+                                      "using text2wave instead")
+                    self._server = False
+                    raise self._ServerUnavailable("Festival server did not "
+                                                  "start")
+                sleep(0.1)
+
+        self._server = server
+        self._server_port = port
+
+    def _request(self, connection, command):
+        """
+        Sends a Scheme command to the server and returns the list of
+        wave files it sent back before reporting that it is done.
+        """
+
+        self._logger.debug("Sending %s to Festival server", command)
+        connection.sendall(command + '\n')
+
+        buf = ''
+        waves = []
+
+        while True:
+            while len(buf) < 3:
+                buf += self._recv(connection)
+            kind, buf = buf[:3], buf[3:]
+
+            if kind == 'OK\n':
+                return waves
+            elif kind == 'ER\n':
+                raise self._ServerError("Festival could not run %s" %
+                                        command.split(' ', 1)[0].strip('()'))
+            elif kind in ['WV\n', 'LP\n']:
+                data, buf = self._receive(connection, buf)
+                if kind == 'WV\n':
+                    waves.append(data)
+            else:
+                raise IOError("Unexpected response from Festival server")
+
+    def _receive(self, connection, buf):
+        """
+        Reads a file sent by the server, which ends with SERVER_KEY, and
+        returns it and whatever was read past its end. Within the file,
+        the key less its last character is sent followed by an 'X', so
+        as not to be mistaken for the end.
+        """
+
+        prefix = SERVER_KEY[:-1]
+        parts = []
+
+        while True:
+            index = buf.find(prefix)
+
+            if index == -1:
+                cut = max(len(buf) - len(prefix) + 1, 0)
+                parts.append(buf[:cut])
+                buf = buf[cut:]
+
+            elif len(buf) > index + len(prefix):
+                parts.append(buf[:index + len(prefix)])
+                follower = buf[index + len(prefix)]
+                buf = buf[index + len(prefix) + 1:]
+
+                if follower == SERVER_KEY[-1]:
+                    parts[-1] = parts[-1][:-len(prefix)]
+                    return ''.join(parts), buf
+                elif follower != 'X':
+                    buf = follower + buf
+                continue
+
+            buf += self._recv(connection)
+
+    @staticmethod
+    def _recv(connection):
+        """Reads whatever is available from the server, or raises."""
+
+        chunk = connection.recv(2**16)
+        if not chunk:
+            raise EOFError("Festival server closed the connection")
+        return chunk
@@ -74,6 +74,8 @@ class NeoSpeech(Service):
 
     TRAITS = [Trait.INTERNET]
 
+    CONCURRENCY = 1  # runs are serialized by _lock anyway
+
     def __init__(self, *args, **kwargs):
         self._lock = Lock()
         self._cookies = None
@@ -24,7 +24,7 @@ import re
 from HTMLParser import HTMLParser
 
 from .base import Service
-from .common import Trait
+from .common import NotFound, Trait
 
 __all__ = ['Oxford']
 
@@ -137,7 +137,7 @@ class Oxford(Service):
             html_payload = self.net_stream(dict_url)
         except IOError as io_error:
             if getattr(io_error, 'code', None) == 404:
-                raise IOError(
+                raise NotFound(
                     "The Oxford Dictionary does not recognize this phrase. "
                     "While most single words are recognized, many multi-word "
                     "phrases are not."
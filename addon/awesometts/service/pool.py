@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Keep-alive HTTP connection pool shared by the services
+
+Most services make several short requests to the same host (e.g. one
+per segment of a split phrase), so reusing connections saves a TCP and
+usually a TLS handshake on each of them.
+"""
+
+from base64 import b64encode
+import httplib
+from socket import error as SocketError
+from StringIO import StringIO
+from threading import Condition
+from time import time
+import urllib
+from urllib2 import HTTPError, URLError
+from urlparse import urljoin, urlsplit, urlunsplit
+
+__all__ = ['ConnectionPool']
+
+
+MAX_REDIRECTS = 10  # same as urllib2
+WAIT_SECS = 120  # give up waiting for a free connection to a host after this
+
+
+class ConnectionPool(object):
+    """
+    Opens URLs much like urllib2.urlopen(), but keeps connections open
+    afterward so later requests to the same host (and proxy) can reuse
+    them. To stay polite, only so many connections are ever opened to a
+    single host at once; further requests wait for one to free up (for
+    up to WAIT_SECS, after which a URLError is raised).
+
+    Like urllib2, proxies are taken from the environment (or the system
+    settings on Mac OS X and Windows), redirects are followed, statuses
+    of 400 and up raise an HTTPError, and network errors raise a
+    URLError, so callers can handle failures in the same way.
+    """
+
+    __slots__ = [
+        '_active',        # dict of host keys mapping to connections in use
+        '_bypass',        # dict of hostnames mapping to proxy bypass result
+        '_condition',     # guards the pool, notified as connections free up
+        '_counts',        # dict of counters for connections opened, reused
+        '_idle',          # dict of host keys mapping to (when, connection)s
+        '_idle_timeout',  # seconds after which idle connections are dropped
+        '_per_host',      # how many connections a host may have at once
+        '_proxies',       # dict of schemes to proxy URLs, read on first use
+    ]
+
+    def __init__(self, per_host=4, idle_timeout=30):
+        """
+        Initialize an empty pool.
+        """
+
+        self._active = {}
+        self._bypass = {}
+        self._condition = Condition()
+        self._counts = dict(opened=0, reused=0)
+        self._idle = {}
+        self._idle_timeout = idle_timeout
+        self._per_host = per_host
+        self._proxies = None
+
+    def open(self, url, data=None, headers=None, timeout=None):
+        """
+        Requests the given URL, as a POST if there is data or as a GET
+        otherwise, and returns a response with getcode(), info(), and
+        read() methods like the ones urllib2 returns, plus a `reused`
+        flag. The response must be read in full or closed so that its
+        connection can go back into the pool.
+        """
+
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request(url, data, headers or {}, timeout)
+            code = response.getcode()
+            location = response.info().getheader('location')
+
+            if code in [301, 302, 303, 307] and location:
+                response.read()
+                response.close()
+
+                url = urljoin(url, location)
+                if code != 307:
+                    data = None  # like browsers, switch to GET
+                continue
+
+            if code >= 400:
+                payload = response.read()
+                response.close()
+                raise HTTPError(url, code, response.reason, response.info(),
+                                StringIO(payload))
+
+            return response
+
+        raise HTTPError(url, code, "Too many redirects", response.info(),
+                        StringIO(''))
+
+    def stats(self):
+        """
+        Returns counts of the connections opened and reused so far and
+        of those sitting idle now.
+        """
+
+        with self._condition:
+            return dict(self._counts,
+                        idle=sum(len(idle) for idle in self._idle.values()))
+
+    def close(self):
+        """
+        Closes all of the idle connections.
+        """
+
+        with self._condition:
+            idle = [connection
+                    for connections in self._idle.values()
+                    for _, connection in connections]
+            self._idle = {}
+
+        for connection in idle:
+            connection.close()
+
+    def _request(self, url, data, headers, timeout):
+        """
+        Sends a single request, retrying once on a fresh connection if
+        a reused one turns out to have been closed by the server.
+        """
+
+        scheme, netloc, path, query, _ = urlsplit(url)
+        if scheme not in ['http', 'https']:
+            raise URLError("unknown url type: %s" % scheme)
+
+        host = netloc.rsplit('@', 1)[-1]
+        proxy = self._get_proxy(scheme, host.split(':')[0])
+        key = (scheme, host, proxy)
+
+        headers = dict(headers)
+        headers.setdefault('Host', host)
+        if data is not None:  # as urllib2 does for requests with data
+            headers.setdefault('Content-Type',
+                               'application/x-www-form-urlencoded')
+        if proxy and scheme == 'http':
+            path = urlunsplit((scheme, netloc, path or '/', query, ''))
+            auth = urlsplit(proxy).username and self._get_proxy_auth(proxy)
+            if auth:
+                headers['Proxy-Authorization'] = auth
+        else:
+            path = urlunsplit(('', '', path or '/', query, ''))
+
+        for attempt in range(2):
+            connection, reused = self._acquire(key, timeout, attempt > 0)
+
+            try:
+                if reused and connection.sock:
+                    connection.sock.settimeout(timeout)
+                connection.request('POST' if data is not None else 'GET',
+                                   path, data, headers)
+                response = connection.getresponse()
+
+            except (httplib.HTTPException, SocketError) as error:
+                connection.close()
+                self._release(key, None)
+                if not reused:
+                    raise URLError(error)
+
+            except BaseException:  # e.g. a UnicodeError from the headers
+                connection.close()
+                self._release(key, None)
+                raise
+
+            else:
+                return _Response(self, key, connection, response, reused)
+
+    def _acquire(self, key, timeout, fresh):
+        """
+        Returns a connection for the given host key (and whether it is
+        being reused), waiting if the host is already at its limit.
+        """
+
+        deadline = time() + WAIT_SECS
+
+        with self._condition:
+            while True:
+                idle = self._idle.get(key)
+                expired = time() - self._idle_timeout
+
+                while idle and (fresh or idle[0][0] < expired):
+                    idle.pop(0)[1].close()
+
+                if idle:
+                    connection = idle.pop()[1]
+                    self._counts['reused'] += 1
+                    self._active[key] = self._active.get(key, 0) + 1
+                    break
+
+                if self._active.get(key, 0) < self._per_host:
+                    connection = None
+                    self._counts['opened'] += 1
+                    self._active[key] = self._active.get(key, 0) + 1
+                    break
+
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise URLError("timed out waiting for a connection to %s"
+                                   % key[1])
+                self._condition.wait(remaining)
+
+        if connection:
+            return connection, True
+
+        try:
+            return self._connect(key, timeout), False
+        except BaseException:  # e.g. an InvalidURL for a bad port
+            self._release(key, None)
+            raise
+
+    def _release(self, key, connection):
+        """
+        Returns the connection to the idle pool, unless None was passed
+        because it could not be kept, and wakes up a waiting request.
+        """
+
+        with self._condition:
+            self._active[key] -= 1
+            if connection:
+                self._idle.setdefault(key, []).append((time(), connection))
+            self._condition.notify()
+
+    def _connect(self, key, timeout):
+        """
+        Returns a new, not yet connected connection for the host key.
+        """
+
+        scheme, host, proxy = key
+        connection_class = (httplib.HTTPSConnection if scheme == 'https'
+                            else httplib.HTTPConnection)
+
+        if not proxy:
+            return connection_class(host, timeout=timeout)
+
+        proxy_host = urlsplit(proxy).netloc.rsplit('@', 1)[-1]
+
+        if scheme == 'http':
+            return httplib.HTTPConnection(proxy_host, timeout=timeout)
+
+        connection = connection_class(proxy_host, timeout=timeout)
+        auth = urlsplit(proxy).username and self._get_proxy_auth(proxy)
+        connection.set_tunnel(host, headers={'Proxy-Authorization': auth}
+                              if auth else None)
+        return connection
+
+    def _get_proxy(self, scheme, hostname):
+        """
+        Returns the proxy URL to use for the given scheme and hostname,
+        or None to connect directly.
+        """
+
+        with self._condition:
+            if self._proxies is None:
+                self._proxies = urllib.getproxies()
+            proxy = self._proxies.get(scheme)
+
+            if proxy and hostname not in self._bypass:
+                self._bypass[hostname] = urllib.proxy_bypass(hostname)
+            if not proxy or self._bypass[hostname]:
+                return None
+
+        return proxy if '://' in proxy else 'http://' + proxy
+
+    @staticmethod
+    def _get_proxy_auth(proxy):
+        """Returns a basic Proxy-Authorization header value."""
+
+        parts = urlsplit(proxy)
+        return 'Basic ' + b64encode('%s:%s' % (urllib.unquote(parts.username),
+                                               urllib.unquote(parts.password
+                                                              or '')))
+
+
+class _Response(object):
+    """
+    Wraps an httplib response to look like a urllib2 one, returning
+    its connection to the pool once the payload has been read.
+    """
+
+    __slots__ = [
+        '_connection',  # connection the response arrived on, until released
+        '_key',         # host key of the connection
+        '_pool',        # pool to return the connection to
+        '_response',    # underlying httplib.HTTPResponse
+        'reused',       # True if the connection had been used before
+    ]
+
+    def __init__(self, pool, key, connection, response, reused):
+        """
+        Save the response and where its connection should go.
+        """
+
+        self._connection = connection
+        self._key = key
+        self._pool = pool
+        self._response = response
+        self.reused = reused
+
+    @property
+    def headers(self):
+        """The headers of the response, as with urllib2."""
+
+        return self._response.msg
+
+    @property
+    def reason(self):
+        """The reason phrase of the status line."""
+
+        return self._response.reason
+
+    def getcode(self):
+        """Returns the HTTP status code."""
+
+        return self._response.status
+
+    def info(self):
+        """Returns the headers of the response, as with urllib2."""
+
+        return self._response.msg
+
+    def read(self, amt=None):
+        """
+        Reads (part of) the payload, releasing the connection back into
+        the pool once all of it has been read.
+        """
+
+        try:
+            payload = self._response.read(amt)
+        except (httplib.HTTPException, SocketError):
+            self._discard()
+            raise
+
+        if self._response.isclosed():
+            self.close()
+        return payload
+
+    def close(self):
+        """
+        Releases the connection, keeping it for reuse only if the whole
+        payload was read and the server is willing to keep it open.
+        """
+
+        if not self._connection:
+            return
+
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool._release(self._key,  # pylint:disable=W0212
+                               self._connection)
+            self._connection = None
+        else:
+            self._discard()
+
+    def _discard(self):
+        """Closes the connection rather than returning it for reuse."""
+
+        if self._connection:
+            self._connection.close()
+            self._pool._release(self._key, None)  # pylint:disable=W0212
+            self._connection = None
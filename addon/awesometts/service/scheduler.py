@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Scheduler for the CPU-heavy processes run by the services
+
+Local engines (e.g. eSpeak, Pico2Wave) and the LAME transcoder each
+keep a core busy while they run, so running more of them at once than
+there are cores only makes every one of them slower.
+"""
+
+from collections import deque
+import errno
+import os
+import os.path
+import subprocess
+from threading import Condition, local
+from time import time
+
+__all__ = ['ProcessScheduler']
+
+
+def _get_cpu_count():
+    """Returns the number of cores, or 2 if that cannot be found."""
+
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 2
+
+
+class ProcessScheduler(object):
+    """
+    Holds the number of CPU-heavy processes running at once to a limit
+    (by default, the number of cores), queueing callers beyond it in
+    the order they arrived, and records the wall and CPU time spent in
+    each binary.
+
+    Callers take a slot with a `with` block around the processes that
+    work together on one task (e.g. an engine piped into LAME, which
+    mostly take turns), starting them with popen() and reaping them
+    with wait(). Slots are reentrant, so a thread that already holds
+    one can call e.g. check_call() without taking a second.
+
+    CPU time is read with os.wait4(), which is not available on
+    Windows, so only wall time is recorded there.
+    """
+
+    __slots__ = [
+        '_condition',  # guards the counts and queue, notified upon release
+        '_limit',      # how many slots may be held at once
+        '_local',      # per-thread depth of slots held, for reentrancy
+        '_queue',      # tickets of the threads waiting for a slot, in order
+        '_running',    # how many slots are held now
+        '_started',    # dict of PIDs to their binary name and start time
+        '_totals',     # dict of binary names to their runs, wall, CPU time
+    ]
+
+    def __init__(self, limit=None):
+        """
+        Initialize with no slots held, allowing the given number (or
+        the number of cores) at once.
+        """
+
+        self._condition = Condition()
+        self._limit = limit or _get_cpu_count()
+        self._local = local()
+        self._queue = deque()
+        self._running = 0
+        self._started = {}
+        self._totals = {}
+
+    def __enter__(self):
+        """
+        Takes a slot, waiting behind any callers that asked before if
+        all of them are held, unless this thread already holds one.
+        """
+
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        if depth:
+            return self
+
+        ticket = object()
+
+        with self._condition:
+            self._queue.append(ticket)
+            while self._queue[0] is not ticket or \
+                    self._running >= self._limit:
+                self._condition.wait()
+            self._queue.popleft()
+            self._running += 1
+            self._condition.notify_all()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Gives up the slot once the outermost block has exited.
+        """
+
+        self._local.depth -= 1
+        if self._local.depth:
+            return
+
+        with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
+
+    def popen(self, args, **kwargs):
+        """
+        Starts a process like subprocess.Popen(), noting when it did,
+        so that the caller must reap it with wait() afterward.
+        """
+
+        process = subprocess.Popen(args, **kwargs)
+
+        with self._condition:
+            self._started[process.pid] = (os.path.basename(args[0]), time())
+
+        return process
+
+    def wait(self, process):
+        """
+        Waits for a process from popen() to exit, like its own wait()
+        would, returning its exit status and recording its wall time
+        and (where possible) CPU time.
+        """
+
+        cpu = None
+
+        if hasattr(os, 'wait4') and process.returncode is None:
+            while True:
+                try:
+                    _, status, usage = os.wait4(process.pid, 0)
+                except OSError as error:
+                    if error.errno == errno.EINTR:
+                        continue
+                    process.wait()  # e.g. ECHILD, if already reaped
+                else:
+                    process.returncode = (
+                        -os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                        else os.WEXITSTATUS(status)
+                    )
+                    cpu = usage.ru_utime + usage.ru_stime
+                break
+
+        else:
+            process.wait()
+
+        with self._condition:
+            binary, started = self._started.pop(process.pid, (None, None))
+            if binary:
+                totals = self._totals.setdefault(
+                    binary,
+                    dict(runs=0, wall=0.0, cpu=0.0, timed=0),
+                )
+                totals['runs'] += 1
+                totals['wall'] += time() - started
+                if cpu is not None:
+                    totals['cpu'] += cpu
+                    totals['timed'] += 1
+
+        return process.returncode
+
+    def check_call(self, args, **kwargs):
+        """
+        Like subprocess.check_call(), but in a slot and recorded.
+        """
+
+        with self:
+            returncode = self.wait(self.popen(args, **kwargs))
+
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, args[0])
+
+    def check_output(self, args, **kwargs):
+        """
+        Like subprocess.check_output(), but in a slot and recorded.
+        """
+
+        with self:
+            process = self.popen(args, stdout=subprocess.PIPE, **kwargs)
+            try:
+                output = process.stdout.read()
+            finally:
+                process.stdout.close()
+                returncode = self.wait(process)
+
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, args[0],
+                                                output=output)
+        return output
+
+    def stats(self):
+        """
+        Returns the limit, how many slots are held and how many callers
+        are waiting for one, and the totals for each binary: its runs,
+        wall seconds, and CPU seconds (over the `timed` runs for which
+        CPU time could be read).
+        """
+
+        with self._condition:
+            return dict(
+                limit=self._limit,
+                running=self._running,
+                waiting=len(self._queue),
+                binaries={binary: dict(totals)
+                          for binary, totals in self._totals.items()},
+            )
@@ -18,15 +18,14 @@
 
 """Service implementation for VoiceText's text-to-speech API"""
 
-from anki.utils import isWin as WIN32, isMac as MACOSX
-
 from .base import Service
 from .common import Trait
 
 __all__ = ['VoiceText']
 
 
-API_FORMAT = 'ogg' if WIN32 else 'aac'  # very short AAC files fail on Windows
+# very short AAC files fail on Windows
+API_FORMAT = 'ogg' if Service.IS_WINDOWS else 'aac'
 
 API_REQUIRE = (
     dict(mime='audio/wave', size=2048) if API_FORMAT == 'wav'
@@ -185,7 +184,8 @@ class VoiceText(Service):
                     self.net_download(svc_path, (api_endpoint, parameters),
                                       require=API_REQUIRE, awesome_ua=True)
 
-                    if MACOSX and API_FORMAT == 'aac':  # avoid crashes on OS X
+                    # avoid crashes on OS X
+                    if self.IS_MACOSX and API_FORMAT == 'aac':
                         caf_path = self.path_temp('caf')
                         caf_paths.append(caf_path)
 
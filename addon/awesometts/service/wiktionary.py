@@ -23,7 +23,7 @@ Service implementation for Wiktionary single word pronunciations
 import re
 
 from .base import Service
-from .common import Trait
+from .common import NotFound, Trait
 
 __all__ = ['Wiktionary']
 
@@ -153,7 +153,8 @@ class Wiktionary(Service):
         # for now.
         matcher = re.search("//.*\\.ogg", webpage)
         if not matcher:
-            raise IOError("Wiktionary doesn't have any audio for this input.")
+            raise NotFound("Wiktionary doesn't have any audio for this "
+                           "input.")
         oggurl = "https:" + matcher.group(0)
 
         ogg_path = self.path_temp('ogg')
@@ -29,7 +29,9 @@ import anki
 __all__ = ['RE_CLOZE_BRACED', 'RE_CLOZE_RENDERED', 'RE_ELLIPSES',
            'RE_ELLIPSES_LEADING', 'RE_ELLIPSES_TRAILING', 'RE_FILENAMES',
            'RE_HINT_LINK', 'RE_LINEBREAK_HTML', 'RE_NEWLINEISH', 'RE_SOUNDS',
-           'RE_WHITESPACE', 'STRIP_HTML', 'Sanitizer']
+           'RE_WHITESPACE', 'RULES_FROM_NOTE', 'RULES_FROM_TEMPLATE_BACK',
+           'RULES_FROM_TEMPLATE_FRONT', 'RULES_FROM_UNKNOWN',
+           'RULES_FROM_USER', 'STRIP_HTML', 'Sanitizer']
 
 
 RE_CLOZE_BRACED = re.compile(anki.template.template.clozeReg % r'\d+')
@@ -54,6 +56,99 @@ RE_WHITESPACE = re.compile(r'[\0\s]+', re.UNICODE)
 
 STRIP_HTML = anki.utils.stripHTML  # this also converts character entities
 
+# n.b. cloze substitution logic happens first in both modes because:
+# - we need the <span>...</span> markup in on-the-fly to identify it
+# - Anki won't recognize cloze w/ HTML beginning/ending within braces
+# - the following 'html' rule will cleanse the HTML out anyway
+
+# for content directly from a note field (e.g. BrowserGenerator runs,
+# prepopulating a modal input based on some note field, where cloze
+# placeholders are still in their unprocessed state)
+RULES_FROM_NOTE = [
+    ('clozes_braced', 'sub_note_cloze'),
+    ('newline_ellipsize', 'ellip_note_newlines'),
+    'html',
+    'whitespace',
+    'sounds_univ',
+    'filenames',
+    ('within_parens', 'strip_note_parens'),
+    ('within_brackets', 'strip_note_brackets'),
+    ('within_braces', 'strip_note_braces'),
+    ('char_remove', 'spec_note_strip'),
+    ('counter', 'spec_note_count', 'spec_note_count_wrap'),
+    ('char_ellipsize', 'spec_note_ellipsize'),
+    ('custom_sub', 'sul_note'),
+    'ellipses',
+    'whitespace',
+]
+
+RULES_TEMPLATE_POSTHTML = [
+    'whitespace',
+    'sounds_univ',
+    'filenames',
+    ('within_parens', 'strip_template_parens'),
+    ('within_brackets', 'strip_template_brackets'),
+    ('within_braces', 'strip_template_braces'),
+    ('char_remove', 'spec_template_strip'),
+    ('counter', 'spec_template_count', 'spec_template_count_wrap'),
+    ('char_ellipsize', 'spec_template_ellipsize'),
+    ('custom_sub', 'sul_template'),
+    'ellipses',
+    'whitespace',
+]
+
+# for cleaning up already-processed HTML templates (e.g. on-the-fly,
+# where cloze is marked with <span class=cloze></span> tags)
+RULES_FROM_TEMPLATE_FRONT = [
+    ('clozes_rendered', 'sub_template_cloze'),
+    'hint_links',
+    ('hint_content', 'otf_remove_hints'),
+    ('newline_ellipsize', 'ellip_template_newlines'),
+    'html',
+] + RULES_TEMPLATE_POSTHTML
+
+# like the previous, but for the back sides of cards
+RULES_FROM_TEMPLATE_BACK = [
+    ('clozes_revealed', 'otf_only_revealed_cloze'),
+    'hint_links',
+    ('hint_content', 'otf_remove_hints'),
+    ('newline_ellipsize', 'ellip_template_newlines'),
+    'html',
+] + RULES_TEMPLATE_POSTHTML
+
+# for cleaning up text from unknown sources (e.g. system clipboard);
+# n.b. clozes_revealed is not used here without the card context and
+# it would be a weird thing to apply to the clipboard content anyway
+RULES_FROM_UNKNOWN = [
+    ('clozes_braced', 'sub_note_cloze'),
+    ('clozes_rendered', 'sub_template_cloze'),
+    'hint_links',
+    ('hint_content', 'otf_remove_hints'),
+    ('newline_ellipsize', 'ellip_note_newlines'),
+    ('newline_ellipsize', 'ellip_template_newlines'),
+    'html',
+    'html',  # clipboards often have escaped HTML, so we run twice
+    'whitespace',
+    'sounds_univ',
+    'filenames',
+    ('within_parens', ['strip_note_parens', 'strip_template_parens']),
+    ('within_brackets', ['strip_note_brackets', 'strip_template_brackets']),
+    ('within_braces', ['strip_note_braces', 'strip_template_braces']),
+    ('char_remove', 'spec_note_strip'),
+    ('char_remove', 'spec_template_strip'),
+    ('counter', 'spec_note_count', 'spec_note_count_wrap'),
+    ('counter', 'spec_template_count', 'spec_template_count_wrap'),
+    ('char_ellipsize', 'spec_note_ellipsize'),
+    ('char_ellipsize', 'spec_template_ellipsize'),
+    ('custom_sub', 'sul_note'),
+    ('custom_sub', 'sul_template'),
+    'ellipses',
+    'whitespace',
+]
+
+# for direct user input (e.g. previews, EditorGenerator insertion)
+RULES_FROM_USER = ['ellipses', 'whitespace']
+
 
 class Sanitizer(object):  # call only, pylint:disable=too-few-public-methods
     """Once instantiated, provides a callable to sanitize text."""
@@ -0,0 +1,38 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generates clips for every row of a CSV/TSV file without running Anki
+
+    $ PYTHONPATH=~/src/anki addon/tools/batch.py words.tsv -s google
+    $ addon/tools/batch.py --help
+
+See awesometts/batch.py for the input and manifest formats.
+"""
+
+import sys
+
+from bootstrap import bootstrap
+
+
+if __name__ == '__main__':
+    bootstrap()
+
+    from awesometts.batch import main
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Makes the awesometts package importable by the command-line tools
+
+The package's own initialization sets up the add-on inside of Anki's
+GUI, so it is bypassed here; only the modules that the tools import
+(e.g. awesometts.headless) are loaded. Anki's source tree must be on
+PYTHONPATH (or installed) for its `anki` package and BeautifulSoup.
+"""
+
+import imp
+import os.path
+import sys
+
+__all__ = ['bootstrap']
+
+
+ADDON = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bootstrap():
+    """
+    Registers an empty awesometts package pointed at the add-on code,
+    exiting with a message if Anki's libraries cannot be found.
+    """
+
+    try:
+        import anki  # noqa, pylint:disable=unused-variable
+    except ImportError:
+        sys.stderr.write(
+            "The `anki` package could not be imported. Please add Anki's "
+            "source directory\n(e.g. a checkout of "
+            "https://github.com/dae/anki) to your PYTHONPATH.\n"
+        )
+        sys.exit(1)
+
+    package = imp.new_module('awesometts')
+    package.__path__ = [os.path.join(ADDON, 'awesometts')]
+    sys.modules['awesometts'] = package
@@ -0,0 +1,38 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# AwesomeTTS text-to-speech add-on for Anki
+# Copyright (C) 2010-Present  Anki AwesomeTTS Development Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Serves clips over HTTP from the add-on's router and cache without Anki
+
+    $ PYTHONPATH=~/src/anki addon/tools/serve.py --port 8015
+    $ addon/tools/serve.py --help
+
+See awesometts/server.py for the endpoints.
+"""
+
+import sys
+
+from bootstrap import bootstrap
+
+
+if __name__ == '__main__':
+    bootstrap()
+
+    from awesometts.server import main
+    sys.exit(main(sys.argv[1:]))